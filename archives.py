@@ -0,0 +1,244 @@
+"""
+Functions for reading log files straight out of the zip, tar and gzip
+archives that log folders are shipped in, without extracting them first.
+
+A log file inside an archive is named by the path to the archive followed
+by the name of the file inside it, as with zipimport, i.e.,
+
+YL_DATA/peru.zip/PE211005_IIN028_task1_5-15-2013-16-13-32.csv
+
+so the rest of the code can treat it like any other log file: its name
+is still read with DataFile.parse_file_name, and it goes in the manifest
+under that path.  A gzipped log file, PE211005_..._5-15-2013-16-13-32.csv.gz,
+holds a single log file named without the .gz.
+
+Tar archives, compressed or not, can only be read efficiently from start
+to finish, so read_members reads a batch of files out of each archive in a
+single pass; use reading_order to put the files in the order they are
+stored in.
+"""
+
+import gzip
+import os
+import tarfile
+import time
+import zipfile
+import zlib
+from itertools import groupby
+
+# File name endings of the archives that can be read, in lower case
+ZIP_EXTENSIONS = ('.zip',)
+TAR_EXTENSIONS = ('.tar', '.tar.gz', '.tgz', '.tar.bz2', '.tbz2')
+GZIP_EXTENSIONS = ('.gz',)
+ARCHIVE_EXTENSIONS = ZIP_EXTENSIONS + TAR_EXTENSIONS + GZIP_EXTENSIONS
+
+# The errors that can come up while reading a damaged or truncated archive
+ARCHIVE_ERRORS = (EnvironmentError, EOFError, KeyError, tarfile.TarError, zipfile.BadZipfile, zlib.error)
+
+# The contents of each archive listed so far, by path: ((size, mtime) of the archive,
+# [(name, size, mtime), ...] for each file in it, in the order stored, {name: position})
+_listings = {}
+
+
+def archive_kind(path):
+    """
+    Returns 'zip', 'tar' or 'gzip' for the path to an archive, judging by its name, or None.
+    """
+    name = path.lower()
+    if name.endswith(ZIP_EXTENSIONS):
+        return 'zip'
+    if name.endswith(TAR_EXTENSIONS):
+        return 'tar'
+    if name.endswith(GZIP_EXTENSIONS):
+        return 'gzip'
+    return None
+
+
+def is_archive(path):
+    return archive_kind(path) is not None and os.path.isfile(path)
+
+
+def member_path(archive, name):
+    """
+    Returns the path used for the file with the given name inside archive.
+    """
+    return archive + os.sep + name
+
+
+def split_path(log_file):
+    """
+    Splits the path to a log file inside an archive (see member_path) into the path to
+    the archive and the name of the file inside it.
+
+    :return: a tuple, (archive, name), or (None, None) if log_file isn't inside an archive
+    """
+    start = 0
+    while True:
+        i = log_file.find(os.sep, start)
+        if i < 0:
+            return None, None
+        if archive_kind(log_file[:i]) is not None and os.path.isfile(log_file[:i]):
+            return log_file[:i], log_file[i + 1:]
+        start = i + 1
+
+
+def list_members(archive):
+    """
+    Returns a list of (name, size, mtime) tuples, one for each file (not folder) in
+    archive, in the order they are stored.  Listings are kept until the archive changes,
+    since listing a compressed tar archive means reading all of it.
+    """
+    stat = os.stat(archive)
+    signature = (stat.st_size, stat.st_mtime)
+    if archive in _listings and _listings[archive][0] == signature:
+        return _listings[archive][1]
+
+    kind = archive_kind(archive)
+    if kind == 'zip':
+        with zipfile.ZipFile(archive) as zip_file:
+            members = [(info.filename, info.file_size, time.mktime(info.date_time + (0, 0, -1)))
+                       for info in zip_file.infolist() if not info.filename.endswith('/')]
+    elif kind == 'tar':
+        with tarfile.open(archive) as tar_file:
+            members = [(info.name, info.size, info.mtime) for info in tar_file if info.isfile()]
+    else:
+        members = [(os.path.basename(archive)[:-len('.gz')], stat.st_size, stat.st_mtime)]
+
+    _listings[archive] = (signature, members, dict((name, i) for i, (name, size, mtime) in enumerate(members)))
+    return members
+
+
+def list_paths(archive):
+    """
+    Returns the paths (see member_path) of the files in archive, in the order they are stored.
+    """
+    return [member_path(archive, name) for name, size, mtime in list_members(archive)]
+
+
+def file_signature(log_file):
+    """
+    Returns (size, mtime) for a log file, whether it's inside an archive or not.
+    """
+    archive, name = split_path(log_file)
+    if archive is None:
+        stat = os.stat(log_file)
+        return stat.st_size, stat.st_mtime
+
+    list_members(archive)
+    signature, members, positions = _listings[archive]
+    if name not in positions:
+        raise IOError("No file named %s in %s" % (name, archive))
+    return members[positions[name]][1:]
+
+
+def read_member(log_file):
+    """
+    Reads one log file out of an archive.  To read many files out of the same
+    archive, read_members is much quicker.
+
+    :return: the contents of the file, as a string
+    """
+    archive, name = split_path(log_file)
+    kind = archive_kind(archive)
+    if kind == 'zip':
+        with zipfile.ZipFile(archive) as zip_file:
+            return zip_file.read(name)
+    elif kind == 'tar':
+        with tarfile.open(archive) as tar_file:
+            return tar_file.extractfile(name).read()
+    else:
+        in_file = gzip.open(archive, "rb")
+        try:
+            return in_file.read()
+        finally:
+            in_file.close()
+
+
+def read_members(log_files):
+    """
+    Reads log files out of their archives, reading each run of files from the same
+    archive in a single pass if they are in the order they are stored (see reading_order).
+
+    :param log_files: a list of paths to log files inside archives
+    :return: an iterator over (log_file, contents, error) tuples (see ingest.read_log_file),
+             in the same order as log_files
+    """
+    for archive, files in groupby(log_files, lambda log_file: split_path(log_file)[0]):
+        files = list(files)
+        if archive_kind(archive) == 'tar':
+            reads = read_tar_members(archive, files)
+        else:
+            reads = read_each_member(files)
+        for read in reads:
+            yield read
+
+
+def read_each_member(log_files):
+    for log_file in log_files:
+        try:
+            yield log_file, read_member(log_file), None
+        except ARCHIVE_ERRORS as err:
+            yield log_file, None, str(err)
+
+
+def read_tar_members(archive, log_files):
+    """
+    Reads log files out of a single tar archive in one pass, holding on to a file
+    only if it comes up before the files ahead of it in log_files.
+    """
+    wanted = set(split_path(log_file)[1] for log_file in log_files)
+    ready = {}
+    try:
+        tar_file = tarfile.open(archive, "r|*")
+    except ARCHIVE_ERRORS as err:
+        for log_file in log_files:
+            yield log_file, None, str(err)
+        return
+
+    try:
+        members = iter(tar_file)
+        error = None
+        for log_file in log_files:
+            name = split_path(log_file)[1]
+            while name not in ready and error is None:
+                try:
+                    info = next(members, None)
+                    if info is None:
+                        error = "No file named %s in %s" % (name, archive)
+                    elif info.isfile() and info.name in wanted:
+                        wanted.discard(info.name)
+                        ready[info.name] = tar_file.extractfile(info).read()
+                except ARCHIVE_ERRORS as err:
+                    error = str(err)
+
+            if name in ready:
+                yield log_file, ready.pop(name), None
+            else:
+                yield log_file, None, error
+                if error.startswith("No file named"):
+                    error = None  # Later files may have been read already
+    finally:
+        tar_file.close()
+
+
+def reading_order(log_files):
+    """
+    Puts log files in the order in which they can be read most quickly: files that
+    aren't in archives first, in their original order, and then the files in each
+    archive, in the order they are stored.
+    """
+    plain = []
+    archived = {}
+    for log_file in log_files:
+        archive, name = split_path(log_file)
+        if archive is None:
+            plain.append(log_file)
+        else:
+            archived.setdefault(archive, []).append(log_file)
+
+    for archive in sorted(archived):
+        list_members(archive)
+        positions = _listings[archive][2]
+        archived[archive].sort(key=lambda log_file: positions.get(split_path(log_file)[1], -1))
+        plain.extend(archived[archive])
+    return plain
@@ -0,0 +1,310 @@
+"""
+A script for measuring how quickly log files are parsed, summarized,
+stored and exported.  It writes a folder of synthetic log files for
+all six tasks (in the same formats as the files from the tablets),
+runs each stage of the pipeline over them, and reports files/sec,
+rows/sec and peak memory for each stage.  Example usage:
+
+>$ python benchmark.py --subjects 200 --trials 12
+Writing synthetic log files for 200 subjects to /tmp/tmpXyz...
+stage          files  seconds   files/sec    rows/sec  peak MB
+parse           1200    0.270      4440.2     63738.4     19.1
+summarize       1200    0.032     37411.0    537035.0     20.4
+database        1200    0.111     10827.2    155424.5     23.8
+export          1200    0.089     13510.8    193947.0     23.8
+
+--trials sets the number of trials per task (blocks for task4 and task5
+are fixed), so the per-row cost can be compared at different file sizes.
+--scaling parses a single file of each task at increasing trial counts and
+reports the time per trial, which should stay flat as the count grows.
+
+Peak memory is the peak resident set size of the process so far, so it
+only ever goes up from one stage to the next.
+"""
+
+import argparse
+import os
+import random
+import resource
+import shutil
+import StringIO
+import sys
+import tempfile
+import time
+
+import data_classes as dat
+import database
+import export
+import parser_functions
+
+TASKS = ['task1', 'task2', 'task3', 'task4', 'task5', 'task6']
+
+
+def write_touch_task(out, rng, n_trials, header_lines):
+    """
+    Writes a task1 or task6 log file.  Each trial spans one to four lines, of which only
+    the first is used.  Columns 1, 6 and 7 hold TrialNum, NumBadTouches and Score.
+    """
+    out.write("Metadata\n" * header_lines)
+    for section, trials in (("Practice", 2), ("Task", n_trials)):
+        out.write("%s,TrialNum,TargetX,TargetY,TouchX,TouchY,NumBadTouches,Score\n" % section)
+        for trial in range(1, trials + 1):
+            for line in range(rng.randint(1, 4)):
+                out.write(",%d,%d,%d,%d,%d,%d,%d\n" % (trial, rng.randint(0, 1024), rng.randint(0, 768),
+                                                       rng.randint(0, 1024), rng.randint(0, 768),
+                                                       rng.randint(0, 3), rng.randint(0, 5)))
+
+
+def write_task2(out, rng, n_trials):
+    """
+    Writes a task2 log file: practice lines, a "Task" line, then one line per trial.
+    """
+    def trial_line(trial):
+        return ",%d,%s,%s,%.6f,(%.1f;%.1f),%.5f,%s,%d\n" % (
+            trial, rng.choice(["same", "opposite"]), rng.choice(["False", "False", "True"]), rng.uniform(0.2, 1.5),
+            rng.uniform(0, 1024), rng.uniform(0, 768), rng.uniform(0, 60), rng.choice(["left", "right"]),
+            rng.randint(0, 1))
+
+    out.write("Metadata\n" * 3)
+    for trial in range(1, 5):
+        out.write(trial_line(trial))
+    out.write("Task,TrialNum,TargetSide,TimeOut,ReactionTime,TouchPosition,DistanceFromCenter,PressedSide,Correct\n")
+    for trial in range(1, n_trials + 1):
+        out.write(trial_line(trial))
+
+
+def write_task3(out, rng, n_trials):
+    """
+    Writes a task3 log file, with one line for each of the one to three dots in a trial.
+    """
+    def dot_lines(trial):
+        num_dots = rng.randint(1, 3)
+        delay = rng.choice(["0.1", "3"])
+        return "".join(",%d,%d,%d,%s,False,False,%d,%.6f,(%.1f;%.1f),%s\n" % (
+            trial, num_dots, rng.randint(3, 6), delay, rng.randint(1, 6), rng.uniform(0.2, 2.0), rng.uniform(0, 1024),
+            rng.uniform(0, 768), rng.choice(["%.5f" % rng.uniform(0, 60)] * 8 + [".", "0"]))
+            for dot in range(num_dots))
+
+    out.write("Metadata\n" * 2)
+    for trial in range(1, 3):
+        out.write(dot_lines(trial))
+    out.write("Task,TrialNum,NumDots,ShownDots,Delay,TimeOut,EarlyResponse,DotPressed,ReactionTime,TouchPosition,"
+              "DistanceFromCenter\n")
+    for trial in range(1, n_trials + 1):
+        out.write(dot_lines(trial))
+
+
+def write_task4(out, rng, n_trials):
+    """
+    Writes a task4 log file: practice trials, then five blocks of trials, each
+    followed by a "Block N Calculations" line.
+    """
+    def trial_line(trial):
+        return ",%d,%s,%.4f,(%.1f;%.1f),%.3f\n" % (trial, rng.choice(["true", "false"]), rng.uniform(0.2, 1.5),
+                                                   rng.uniform(0, 1024), rng.uniform(0, 768), rng.uniform(0, 60))
+
+    out.write("Metadata\n" * 2)
+    for trial in range(1, 4):
+        out.write(trial_line(trial))
+    for block in range(1, 6):
+        for trial in range(1, max(n_trials // 5, 1) + 1):
+            out.write(trial_line(trial))
+        out.write("Block %d Calculations,PercentCorrect,%.2f%%,AvgDistanceFromCenter,%.5f,AvgResponseTime,%.6f\n" % (
+            block, rng.uniform(50, 100), rng.uniform(0, 60), rng.uniform(0.2, 1.5)))
+
+
+def write_task5(out, rng, n_trials):
+    """
+    Writes a task5 log file: one "Practice 1" line and three "Task N" lines of
+    alternating names and values.
+    """
+    def task_line(name):
+        return ("%s,EndCondition,%s,Duration,%.5f,NumGoodTouches,%d,NumBadTouches,%d,NumRepeats,%d,"
+                "AvgTimePerTarget,%.6f,StandardDeviation,%.5f,AvgTimePerAction,%.6f,AvgTargetsPerArea,(%s),"
+                "AvgLocation,%.4f,AvgFirstTen,%.6f,AvgLastTen,%.4f,AvgDistancePerTarget,%.4f\n") % (
+            name, rng.choice(["completed", "timeout"]), rng.uniform(5, 30), rng.randint(10, 40), rng.randint(0, 5),
+            rng.randint(0, 3), rng.uniform(0.2, 1), rng.uniform(0, 20), rng.uniform(0.2, 1),
+            ";".join(str(rng.randint(0, 8)) for area in range(8)), rng.uniform(0, 1000), rng.uniform(0.2, 1),
+            rng.uniform(0.2, 1), rng.uniform(50, 250))
+
+    out.write("Metadata\n" * 2)
+    out.write(task_line("Practice 1"))
+    for task in range(1, 4):
+        out.write(task_line("Task %d" % task))
+
+
+def write_log_file(task, out, rng, n_trials):
+    """
+    Writes a synthetic log file for the given task to the open file, out.
+
+    :param task: one of 'task1', 'task2', ..., 'task6'
+    :param out: an open file (or file-like) object
+    :param rng: a random.Random instance
+    :param n_trials: the number of task trials to write (task5 always has three)
+    """
+    if task == 'task1':
+        write_touch_task(out, rng, n_trials, 3)
+    elif task == 'task2':
+        write_task2(out, rng, n_trials)
+    elif task == 'task3':
+        write_task3(out, rng, n_trials)
+    elif task == 'task4':
+        write_task4(out, rng, n_trials)
+    elif task == 'task5':
+        write_task5(out, rng, n_trials)
+    elif task == 'task6':
+        write_touch_task(out, rng, n_trials, 2)
+
+
+def write_log_folder(folder, n_subjects, n_trials, seed=0):
+    """
+    Writes a log file for each of the six tasks for n_subjects made-up subjects to folder,
+    named the way the tablets name them, i.e., 'PE211005_IIN028_task1_5-15-2013-16-13-32.csv'
+
+    :return: a sorted list of the paths to the new files
+    """
+    rng = random.Random(seed)
+    log_files = []
+
+    for i in range(n_subjects):
+        subject = "PE%s%02d%04d" % ("s" if i % 10 == 9 else "", 11 + i % 4 * 10, 1000 + i)
+        device = "IIN%03d" % (i % 40)
+        for task in TASKS:
+            name = "%s_%s_%s_%d-%d-2013-%d-%d-%d.csv" % (subject, device, task, 1 + i % 12, 1 + i % 28, 8 + i % 10,
+                                                         i % 60, rng.randint(0, 59))
+            log_files.append(os.path.join(folder, name))
+            with open(log_files[-1], "w") as out:
+                write_log_file(task, out, rng, n_trials)
+
+    return sorted(log_files)
+
+
+def peak_memory():
+    """
+    Returns the peak resident set size of this process so far, in MB.
+    """
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, OS X reports bytes
+    return peak / (1024.0 * 1024.0) if sys.platform == "darwin" else peak / 1024.0
+
+
+def count_rows(data_file):
+    return len(data_file.trial_by_trial) + len(data_file.practice)
+
+
+def run_stages(log_files, out_dir):
+    """
+    Runs each stage of the pipeline over every file in log_files, timing each one.
+
+    :return: a list of (stage, files, rows, seconds, peak memory) tuples
+    """
+    results = []
+
+    # Parse: read each file into a DataFile, as DataFile.__init__ does, but stop short of summarizing
+    data_files = []
+    start = time.time()
+    for log_file in log_files:
+        with open(log_file, "rU") as in_file:
+            data_file = dat.DataFile()
+            data_file.log_file = in_file
+            data_file.filename = os.path.basename(log_file)
+            data_file.parse_file_name(data_file.filename)
+            data_file.set_task_headers()
+            data_file.set_practice_headers()
+            data_file.parse_file_data()
+            del data_file.log_file
+        data_files.append(data_file)
+    rows = sum(count_rows(data_file) for data_file in data_files)
+    results.append(('parse', len(data_files), rows, time.time() - start, peak_memory()))
+
+    start = time.time()
+    for data_file in data_files:
+        data_file.summarize()
+    results.append(('summarize', len(data_files), rows, time.time() - start, peak_memory()))
+
+    subjects = {}
+    for data_file in data_files:
+        if data_file.key not in subjects:
+            subjects[data_file.key] = dat.Subject(data_file.ID, data_file.group, data_file.sibling, data_file.key)
+        subjects[data_file.key].add_data(data_file.task, data_file)
+
+    start = time.time()
+    db = database.Database(os.path.join(out_dir, "benchmark.sqlite"))
+    for key in subjects:
+        db.put_subject(subjects[key])
+    db.close()
+    results.append(('database', len(data_files), rows, time.time() - start, peak_memory()))
+
+    start = time.time()
+    export.write_summaries(subjects.values(), os.path.join(out_dir, "summary.csv"), overwrite=True)
+    with export.TrialFileWriter(out_dir, overwrite=True) as writer:
+        for key in subjects:
+            writer.write_subject(subjects[key])
+    results.append(('export', len(data_files), rows, time.time() - start, peak_memory()))
+
+    return results
+
+
+def run_scaling(trial_counts, seed=0):
+    """
+    Parses one in-memory log file of each task at each of the given trial counts.
+
+    :return: a list of (task, trials, microseconds per trial) tuples
+    """
+    results = []
+    for task in TASKS:
+        if task in ('task4', 'task5'):  # Fixed numbers of blocks, nothing to scale
+            continue
+        headers = dat.DataFile()
+        headers.task = task
+        headers.set_task_headers()
+        headers.set_practice_headers()
+        for n_trials in trial_counts:
+            log_file = StringIO.StringIO()
+            write_log_file(task, log_file, random.Random(seed), n_trials)
+            start = time.time()
+            parser_functions.read_log_file(task, StringIO.StringIO(log_file.getvalue()), headers.task_headers,
+                                           headers.practice_headers)
+            results.append((task, n_trials, (time.time() - start) / n_trials * 1e6))
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark YL log file processing on synthetic data.")
+    parser.add_argument("--subjects", type=int, default=100, help="number of subjects (six files each)")
+    parser.add_argument("--trials", type=int, default=12, help="trials per task file")
+    parser.add_argument("--seed", type=int, default=0, help="random seed for the synthetic data")
+    parser.add_argument("--folder", help="where to write the synthetic files (default: a temporary folder that "
+                                         "is deleted afterwards)")
+    parser.add_argument("--scaling", action="store_true",
+                        help="report parse time per trial for growing files instead")
+    args = parser.parse_args(argv)
+
+    if args.scaling:
+        print "%-6s %8s %12s" % ("task", "trials", "us/trial")
+        for task, n_trials, per_trial in run_scaling([args.trials * 2 ** i for i in range(6)], args.seed):
+            print "%-6s %8d %12.1f" % (task, n_trials, per_trial)
+        return
+
+    folder = args.folder or tempfile.mkdtemp()
+    if not os.path.isdir(folder):
+        os.makedirs(folder)
+    out_dir = tempfile.mkdtemp()
+
+    try:
+        print "Writing synthetic log files for %d subjects to %s..." % (args.subjects, folder)
+        log_files = write_log_folder(folder, args.subjects, args.trials, args.seed)
+
+        print "%-10s %9s %8s %11s %11s %8s" % ("stage", "files", "seconds", "files/sec", "rows/sec", "peak MB")
+        for stage, files, rows, seconds, memory in run_stages(log_files, out_dir):
+            seconds = max(seconds, 1e-9)
+            print "%-10s %9d %8.3f %11.1f %11.1f %8.1f" % (stage, files, seconds, files / seconds, rows / seconds,
+                                                          memory)
+    finally:
+        shutil.rmtree(out_dir)
+        if not args.folder:
+            shutil.rmtree(folder)
+
+
+if __name__ == "__main__":
+    main()
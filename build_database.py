@@ -1,17 +1,28 @@
 """
 A script to iterate over log files, add them to database, and
-then write the summary data to a file. Example usage:
+then write the summary data to a file.  When run without arguments, it
+asks for everything it needs.  Example usage:
 
 >$ python build_database.py
 Please type the path to your log files folder: YL_DATA_PERU
 Please enter the path to your summary data spreadsheet:summary.csv
 Overwrite existing summary file (y/n): y
+Number of worker processes to use [4]: 
+Write out each log file as soon as it is parsed, to save memory (y/n) [n]: 
 Log files to process: 1237
 
 
 All Done!
 
 
+Everything can also be given on the command line, so that runs can be scheduled
+(i.e., from cron) without anyone at the keyboard:
+
+>$ python build_database.py YL_DATA_PERU YL_DATA_CHILE --summary-file summary.csv --append --workers 8
+
+Run python build_database.py --help for all of the options.  Anything that is needed but not
+given on the command line is asked for, as above.  The same run can be started from Python
+with build(), i.e., build(['YL_DATA_PERU'], 'summary.csv', overwrite=False).
 
 The log folder specified should contain the .csv log files output
 from the YL tablet games and ideally only those files.  All files
@@ -29,167 +40,928 @@ In addition to writing to the
 comma-separated summary file specified by the user (summary.csv above), this script
 also automatically saves 6 task-specific files, each of which contains all trial data
 from all subjects for its respective task, to the working directory (the same one in
-which this script resides).  In addition, subject data are saved to a shelve database,
-which contains all info about the subject.
+which this script resides).  In addition, subject data are saved to an SQLite database,
+YL_DATABASE.sqlite (see database.py), which contains all info about the subject.
+
+When the overwrite option is not chosen, only log files that are new, or whose contents
+have changed since the last run, are parsed (see manifest.py).  Data from a changed file
+replace the data previously stored for that subject and task.
 
 When the overwrite option is chosen, the summary file, all the task files, and the
-shelve database are overwritten as well.  Before choosing to overwrite, you should ensure
+database are overwritten as well.  Before choosing to overwrite, you should ensure
 that you have access to all of the log files that have been processed previously (except, of course,
 those that you don't want to keep), or the information in those files will be lost.
+To just get a fresh summary file and task files, there's no need to overwrite: --export
+rewrites them straight from the database without reading any log files, optionally for
+only some of the subjects (see export_database()).
+
+Normally, all of the trial data are held in memory until the end of the run.  If memory is
+tight, answer 'y' when asked whether to write out each log file as soon as it is parsed:
+each file's trial data then go straight to the database and the task files and are
+dropped from memory, and each subject's summary is written to the summary file and
+dropped, too, once all of their log files have been parsed.
+
+After every thousand log files (see --checkpoint-every), everything parsed so far is committed
+to the database and the task files and a checkpoint is saved (see checkpoint.py).  If a run is
+interrupted, python build_database.py --resume finishes it without parsing those files again.
+
+Log files are parsed in parallel by a pool of worker processes.  By default one worker
+is started per CPU; enter a different number at the prompt to change this (1 parses
+everything in a single process).
+
+At the end of each run, a report of how long each stage took (listing the files, parsing,
+summarizing, writing the database and the output files), with times, file counts and bytes read
+per task and a list of the slowest files, is written to RUN_REPORT.json (see instrumentation.py).
+To also save cProfile statistics, use --profile.
+
+The log folders are scanned and every file name is checked before any file is opened; files
+with names that don't follow the naming convention are reported and skipped.  Install the
+scandir package to list very large folders faster.  Zip, tar and gzip archives of log files,
+in the log folders or given in place of a folder, are read without being extracted (see archives.py).
 
 If a single subject has multiple log files for the same task, a warning will be printed to the
-screen, and the second such log file encountered by the program will be the one that is used.
+screen, and only the last such log file, in alphabetical order, will be parsed and used, so the
+same file wins on every run.
 In such cases, the user should manually inspect the files to determine which one should be kept.  The
 file that is not kept should then be removed from the log files directory and this script should be re-run
 in overwrite mode.
 
 """
 
+import argparse
+import multiprocessing
 import os
-import shelve
-import cPickle as pickle
+import re
+import signal
+import time
 
+import archives
+import checkpoint
+import columnar
 import data_classes as dat
-import exception_classes as e
-
-# Initialize default values
-
-log_folder = ""
-summary_file = ""
-overwrite_summary = True
-overwrite_task = True
-shelve_database = "YL_DATABASE"  # Automatically store the shelve DB in current directory
-subjects = {}  # This will store subject data to be added to shelve DB
-seen_file_store = "PROCESSED_FILES.pck"  # To keep track of files already processed
-
-# Get User Input
-
-# Prompt the user for the path to their log files folder.
-# The user will be continually prompted until they give a path to
-# an existing folder.
-while not os.path.isdir(log_folder):
-    log_folder = raw_input("Please type the path to your log files folder: ")
-
-# Get user input for summary file
-summary_file = raw_input("Please enter the path to your summary data spreadsheet:")
-
-# Make sure they haven't just given you a directory
-while os.path.isdir(summary_file):
-    summary_file = raw_input("%s is a directory.  Please enter a valid file name: " % summary_file)
-
-# If the named output file already exists, see if the user wishes to overwrite the file
-if os.path.isfile(summary_file):
-    w = ""
-    while w not in ['y', 'n']:
-        w = raw_input("Overwrite existing summary file (y/n): ")
-    if w == "y":
-        overwrite_summary = True
-        overwrite_task = True
-    else:
-        overwrite_summary = False
-        overwrite_task = False
-
-# Load a pickled list of already seen files
-if overwrite_summary is False and os.path.isfile(seen_file_store):
-    with open(seen_file_store, "rb") as f:
-        already_seen = pickle.load(f)
-else:
-    already_seen = set()
-
-# Make a list of files not already seen
-new_files = set(f for f in os.listdir(log_folder)).difference(already_seen)
-
-# Tell the user how many files have already been processed
-if not overwrite_summary:
-    print "Number of previously processed log files to date: %d" % len(already_seen)
-print "Log files to process: %d" % len(new_files)
-
-
-# Iterate over all the files
-for log_file in [os.path.join(log_folder, f) for f in new_files]:
-
+import database
+import export
+import ingest
+import instrumentation
+import manifest
+import watcher
+
+# Default values
+
+DATABASE_FILE = "YL_DATABASE.sqlite"  # Automatically store the database in current directory
+SEEN_FILE_STORE = "PROCESSED_FILES.pck"  # Manifest of files already processed (see manifest.py)
+REPORT_FILE = "RUN_REPORT.json"  # Where to write the timing report for the run (see instrumentation.py)
+CHECKPOINT_FILE = "BUILD_CHECKPOINT.json"  # Where to save checkpoints during the run (see checkpoint.py)
+CHECKPOINT_EVERY = 1000  # How many log files to parse between checkpoints
+
+
+def build(log_folders, summary_file, overwrite=True, n_workers=None, stream_files=False,
+          database_file=DATABASE_FILE, seen_file_store=SEEN_FILE_STORE, task_dir="",
+          report_file=REPORT_FILE, profile_file=None, shard=None, n_shards=1, shard_by='key', prefetch=0,
+          columnar_files=False, compress=False, checkpoint_every=CHECKPOINT_EVERY,
+          checkpoint_file=CHECKPOINT_FILE, resume=False, rewrite_outputs=False):
+    """
+    Parses the log files in the given folders, adds them to the database, and writes
+    the summary file and the task files.
+
+    Every checkpoint_every log files, the data parsed so far are committed to the database
+    and written to the task files, the manifest is saved, and a checkpoint is saved to
+    checkpoint_file (see checkpoint.py), so that if the run is interrupted, resume() can
+    finish it without parsing those files again.
+
+    :param log_folders: a list of paths to folders of log files
+    :param summary_file: path to the summary file.  If None, neither the summary file nor
+                         the task files are written (i.e., for a sharded run, whose database
+                         is merged with the others' and exported by merge()).
+    :param overwrite: if True, the summary file, the task files, the database and the manifest
+                      are started over.  Otherwise only new or changed log files are parsed
+                      and their data are added to the existing outputs.
+    :param n_workers: the number of processes used to parse log files.  By default, one per CPU.
+    :param stream_files: if True, write each log file's data out as soon as it is parsed, and each
+                         subject's summary once their last log file has been, to save memory
+    :param database_file: path to the SQLite database
+    :param seen_file_store: path to the manifest of files already processed
+    :param task_dir: the folder in which to write the task files
+    :param report_file: where to write the timing report for the run
+    :param profile_file: if given, cProfile statistics for the run are saved to this file
+    :param shard: if given, only the log files in this shard, from 0 to n_shards - 1, are
+                  parsed (see ingest.select_shard)
+    :param n_shards: the number of shards the log files are split into
+    :param shard_by: what the log files are split by: 'key', 'group' or 'prefix'
+    :param prefetch: if more than 0, the number of threads that read log files into memory
+                     ahead of parsing them, to hide the wait on slow (i.e., network) drives
+    :param columnar_files: if True, also write the trial-by-trial data to binary, column by column
+                           task files (task1.ylc, ..., task6.ylc; see columnar.py)
+    :param compress: if True, compress the columns of the .ylc files
+    :param checkpoint_every: how many log files to parse between checkpoints, or 0 for none
+    :param checkpoint_file: where to save the checkpoints.  The file is deleted when the run is done.
+    :param resume: if True, carry on from the checkpoint in checkpoint_file instead of starting
+                   a new run (see resume(), which passes the rest of the arguments along, too)
+    :param rewrite_outputs: if True, and the run adds to the existing outputs, the summary file
+                            and the task files are rewritten from the database at the end of the
+                            run (i.e., after an interrupted run's checkpoint was discarded, which
+                            leaves rows missing from them)
+    :return: the dictionary of Subject instances built from the parsed files, keyed by subject key.
+             When streaming, this only holds the subjects whose summaries weren't written before
+             the end of the run, without their trial data.
+    """
+    if n_workers is None:
+        n_workers = multiprocessing.cpu_count()
+    overwrite_summary = overwrite
+    overwrite_task = overwrite
+    start_over = overwrite and not resume  # A resumed run keeps what was stored before the checkpoint
+    subjects = {}  # This will store subject data to be added to the database
+
+    # Everything needed to resume the run, which is saved with each checkpoint
+    settings = {'log_folders': [os.path.abspath(folder) for folder in log_folders], 'summary_file': summary_file,
+                'overwrite': overwrite, 'stream_files': stream_files, 'database_file': database_file,
+                'seen_file_store': seen_file_store, 'task_dir': task_dir, 'report_file': report_file,
+                'shard': shard, 'n_shards': n_shards, 'shard_by': shard_by, 'columnar_files': columnar_files,
+                'compress': compress, 'checkpoint_every': checkpoint_every}
+
+    # Subject key and task for each log file whose data have been stored in the database and
+    # the task files during the run, including, when resuming, before the last checkpoint
+    stored = set()
+
+    # Keys of the subjects whose rows have been written to the summary file during the run,
+    # when streaming
+    summarized = set()
+    if resume:
+        saved = checkpoint.load_checkpoint(checkpoint_file)
+        stored = saved['stored']
+        summarized = set(str(key) for key in saved.get('summarized', []))
+        print "Resuming from the checkpoint in %s: %d log files already stored" % (checkpoint_file, len(stored))
+
+    # Keep track of where the time goes.  The profiler only sees this process, not the workers,
+    # so use a single worker to profile the parsing itself.
+    report = instrumentation.RunReport()
+    if profile_file:
+        import cProfile
+        profiler = cProfile.Profile()
+        profiler.enable()
+
+    # Load the manifest of already seen files, along with the database they went into
+    if not start_over:
+        with report.stage('database'):
+            upgrade_database(database_file)
+    with report.stage('manifest'):
+        if not start_over:
+            already_seen = manifest.load_manifest(seen_file_store)
+        else:
+            already_seen = {}
+
+    # Make lists of files not already seen and of files that have changed since they were seen
+    # Files with names that don't follow the naming convention are reported without being opened.
+    with report.stage('list'):
+        log_files, bad_files = ingest.scan_log_folders([os.path.abspath(folder) for folder in log_folders])
+        if shard is not None:
+            log_files = ingest.select_shard(log_files, shard, n_shards, shard_by)
+            if shard != 0:
+                bad_files = []
+        report.files['listed'] = len(log_files) + len(bad_files)
+        new_files, changed_files = manifest.find_changes(already_seen, log_files)
+
+    for log_file, error in bad_files:
+        print "Problem with file: %s\nError Below:\n%s" % (log_file, error)
+        print "Skipping for now..."
+        report.record_failure()
+
+    # Tell the user how many files have already been processed
+    if not start_over:
+        print "Number of previously processed log files to date: %d" % len(already_seen)
+        print "Previously processed log files that have changed: %d" % len(changed_files)
+
+    # Subject key and task for each changed file that gets parsed again.  These
+    # replace whatever is already stored in the database.
+    replaced = set()
+
+    # When adding to the summary and task files, the rows already written for a changed file
+    # stay in them, so they are rewritten from the database at the end of the run instead
+    rewrite_outputs = rewrite_outputs or (resume and saved.get('rewrite_outputs', False))
+
+    # Parse the files grouped by subject and task (see ingest.scan_log_folders).  When a subject
+    # has more than one log file for the same task, only the last one by name is parsed, so the
+    # same one always wins, and duplicates are reported before anything is opened.  If that
+    # file can't be parsed, the next one by name is parsed instead.  The files already seen
+    # are included, so that a file that lost out to one stored in an earlier run isn't
+    # parsed now just because it was never stored itself.
+    to_parse = set(new_files + changed_files)
+    kept_files, duplicates, fallbacks = ingest.drop_duplicate_files(log_files)
+    files_to_parse = [f for f in kept_files if f in to_parse]
+    fallbacks = dict((log_file, [f for f in fallbacks[log_file] if f in to_parse])
+                     for log_file in files_to_parse if log_file in fallbacks)
+    parsing = set((name_data.task, name_data.key) for name_data in map(ingest.read_file_name, files_to_parse)
+                  if name_data is not None)
+    for task, key in duplicates:
+        if (task, key) in parsing:
+            print "Multiple %s files for subject %s:" % (task, key)
+    print "Log files to process: %d" % len(files_to_parse)
+
+    # When streaming, the number of log files left to parse for each subject, so that
+    # their summary can be written and their data let go of once they are all parsed
+    files_left = {}
+    planned = set(files_to_parse)
+    if stream_files:
+        for log_file in files_to_parse:
+            key = ingest.read_file_name(log_file).key
+            files_left[key] = files_left.get(key, 0) + 1
+
+    # Open the database and the task files
     try:
-    # Check if the current subject number is in our dictionary
-        with open(log_file, "rU") as in_file:
-
-            # Try to generate a data_file instance from the given log file.  If
-            # any of the anticipated errors occur, alert the user to the error and
-            # skip the file.
-            try:
-                log_data = dat.DataFile(in_file)
-            except Exception as e:
-                print "Problem with file %s:\n%s" % (in_file.name, e)
-                raise
-            # e.BadFileNameError as bfe:
-            #     print "Bad file name!\n%s\n" % bfe
-            #     continue
-            # except e.TaskNameError as tne:
-            #     print "Invalid task name encountered in processing file: %s\n%s\nSkipping this file\n" % (in_file.name, tne)
-            #     continue
-            # except e.BadLineError as ble:
-            #     print "Line of unexpected format encountered in log file: %s\n%s\nSkipping this file\n" % (
-            #         in_file.name, ble)
-            #     continue
-
-            # If the subject associated with the log file is not yet in the subject dictionary, create a new entry
+        db = database.Database(database_file)
+    except database.sqlite3.Error as err:
+        print "Problem opening database file: %s\nError: %s" % (database_file, err)
+        raise
+
+    # If we choose to overwrite the summary file, also overwrite the database.
+    if start_over:
+        db.clear()
+
+    write_files = summary_file is not None
+    task_writers = [export.TrialFileWriter(task_dir, overwrite=overwrite_task and not resume)]
+    if columnar_files:
+        task_writers.append(columnar.ColumnarWriter(task_dir, overwrite=overwrite_task and not resume,
+                                                    compress=compress))
+
+    # Pick up the outputs where the last checkpoint left them.  The files stored before it
+    # go in the summary file just as if they had been parsed in this run, unless their
+    # subject's summary had already been written to it.
+    if resume:
+        if write_files:
+            checkpoint.restore_task_files(task_writers[0], saved['task_files'])
+            if saved['summary_file'] is not None:
+                checkpoint.truncate_file(summary_file, saved['summary_file'])
+            if columnar_files:
+                checkpoint.restore_task_files(task_writers[1], saved.get('columnar_files', {}))
+        for key in sorted(set(key for key, task in stored) - summarized):
+            stored_subject = db[key]
+            subjects[key] = dat.Subject(stored_subject.ID, stored_subject.group, stored_subject.sibling, key)
+            for task in stored_subject.data:
+                if (key, task) in stored:
+                    subjects[key].add_data(task, stored_subject.data[task])
+                    if stream_files:
+                        stored_subject.data[task].practice = stored_subject.data[task].trial_by_trial = None
+                    else:
+                        stored_subject.data[task].load_trials()
+
+    def store(parsed):
+        """
+        Writes the data from the given log files, a list of (key, task) tuples, to the
+        database and the task files.  When streaming, their trial data are then let go
+        of, and only their summaries are kept, for the summary file.
+        """
+        for key, task in parsed:
+            if (key, task) in stored:  # Stored before the checkpoint the run was resumed from
+                continue
+
+            # If there is already a record of the subject and task in the database, it is
+            # kept, unless the log file has changed since it was stored.
+            with report.stage('database'):
+                if task not in db.tasks(key) or (key, task) in replaced:
+                    db.put_subject(subjects[key], [task])
+            if write_files:
+                with report.stage('task_files'):
+                    for task_writer in task_writers:
+                        task_writer.write(subjects[key], task)
+
+            if stream_files:
+                subjects[key].data[task].practice = subjects[key].data[task].trial_by_trial = None
+            stored.add((key, task))
+
+    def write_summaries(keys):
+        """
+        Writes the summary rows of the given subjects, when streaming, and lets go of them.
+        """
+        keys = [key for key in keys if key in subjects]
+        if write_files and keys:
+            with report.stage('summary_file'):
+                export.write_summaries([subjects[key] for key in keys], summary_file,
+                                       overwrite=overwrite_summary and not summarized)
+        for key in keys:
+            del subjects[key]
+            summarized.add(key)
+
+    def save_checkpoint():
+        """
+        Commits everything stored so far and saves the manifest and a checkpoint.
+        """
+        with report.stage('database'):
+            db.commit()
+        with report.stage('checkpoint'):
+            task_files = {}
+            summary_size = None
+            columnar_sizes = {}
+            if write_files:
+                task_files = checkpoint.task_file_sizes(task_writers[0], dat.TASKS, overwrite_task and not resume)
+                if (not overwrite_summary or summarized) and os.path.isfile(summary_file):
+                    summary_size = os.path.getsize(summary_file)
+                if columnar_files:
+                    columnar_sizes = checkpoint.columnar_file_sizes(task_writers[1], dat.TASKS,
+                                                                    overwrite_task and not resume)
+            checkpoint.save_checkpoint({'settings': settings, 'stored': sorted(stored), 'task_files': task_files,
+                                        'summary_file': summary_size, 'summarized': sorted(summarized),
+                                        'columnar_files': columnar_sizes,
+                                        'rewrite_outputs': rewrite_outputs or bool(replaced)}, checkpoint_file)
+        with report.stage('manifest'):
+            manifest.save_manifest(already_seen, seen_file_store)
+
+    # Log files parsed since their data were last stored
+    unstored = []
+
+    # When streaming, the subjects whose log files have all been parsed.  Their summaries
+    # are written when the next file comes in, after any files parsed in place of theirs.
+    finished = []
+
+    # Parse the files, possibly in several processes at once.  Files inside archives are
+    # read in the order they are stored, so that each archive is only read once.
+    parsed_files = ingest.parse_log_files(archives.reading_order(files_to_parse), n_workers, prefetch)
+    parsed_files = ingest.parse_fallbacks(parsed_files, fallbacks)
+    for log_file, log_data, error, stats in report.timed('parse', parsed_files):
+        if stream_files and log_file in planned:
+            write_summaries(finished)
+            finished = []
+            key = ingest.read_file_name(log_file).key
+            files_left[key] -= 1
+            if not files_left[key]:
+                finished.append(key)
+
+        # If any problems came up while generating a DataFile instance from the log file,
+        # alert the user to the error and skip the file.
+        if error is not None:
+            print "Problem with file: %s\nError Below:\n%s" % (log_file, error)
+            print "Skipping for now..."
+            if fallbacks.get(log_file):
+                print "Parsing the next file for the same subject and task instead..."
+            report.record_failure()
+            continue
+        report.record_file(log_file, log_data.task, stats)
+
+        # If the subject associated with the log file is not yet in the subject dictionary, create a new entry
         if log_data.key not in subjects:
             subjects[log_data.key] = dat.Subject(log_data.ID, log_data.group, log_data.sibling, log_data.key)
-
-        # If there is an existing subject, check to make sure subject data matches (sibling, group)
-        else:
-            # Check if there are multiple task files for the given subject for the given task number
-            # (e.g. see if subject PE231010 has more than one task1 log file)
-            if log_data.task in subjects[log_data.key].data:
-                print "Multiple %s files for subject %s:" % (log_data.task, log_data.key)
+            if log_data.key in db:
+                print "Pre-existing DATABASE entry for subject %s." % log_data.key
 
         # Update the corresponding subject's data dictionary with the data from the log file object
         subjects[log_data.key].add_data(log_data.task, log_data)
-        already_seen.add(os.path.basename(log_file))
-    except Exception as e:
-        print "Problem with file: %s\nError Below:\n%s" % (in_file.name, e)
-        print "Skipping for now..."
-
-# Update the set of already seen files.
-with open(seen_file_store, "wb") as f:
-    pickle.dump(already_seen, f)
-
-# Write the data to a shelve database
-try:
-    db = shelve.open(shelve_database)
-except IOError as io:
-    print "Problem opening database file: %s\nError: %s" % (shelve_database, io)
-    raise
-
-# If we choose to overwrite the summary file, also overwrite the database.
-if overwrite_summary:
-    db.clear()
-
-for sub in subjects:
-    # If there is already a record of the subject in the shelve database,
-    # check to see if there is missing task data and update the subject if this is the case
-    if sub in db:
-        print "Pre-existing DATABASE entry for subject %s." % sub
-        for task in subjects[sub].data:
-            if task not in db[sub].data:
-                updated_sub = db[sub]
-                updated_sub.add_data(task, subjects[sub].data[task])
-                db[sub] = updated_sub
+        if log_file in already_seen:
+            replaced.add((log_data.key, log_data.task))
+        with report.stage('manifest'):
+            already_seen[log_file] = manifest.file_entry(log_file, log_data.key, log_data.task, stats.get('md5'))
+
+        # Write the file's data to the database and the task file straight away if streaming,
+        # and otherwise at each checkpoint
+        unstored.append((log_data.key, log_data.task))
+        if stream_files:
+            store(unstored)
+            unstored = []
+        if checkpoint_every and report.files['parsed'] % checkpoint_every == 0:
+            store(unstored)
+            unstored = []
+            save_checkpoint()
+
+    # Write the data to the database, unless it was written as the files were parsed.  A last
+    # checkpoint covers everything stored, so that the run can still be resumed if it is
+    # stopped while the summary and task files are being finished.
+    store(unstored)
+    write_summaries(finished)
+    if checkpoint_every:
+        save_checkpoint()
+
+    # All of the changes since the last checkpoint are committed when the database is closed
+    with report.stage('database'):
+        db.close()
+
+    # Write summary data for all of the new subjects, unless they were written as they were finished
+    if write_files and (subjects or not summarized):
+        with report.stage('summary_file'):
+            export.write_summaries([subjects[sub] for sub in subjects], summary_file,
+                                   overwrite=overwrite_summary and not summarized)
+
+    # The trial by trial data were written to the task files along with the database
+    with report.stage('task_files'):
+        for task_writer in task_writers:
+            task_writer.close()
+
+    if write_files and not overwrite and (rewrite_outputs or replaced):
+        print "Rewriting the summary file and the task files from the database, since some log files " \
+              "have changed or an interrupted run left them incomplete."
+        with report.stage('export'):
+            db = database.Database(database_file)
+            try:
+                export.write_database(db, summary_file, task_dir, columnar_files, compress)
+            finally:
+                db.close()
+
+    # Update the manifest of already seen files, now that every output is written
+    with report.stage('manifest'):
+        manifest.save_manifest(already_seen, seen_file_store)
+
+    # The run is finished, so there's nothing to resume
+    if os.path.isfile(checkpoint_file):
+        os.remove(checkpoint_file)
+
+    if profile_file:
+        profiler.disable()
+        profiler.dump_stats(profile_file)
+    report.write(report_file)
+
+    print "\n\nAll Done!\n\n"
+    return subjects
+
+
+def resume(checkpoint_file=CHECKPOINT_FILE, n_workers=None, prefetch=0, profile_file=None):
+    """
+    Finishes a run of build() that was interrupted, with the same settings, starting from
+    its last checkpoint: the log files stored before the checkpoint aren't parsed again,
+    and the outputs end up just as if the run hadn't been interrupted.
+
+    :param checkpoint_file: the checkpoint saved by the interrupted run
+    :param n_workers: the number of processes used to parse log files.  By default, one per CPU.
+    :param prefetch: the number of threads that read log files ahead of parsing them (see build())
+    :param profile_file: if given, cProfile statistics for the run are saved to this file
+    :return: the dictionary of Subject instances, as for build()
+    """
+    if not os.path.isfile(checkpoint_file):
+        raise IOError("No checkpoint at %s, so there is no run to resume" % checkpoint_file)
+
+    settings = {}
+    for name, value in checkpoint.load_checkpoint(checkpoint_file)['settings'].iteritems():
+        if isinstance(value, unicode):
+            value = str(value)
+        elif isinstance(value, list):
+            value = [str(x) for x in value]
+        settings[str(name)] = value
+
+    return build(n_workers=n_workers, prefetch=prefetch, profile_file=profile_file,
+                 checkpoint_file=checkpoint_file, resume=True, **settings)
+
+
+def merge(partial_databases, summary_file, overwrite=True, database_file=DATABASE_FILE, partial_manifests=(),
+          seen_file_store=SEEN_FILE_STORE, task_dir="", columnar_files=False, compress=False):
+    """
+    Merges the databases written by sharded runs of build() into one database, and
+    then rewrites the summary file and the task files from the merged database.  If
+    more than one database has data for the same subject and task, this is reported
+    just as it is when a folder has more than one log file for the same subject and
+    task, and the data from the database listed last are kept.
+
+    :param partial_databases: a list of paths to the databases to merge
+    :param summary_file: path to the summary file
+    :param overwrite: if True, the merged database and manifest are started over.  Otherwise
+                      the partial databases are added to whatever database_file already holds.
+    :param database_file: path to the merged database
+    :param partial_manifests: a list of paths to the manifests written by the sharded runs.
+                              They are combined into seen_file_store, so that later runs
+                              that add to the merged database skip the files already parsed.
+    :param seen_file_store: path to the merged manifest
+    :param task_dir: the folder in which to write the task files
+    :param columnar_files: if True, also write .ylc task files (see build())
+    :param compress: if True, compress the columns of the .ylc files
+    """
+    if not overwrite:
+        upgrade_database(database_file)
+    db = database.Database(database_file)
+    if overwrite:
+        db.clear()
+        already_seen = {}
     else:
-        db[sub] = subjects[sub]
-db.close()
-
-# Iterate over the new dictionary
-for sub in subjects:
-    subjects[sub].write_summary(summary_file, overwrite=overwrite_summary)
-
-    # After the first call to write summary, we want to continue to write
-    # to the same file instead of overwriting every time.
-    overwrite_summary = False
-
-    for task in subjects[sub].data:
-        subjects[sub].dump_trial_by_trial(task, task + '.csv', overwrite=overwrite_task)
-
-    #TODO We're assuming here that the first subject will have task data for all 6 tasks.
-    overwrite_task = False
-
-print "\n\nAll Done!\n\n"
\ No newline at end of file
+        already_seen = manifest.load_manifest(seen_file_store)
+
+    for partial_database in partial_databases:
+        print "Merging %s" % partial_database
+        for task, key in db.merge(partial_database):
+            print "Multiple %s files for subject %s:" % (task, key)
+
+    for partial_manifest in partial_manifests:
+        already_seen.update(manifest.load_manifest(partial_manifest))
+    manifest.save_manifest(already_seen, seen_file_store)
+
+    print "Subjects in merged database: %d" % len(db)
+    export.write_database(db, summary_file, task_dir, columnar_files, compress)
+    db.close()
+
+    print "\n\nAll Done!\n\n"
+
+
+def upgrade_database(database_file):
+    """
+    Copies the shelve database kept by older versions of this script into database_file,
+    if there is one and database_file doesn't exist yet (see database.upgrade_shelve).  Their
+    manifest is carried over as is (see manifest.load_manifest), so without the copy, the
+    data from every log file processed before the upgrade would be missing.
+    """
+    shelve_file = database.find_shelve(database_file)
+    if shelve_file is not None and not os.path.exists(database_file):
+        print "Copying the database from an older version, %s, into %s" % (shelve_file, database_file)
+        database.upgrade_shelve(database_file)
+
+
+def export_database(summary_file, database_file=DATABASE_FILE, task_dir="", columnar_files=False, compress=False,
+                    **filters):
+    """
+    Rewrites the summary file and the task files from the data already in the database,
+    without reading any log files, i.e., after the files were deleted or to pull out
+    part of the cohort.
+
+    :param summary_file: path to the summary file
+    :param database_file: path to the database
+    :param task_dir: the folder in which to write the task files
+    :param columnar_files: if True, also write .ylc task files (see build())
+    :param compress: if True, compress the columns of the .ylc files
+    :param filters: only write data for the subjects in a group or of a sibling status, or
+                    for the log files from a device or between two dates (see Database.subjects),
+                    i.e., group='12', since='5/1/2013', until='5/31/2013'
+    """
+    upgrade_database(database_file)
+    if not os.path.isfile(database_file):
+        raise IOError("No database at %s" % database_file)
+
+    db = database.Database(database_file)
+    try:
+        count = export.write_database(db, summary_file, task_dir, columnar_files, compress, **filters)
+    finally:
+        db.close()
+
+    print "Subjects written: %d" % count
+    print "\n\nAll Done!\n\n"
+
+
+def watch(log_folders, summary_file, n_workers=1, database_file=DATABASE_FILE, seen_file_store=SEEN_FILE_STORE,
+          task_dir="", poll_interval=2.0, settle_time=2.0, prefetch=0):
+    """
+    Keeps watching the given folders for new log files, until stopped with Ctrl-C (or a
+    SIGTERM), and adds each one to the database, the summary file and the task files as
+    soon as it is complete (see watcher.py).  Unlike build(), the folders aren't rescanned:
+    only new files are looked at, so files that change after they were added are only
+    picked up by a normal run.  Files already in the manifest are skipped, so the first
+    poll catches up on anything added since the last run.
+
+    As in build(), if a subject has more than one log file for the same task, this is
+    reported and the last file by name is kept.  Like an appending run of build(), each
+    batch of files adds rows to the summary file for just the tasks in that batch; use
+    export_database() for a summary file with one row per subject.
+
+    :param log_folders: a list of paths to folders of log files
+    :param summary_file: path to the summary file, which is added to
+    :param n_workers: the number of processes used to parse each batch of log files
+    :param database_file: path to the SQLite database
+    :param seen_file_store: path to the manifest of files already processed
+    :param task_dir: the folder in which to write the task files, which are added to
+    :param poll_interval: how many seconds to wait between polls of the folders
+    :param settle_time: how many seconds a new file has to stay the same size before it's read
+    :param prefetch: if more than 0, the number of threads that read log files ahead of
+                     parsing them (see build())
+    """
+    upgrade_database(database_file)
+    already_seen = manifest.load_manifest(seen_file_store)
+
+    # The file stored for each subject and task, so that duplicates can be told apart
+    stored_files = dict(((entry['key'], entry['task']), log_file)
+                        for log_file, entry in already_seen.iteritems() if entry and entry['key'])
+
+    folder_watcher = watcher.FolderWatcher(log_folders, already_seen, settle_time)
+    db = database.Database(database_file)
+    task_writer = export.TrialFileWriter(task_dir)
+
+    def stop(signum, frame):
+        raise KeyboardInterrupt
+    signal.signal(signal.SIGTERM, stop)
+
+    print "Watching %s for new log files.  Press Ctrl-C to stop." % ", ".join(log_folders)
+    try:
+        while True:
+            started = time.time()
+            log_files, bad_files = folder_watcher.poll()
+
+            for log_file, error in bad_files:
+                print "Problem with file: %s\nError Below:\n%s" % (log_file, error)
+                print "Skipping for now..."
+
+            # Keep the last file by name for each subject and task, among the new files
+            # and the file already stored.  Should it not parse, fall back on the next one.
+            log_files, duplicates, fallbacks = ingest.drop_duplicate_files(log_files)
+            files_to_parse = []
+            for log_file in log_files:
+                name_data = ingest.read_file_name(log_file)
+                stored_file = stored_files.get((name_data.key, name_data.task))
+                if stored_file is not None and stored_file != log_file:
+                    duplicates.append((name_data.task, name_data.key))
+                    if os.path.basename(stored_file) > os.path.basename(log_file):
+                        continue
+                    fallbacks[log_file] = [fallback for fallback in fallbacks.get(log_file, [])
+                                           if os.path.basename(fallback) > os.path.basename(stored_file)]
+                files_to_parse.append(log_file)
+            for task, key in duplicates:
+                print "Multiple %s files for subject %s:" % (task, key)
+
+            subjects = {}
+            parsed_files = ingest.parse_log_files(archives.reading_order(files_to_parse), n_workers, prefetch)
+            for log_file, log_data, error, stats in ingest.parse_fallbacks(parsed_files, fallbacks):
+                if error is not None:
+                    print "Problem with file: %s\nError Below:\n%s" % (log_file, error)
+                    print "Skipping for now..."
+                    if fallbacks.get(log_file):
+                        print "Parsing the next file for the same subject and task instead..."
+                    continue
+
+                if log_data.key not in subjects:
+                    subjects[log_data.key] = dat.Subject(log_data.ID, log_data.group, log_data.sibling,
+                                                         log_data.key)
+                subjects[log_data.key].add_data(log_data.task, log_data)
+                db.put_subject(subjects[log_data.key], [log_data.task])
+                already_seen[log_file] = manifest.file_entry(log_file, log_data.key, log_data.task, stats.get('md5'))
+                stored_files[(log_data.key, log_data.task)] = log_file
+
+            if subjects:
+                db.commit()
+                export.write_summaries([subjects[sub] for sub in sorted(subjects)], summary_file)
+                for sub in sorted(subjects):
+                    task_writer.write_subject(subjects[sub])
+                task_writer.flush()
+                manifest.save_manifest(already_seen, seen_file_store)
+                print "%s  Added %d log files for %d subjects" % (time.strftime("%Y-%m-%d %H:%M:%S"),
+                                                                  sum(len(subjects[sub].data) for sub in subjects),
+                                                                  len(subjects))
+
+            time.sleep(max(0.0, poll_interval - (time.time() - started)))
+    except KeyboardInterrupt:
+        print "\nStopped watching."
+    finally:
+        task_writer.close()
+        db.close()
+        manifest.save_manifest(already_seen, seen_file_store)
+
+
+def set_aside(path):
+    """
+    Renames a file to path.old, or, if that is taken, to path.old2, path.old3 and so on,
+    so that nothing set aside before is lost.
+
+    :return: the new path
+    """
+    new_path = path + ".old"
+    n = 1
+    while os.path.exists(new_path):
+        n += 1
+        new_path = "%s.old%d" % (path, n)
+    os.rename(path, new_path)
+    return new_path
+
+
+def shard_path(path, shard, n_shards):
+    """
+    Returns the default name for one shard's copy of an output file,
+    i.e., 'YL_DATABASE.sqlite' --> 'YL_DATABASE-shard1of4.sqlite'
+    """
+    name, extension = os.path.splitext(path)
+    return "%s-shard%dof%d%s" % (name, shard + 1, n_shards, extension)
+
+
+def ask_for_missing(args, interactive):
+    """
+    Prompts the user for anything needed that wasn't given on the command line.
+
+    :param args: the parsed command line arguments (see main).  Missing values are filled in.
+    :param interactive: if True, also ask about the options that have defaults
+                        (the number of workers and whether to stream files)
+    """
+
+    # Prompt the user for the path to their log files folder.
+    # The user will be continually prompted until they give a path to
+    # an existing folder.
+    if not args.log_folders:
+        log_folder = ""
+        while not os.path.isdir(log_folder) and not archives.is_archive(log_folder):
+            log_folder = raw_input("Please type the path to your log files folder: ")
+        args.log_folders = [log_folder]
+
+    # Get user input for summary file
+    if args.summary_file is None:
+        args.summary_file = raw_input("Please enter the path to your summary data spreadsheet:")
+
+    # Make sure they haven't just given you a directory
+    while os.path.isdir(args.summary_file):
+        args.summary_file = raw_input("%s is a directory.  Please enter a valid file name: " % args.summary_file)
+
+    # If the named output file already exists, see if the user wishes to overwrite the file
+    if args.overwrite is None:
+        if os.path.isfile(args.summary_file):
+            w = ""
+            while w not in ['y', 'n']:
+                w = raw_input("Overwrite existing summary file (y/n): ")
+            args.overwrite = w == "y"
+        else:
+            args.overwrite = True
+
+    if not interactive:
+        return
+
+    # Ask how many processes to use for parsing. Hitting return keeps the default.
+    if args.workers is None:
+        args.workers = multiprocessing.cpu_count()
+        w = None
+        while w is None:
+            w = raw_input("Number of worker processes to use [%d]: " % args.workers).strip()
+            if not w:
+                break
+            elif not w.isdigit() or int(w) < 1:
+                w = None
+            else:
+                args.workers = int(w)
+
+    # Ask whether to stream files straight to the outputs.  Hitting return keeps the default.
+    if args.stream is None:
+        w = None
+        while w not in ['', 'y', 'n']:
+            w = raw_input("Write out each log file as soon as it is parsed, to save memory (y/n) [n]: ").strip()
+        args.stream = w == "y"
+
+
+def main(argv=None):
+    """
+    Runs build() with the options given on the command line, asking for anything
+    that is missing.  With no arguments at all, every option is asked for.  With
+    --merge, runs merge() instead, with --export, export_database(), with --watch, watch(),
+    and with --resume, resume().
+    """
+    parser = argparse.ArgumentParser(description="Add YL log files to the database and write the summary "
+                                                 "and task files.")
+    parser.add_argument("log_folders", nargs="*", metavar="LOG_FOLDER",
+                        help="folder(s) of .csv log files, or zip, tar or gzip archives of them")
+    parser.add_argument("-s", "--summary-file", help="path to the summary data spreadsheet")
+    overwrite = parser.add_mutually_exclusive_group()
+    overwrite.add_argument("--overwrite", dest="overwrite", action="store_true", default=None,
+                           help="start the summary file, task files and database over")
+    overwrite.add_argument("--append", dest="overwrite", action="store_false",
+                           help="only add new or changed log files to the existing outputs")
+    parser.add_argument("-w", "--workers", type=int,
+                        help="number of worker processes to use (default: one per CPU)")
+    parser.add_argument("--stream", action="store_true", default=None,
+                        help="write out each log file as soon as it is parsed, to save memory")
+    parser.add_argument("--database",
+                        help="path to the SQLite database (default: %s)" % DATABASE_FILE)
+    parser.add_argument("--manifest",
+                        help="path to the manifest of processed files (default: %s)" % SEEN_FILE_STORE)
+    parser.add_argument("--task-dir", default="",
+                        help="folder in which to write the task files, which is created if need be "
+                             "(default: the current directory)")
+    parser.add_argument("--report",
+                        help="where to write the timing report (default: %s)" % REPORT_FILE)
+    parser.add_argument("--profile", help="save cProfile statistics for the run to this file")
+    parser.add_argument("--columnar", action="store_true",
+                        help="also write the trial data to binary, column by column task files (task1.ylc, ...)")
+    parser.add_argument("--compress", action="store_true", help="compress the columns of the .ylc files")
+    parser.add_argument("--prefetch", type=int, default=0, metavar="THREADS",
+                        help="read log files ahead of parsing them in this many threads, to hide the "
+                             "wait on network or synced folders (default: off)")
+    parser.add_argument("--shard", metavar="I/N",
+                        help="only parse the I-th of N shards of the log files (I counts from 1), into "
+                             "a database of its own.  The summary and task files are only written if "
+                             "--summary-file is given.")
+    parser.add_argument("--shard-by", choices=sorted(ingest.SHARD_FIELDS), default='key',
+                        help="split the log files into shards by subject key, group, or key prefix "
+                             "(default: %(default)s)")
+    parser.add_argument("--merge", nargs="+", metavar="PARTIAL_DATABASE",
+                        help="merge the databases written by sharded runs into --database and rewrite "
+                             "the summary and task files from it, instead of parsing log files")
+    parser.add_argument("--merge-manifests", nargs="+", default=[], metavar="PARTIAL_MANIFEST",
+                        help="with --merge, the manifests written by the sharded runs, to combine into --manifest")
+    parser.add_argument("--checkpoint-every", type=int, default=CHECKPOINT_EVERY, metavar="FILES",
+                        help="save a checkpoint every FILES log files, so an interrupted run can be resumed "
+                             "(default: %(default)s; 0 for no checkpoints)")
+    parser.add_argument("--checkpoint",
+                        help="where to save the checkpoints (default: %s)" % CHECKPOINT_FILE)
+    parser.add_argument("--resume", action="store_true",
+                        help="finish an interrupted run from its last checkpoint, with the same settings")
+    parser.add_argument("--discard-checkpoint", action="store_true",
+                        help="start a new run even though an interrupted run left a checkpoint, which is "
+                             "set aside.  When appending, the summary and task files are then rewritten "
+                             "from the database.")
+    parser.add_argument("--watch", action="store_true",
+                        help="keep watching the log folders and add new log files to the database, the "
+                             "summary file and the task files as they arrive, until stopped with Ctrl-C")
+    parser.add_argument("--poll", type=float, default=2.0, metavar="SECONDS",
+                        help="with --watch, how often to check the folders for new files (default: %(default)s)")
+    parser.add_argument("--settle", type=float, default=2.0, metavar="SECONDS",
+                        help="with --watch, how long a new file has to stay the same size before it is "
+                             "read (default: %(default)s)")
+    parser.add_argument("--export", action="store_true",
+                        help="rewrite the summary and task files from --database, instead of parsing log files")
+    parser.add_argument("--group", help="with --export, only write subjects in this group")
+    parser.add_argument("--sibling", choices=['y', 'n'],
+                        help="with --export, only write siblings (y) or non-siblings (n)")
+    parser.add_argument("--device", help="with --export, only write data from log files from this device")
+    parser.add_argument("--since", metavar="DATE",
+                        help="with --export, only write data from log files from this date (i.e., 5/15/2013) on")
+    parser.add_argument("--until", metavar="DATE",
+                        help="with --export, only write data from log files from up to this date")
+
+    if argv is None:
+        import sys
+        argv = sys.argv[1:]
+    args = parser.parse_args(argv)
+
+    for log_folder in args.log_folders:
+        if not os.path.isdir(log_folder) and not archives.is_archive(log_folder):
+            parser.error("%s is not a folder or an archive" % log_folder)
+    if args.workers is not None and args.workers < 1:
+        parser.error("--workers must be at least 1")
+
+    if args.merge:
+        for partial_database in args.merge:
+            if not os.path.isfile(partial_database):
+                parser.error("%s is not a file" % partial_database)
+        while not args.summary_file or os.path.isdir(args.summary_file):
+            args.summary_file = raw_input("Please enter the path to your summary data spreadsheet:")
+        merge(args.merge, args.summary_file, overwrite=args.overwrite is not False,
+              database_file=args.database or DATABASE_FILE, partial_manifests=args.merge_manifests,
+              seen_file_store=args.manifest or SEEN_FILE_STORE, task_dir=args.task_dir,
+              columnar_files=args.columnar, compress=args.compress)
+        return
+
+    if args.watch:
+        if not args.log_folders:
+            parser.error("--watch needs at least one log folder")
+        while not args.summary_file or os.path.isdir(args.summary_file):
+            args.summary_file = raw_input("Please enter the path to your summary data spreadsheet:")
+        watch(args.log_folders, args.summary_file, n_workers=args.workers or 1,
+              database_file=args.database or DATABASE_FILE, seen_file_store=args.manifest or SEEN_FILE_STORE,
+              task_dir=args.task_dir, poll_interval=args.poll, settle_time=args.settle, prefetch=args.prefetch)
+        return
+
+    if args.export:
+        for date in (args.since, args.until):
+            if date is not None and database.iso_date(date) is None and not re.match(r"\d{4}-\d\d-\d\d$", date):
+                parser.error("%s isn't a date like 5/15/2013 or 2013-05-15" % date)
+        while not args.summary_file or os.path.isdir(args.summary_file):
+            args.summary_file = raw_input("Please enter the path to your summary data spreadsheet:")
+        export_database(args.summary_file, database_file=args.database or DATABASE_FILE, task_dir=args.task_dir,
+                        columnar_files=args.columnar, compress=args.compress, group=args.group,
+                        sibling=None if args.sibling is None else args.sibling == 'y', device=args.device,
+                        since=args.since, until=args.until)
+        return
+
+    shard, n_shards = None, 1
+    database_file, seen_file_store, report_file = DATABASE_FILE, SEEN_FILE_STORE, REPORT_FILE
+    checkpoint_file = CHECKPOINT_FILE
+    if args.checkpoint_every < 0:
+        parser.error("--checkpoint-every can't be negative")
+    if args.shard:
+        try:
+            shard, n_shards = (int(x) for x in args.shard.split("/"))
+        except ValueError:
+            parser.error("--shard should look like 2/4")
+        if not 1 <= shard <= n_shards:
+            parser.error("--shard should be between 1/%d and %d/%d" % (n_shards, n_shards, n_shards))
+        shard -= 1
+
+        # Each shard keeps its own database, manifest, report and checkpoint, so that
+        # several shards can run side by side in the same folder
+        database_file, seen_file_store, report_file, checkpoint_file = (
+            shard_path(path, shard, n_shards) for path in (database_file, seen_file_store, report_file,
+                                                           checkpoint_file))
+        if args.overwrite is None and args.summary_file is None:
+            args.overwrite = True
+    checkpoint_file = args.checkpoint or checkpoint_file
+
+    if args.resume:
+        resume(checkpoint_file, n_workers=args.workers, prefetch=args.prefetch, profile_file=args.profile)
+        return
+
+    # An interrupted run has already added files to the manifest without writing their rows
+    # to the summary file, so a new run can't simply start on top of it.  Offer to finish
+    # it, and otherwise only go ahead if asked to, putting the old checkpoint aside and
+    # rewriting the outputs from the database at the end.
+    discarded = False
+    if os.path.isfile(checkpoint_file):
+        if not argv:
+            w = ""
+            while w not in ['y', 'n']:
+                w = raw_input("A run was interrupted.  Resume it from its last checkpoint (y/n): ")
+            if w == "y":
+                resume(checkpoint_file)
+                return
+        elif not args.discard_checkpoint:
+            parser.error("a run was interrupted and left a checkpoint in %s.  Use --resume to finish it, "
+                         "or --discard-checkpoint to start a new run anyway." % checkpoint_file)
+        old_file = set_aside(checkpoint_file)
+        discarded = True
+        print "A run was interrupted; its checkpoint was moved to %s.  Use --resume --checkpoint %s " \
+              "to finish it instead." % (old_file, old_file)
+
+    if not args.shard or args.summary_file is not None:
+        ask_for_missing(args, interactive=not argv)
+    elif not args.log_folders:
+        parser.error("give the log folder(s) to take the shard from")
+
+    build(args.log_folders, args.summary_file, overwrite=args.overwrite, n_workers=args.workers,
+          stream_files=bool(args.stream), database_file=args.database or database_file,
+          seen_file_store=args.manifest or seen_file_store, task_dir=args.task_dir,
+          report_file=args.report or report_file, profile_file=args.profile,
+          shard=shard, n_shards=n_shards, shard_by=args.shard_by, prefetch=args.prefetch,
+          columnar_files=args.columnar, compress=args.compress, checkpoint_every=args.checkpoint_every,
+          checkpoint_file=checkpoint_file, rewrite_outputs=discarded)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,120 @@
+"""
+Functions for saving and restoring the checkpoints that let an interrupted
+run of build_database.py pick up where it stopped (see build_database.resume).
+
+Every so often during a run, everything parsed so far is committed to the
+database, written to the task files and added to the manifest, and a
+checkpoint is saved as JSON.  It records:
+
+settings: the arguments the run was started with (see build_database.build)
+stored: a [key, task] pair for every log file stored so far in the run
+task_files: the size in bytes of each task file when the checkpoint was saved,
+            or null for a task file that the run hasn't written to yet and that
+            should be started over (or not be there) when the run resumes
+summary_file: the size of the summary file, if the run is adding to it or has
+              written to it already
+summarized: the keys of the subjects whose summary rows have been written, when
+            streaming (see build_database.build)
+columnar_files: the size of each .ylc file (see columnar.py) the run is adding to,
+                or null, as for task_files
+rewrite_outputs: true if a changed log file has been stored again during the run, in
+                 which case the outputs are rewritten from the database at the end of it
+
+Anything written to the task files after the last checkpoint is cut off
+when the run resumes, since the log files it came from weren't recorded
+as processed and are parsed again.  Likewise, the summary file and the .ylc
+files are cut back to their recorded sizes.  The checkpoint is deleted once
+the run has finished.
+"""
+
+import json
+import os
+
+import manifest
+
+
+def save_checkpoint(checkpoint, checkpoint_file):
+    """
+    Saves a checkpoint dictionary (see the module docstring) as JSON.  The file is
+    replaced in one step, so a run killed while saving leaves the last checkpoint whole.
+    """
+    manifest.write_atomically(checkpoint_file, json.dumps(checkpoint, sort_keys=True))
+
+
+def load_checkpoint(checkpoint_file):
+    """
+    Loads a checkpoint saved by save_checkpoint.
+
+    :return: the checkpoint dictionary, with the stored pairs as a set of (key, task) tuples
+    """
+    with open(checkpoint_file) as f:
+        checkpoint = json.load(f)
+    checkpoint['stored'] = set((str(key), str(task)) for key, task in checkpoint['stored'])
+    return checkpoint
+
+
+def task_file_sizes(task_writer, tasks, started_over):
+    """
+    Flushes the task files and returns their sizes, for a checkpoint.
+
+    :param task_writer: the export.TrialFileWriter the run is writing with
+    :param tasks: the tasks whose files to check, i.e., ['task1', ..., 'task6']
+    :param started_over: True if the run is overwriting the task files, in which case a
+                         file the run hasn't written to yet doesn't hold anything to keep
+    :return: a dictionary mapping each task to the size of its file, or None
+    """
+    task_writer.flush()
+    sizes = {}
+    for task in tasks:
+        out_file = task_writer.file_path(task)
+        if task in task_writer.files:
+            os.fsync(task_writer.files[task].fileno())
+            sizes[task] = os.path.getsize(out_file)
+        elif not started_over and os.path.isfile(out_file):
+            sizes[task] = os.path.getsize(out_file)
+        else:
+            sizes[task] = None
+    return sizes
+
+
+def columnar_file_sizes(task_writer, tasks, started_over):
+    """
+    Writes out the rows collected for the .ylc files and returns their sizes, for a
+    checkpoint (see task_file_sizes).
+
+    :param task_writer: the columnar.ColumnarWriter the run is writing with
+    :param tasks: the tasks whose files to check, i.e., ['task1', ..., 'task6']
+    :param started_over: True if the run is overwriting the .ylc files
+    :return: a dictionary mapping each task to the size of its file, or None
+    """
+    task_writer.flush()
+    sizes = {}
+    for task in tasks:
+        out_file = task_writer.file_path(task)
+        if (task in task_writer.written or not started_over) and os.path.isfile(out_file):
+            sizes[task] = os.path.getsize(out_file)
+        else:
+            sizes[task] = None
+    return sizes
+
+
+def restore_task_files(task_writer, sizes):
+    """
+    Cuts each task file back to its size at a checkpoint, or deletes it if the run
+    hadn't written to it (see task_file_sizes and columnar_file_sizes).
+    """
+    for task, size in sizes.iteritems():
+        out_file = task_writer.file_path(str(task))
+        if size is None:
+            if os.path.isfile(out_file):
+                os.remove(out_file)
+        else:
+            truncate_file(out_file, size)
+
+
+def truncate_file(out_file, size):
+    """
+    Cuts out_file back to the given size in bytes.
+    """
+    with open(out_file, "r+b") as f:
+        f.truncate(size)
@@ -0,0 +1,359 @@
+"""
+A compact binary, column-by-column alternative to the task .csv files.
+ColumnarWriter writes one file per task (task1.ylc, ..., task6.ylc) with
+the same columns as the task .csv files, and ColumnarFile reads them back
+one column at a time, so pulling, say, ReactionTime for task2 out of a file
+covering thousands of subjects doesn't mean reading the rest of it.
+
+Each file holds the magic bytes 'YLC1' followed by one or more blocks of
+rows.  Each block holds:
+
+the length of the block's schema, as a 4-byte little-endian unsigned int
+the schema, as JSON: the task, the number of rows in the block, whether the
+    columns are compressed (with zlib), and, for each column, its name, type,
+    and where its data are in the block
+the data for each column, one after another
+
+Adding rows to a file means adding a block to the end of it, so what is
+already in the file is never read or rewritten.  A new file is written to a
+temporary file first and renamed into place (see manifest.write_atomically).
+
+Columns of ints, floats and bools (see TrialTable) are stored as arrays
+('int', 'float' and 'bool' columns, in the byte order recorded in the
+schema).  Any other column, i.e., of strings, (x, y) tuples, or a mix of
+types, is an 'object' column, stored as a marshalled list of its distinct
+values followed by an array with the index of each row's value in that list.
+Example:
+
+>>with ColumnarFile("task2.ylc") as task2:
+>>    reaction_times = task2.column('ReactionTime')
+"""
+
+import json
+import marshal
+import mmap
+import os
+import struct
+import sys
+import zlib
+from array import array
+
+import data_classes as dat
+import manifest
+
+MAGIC = 'YLC1'
+
+# The array typecode used for each type of column
+TYPECODES = {'int': 'l', 'float': 'd', 'bool': 'b', 'object': 'l'}
+
+# How many rows ColumnarWriter collects for a task before writing them out as a block
+ROWS_PER_BLOCK = 50000
+
+
+class ColumnarWriter:
+    """
+    Collects trial-by-trial data for each task, column by column, and writes them
+    to one .ylc file per task a block at a time: whenever rows_per_block rows have
+    been collected for a task, and when flush() or close() is called.  It is used
+    just like export.TrialFileWriter:
+
+    with ColumnarWriter(overwrite=True) as writer:
+        for sub in subjects:
+            writer.write_subject(subjects[sub])
+    """
+
+    # Columns identifying the subject and log file, as in the task .csv files
+    id_headers = ['Key', 'SubID', 'Group', 'Sibling', 'Device', 'Time']
+
+    def __init__(self, out_dir="", overwrite=False, compress=False, rows_per_block=ROWS_PER_BLOCK):
+        """
+        :param out_dir: the directory in which to write the task files
+        :param overwrite: if a task file already exists, the new rows are added to the ones
+                          already in it unless overwrite is True, in which case it is replaced.
+        :param compress: if True, compress each column with zlib
+        :param rows_per_block: how many rows to collect for a task before writing them out
+        """
+        self.out_dir = out_dir
+        self.overwrite = overwrite
+        self.compress = compress
+        self.rows_per_block = rows_per_block
+        self.headers = {}     # The headers of each task's file
+        self.chunks = {}      # For each task, a list of (column_type, values) chunks for each column
+        self.lengths = {}     # The number of rows collected for each task
+        self.written = set()  # The tasks whose files have been written to
+
+    def file_path(self, task):
+        return os.path.join(self.out_dir, task + '.ylc')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+
+    def write(self, subject, task):
+        """
+        Adds every trial from one of subject's tasks to that task's columns.
+
+        :param subject: a Subject instance
+        :param task: one of 'task1', 'task2', ..., 'task6'
+        :return: None
+        """
+        data_file = subject.data[task]
+        table = data_file.trial_by_trial
+        if not isinstance(table, dat.TrialTable):  # i.e., a list of dictionaries from an old database
+            table = dat.TrialTable(data_file.task_headers,
+                                   [[trial.get(header) for header in data_file.task_headers] for trial in table])
+        if not len(table):
+            return
+
+        if task not in self.headers:
+            self.headers[task] = self.id_headers + list(data_file.task_headers)
+            self.chunks[task] = [[] for header in self.headers[task]]
+            self.lengths[task] = 0
+
+        # The identifying columns are the same for every trial in the file
+        ids = [subject.key, subject.ID, subject.group, subject.sibling, data_file.device, data_file.time]
+        chunks = self.chunks[task]
+        for i, value in enumerate(ids):
+            chunks[i].append((None, [value] * len(table)))
+        for i, header in enumerate(data_file.task_headers, len(ids)):
+            if header in table.headers:
+                j = table.headers.index(header)
+                chunks[i].append((table.types[j], table.columns[j]))
+            else:
+                chunks[i].append((None, [None] * len(table)))
+        self.lengths[task] += len(table)
+        if self.lengths[task] >= self.rows_per_block:
+            self.write_block(task)
+
+    def write_subject(self, subject):
+        """
+        Adds trial-by-trial data for all of subject's tasks.
+        """
+        for task in subject.data:
+            self.write(subject, task)
+
+    def write_block(self, task):
+        """
+        Writes the rows collected for a task as a block at the end of its file.  The
+        first block written replaces the file if overwriting.  The output directory is
+        created if it doesn't exist yet.
+        """
+        out_file = self.file_path(task)
+        if self.out_dir and not os.path.isdir(self.out_dir):
+            os.makedirs(self.out_dir)
+        headers = self.headers[task]
+        columns = [join_chunks(chunks) for chunks in self.chunks[task]]
+        block = encode_block(task, headers, columns, self.lengths[task], self.compress)
+
+        if os.path.isfile(out_file) and (task in self.written or not self.overwrite):
+            if task not in self.written:
+                with ColumnarFile(out_file) as old:
+                    if old.headers != headers:
+                        raise ValueError("Can't add to %s, which has different columns" % out_file)
+            with open(out_file, "ab") as out:
+                out.write(block)
+                out.flush()
+                os.fsync(out.fileno())
+        else:
+            manifest.write_atomically(out_file, MAGIC + block)
+
+        self.written.add(task)
+        self.chunks[task] = [[] for header in headers]
+        self.lengths[task] = 0
+
+    def flush(self):
+        """
+        Writes out the rows collected so far for every task.
+        """
+        for task in sorted(self.chunks):
+            if self.lengths[task]:
+                self.write_block(task)
+
+    def close(self):
+        self.flush()
+        self.headers = {}
+        self.chunks = {}
+        self.lengths = {}
+
+
+def join_chunks(chunks):
+    """
+    Joins a list of (column_type, values) chunks into a single (column_type, values)
+    column.  The column is an array if every chunk has the same type of array, and a
+    list of plain values otherwise.
+    """
+    kinds = set(column_type for column_type, values in chunks)
+    if len(kinds) == 1 and None not in kinds and 'object' not in kinds:
+        column_type = kinds.pop()
+        column = array(TYPECODES[column_type])
+        for chunk_type, values in chunks:
+            column.extend(values)
+        return column_type, column
+
+    column = []
+    for column_type, values in chunks:
+        column.extend(map(bool, values) if column_type == 'bool' else values)
+    return 'object', column
+
+
+def encode_column(column_type, values):
+    """
+    Returns the bytes stored in a file for a column of the given type.
+    """
+    if column_type != 'object':
+        return values.tostring()
+
+    # Values are told apart by type as well, since 1 == 1.0 == True
+    distinct = {}
+    indices = array(TYPECODES['object'], [distinct.setdefault((type(value), value), len(distinct))
+                                          for value in values])
+    table = [None] * len(distinct)
+    for (value_type, value), i in distinct.iteritems():
+        table[i] = value
+    table = marshal.dumps(table, 2)
+    return struct.pack('<I', len(table)) + table + indices.tostring()
+
+
+def encode_block(task, headers, columns, length, compress=False):
+    """
+    Returns the bytes for a block of rows in a .ylc file (see the module docstring).
+
+    :param task: the task the data are from
+    :param headers: a list of column names
+    :param columns: a list of (column_type, values) columns (see join_chunks), one per header
+    :param length: the number of rows
+    :param compress: if True, compress each column with zlib
+    """
+    blocks = []
+    schema = {'task': task, 'rows': length, 'compression': 'zlib' if compress else None,
+              'byteorder': sys.byteorder, 'itemsizes': dict((column_type, array(typecode).itemsize)
+                                                            for column_type, typecode in TYPECODES.items()),
+              'columns': []}
+    offset = 0
+    for header, (column_type, values) in zip(headers, columns):
+        block = encode_column(column_type, values)
+        if compress:
+            block = zlib.compress(block)
+        schema['columns'].append({'name': header, 'type': column_type, 'offset': offset, 'size': len(block)})
+        blocks.append(block)
+        offset += len(block)
+
+    schema = json.dumps(schema, sort_keys=True)
+    return struct.pack('<I', len(schema)) + schema + ''.join(blocks)
+
+
+class ColumnarFile:
+    """
+    Reads columns from a .ylc file (see the module docstring).  The file is memory-mapped,
+    and only the columns that are asked for are read, from every block in turn.
+    """
+
+    def __init__(self, path):
+        """
+        :param path: path to a .ylc file
+        """
+        self.path = path
+        self.file = open(path, "rb")
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        if self.map[:4] != MAGIC:
+            self.close()
+            raise ValueError("%s is not a .ylc file" % path)
+
+        # The schema of each block and where its column data start
+        self.blocks = []
+        position = 4
+        while position < len(self.map):
+            schema_size = struct.unpack('<I', self.map[position:position + 4].ljust(4, '\0'))[0]
+            start = position + 4 + schema_size
+            if start <= len(self.map):
+                schema = json.loads(self.map[position + 4:start])
+                position = start + sum(column['size'] for column in schema['columns'])
+            if start > len(self.map) or position > len(self.map):
+                self.close()
+                raise ValueError("%s ends part way through a block of rows" % path)
+            if self.blocks and [column['name'] for column in schema['columns']] != self.headers:
+                self.close()
+                raise ValueError("The blocks of rows in %s have different columns" % path)
+            self.blocks.append((schema, start))
+            if len(self.blocks) == 1:
+                self.headers = [str(column['name']) for column in schema['columns']]
+
+        if not self.blocks:
+            self.close()
+            raise ValueError("%s has no rows" % path)
+        self.schema = self.blocks[0][0]
+        self.task = str(self.schema['task'])
+
+        # A column is an 'object' column unless it has the same type in every block (see join_chunks)
+        self.types = {}
+        for i, header in enumerate(self.headers):
+            kinds = set(str(schema['columns'][i]['type']) for schema, start in self.blocks)
+            self.types[header] = kinds.pop() if len(kinds) == 1 else 'object'
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __len__(self):
+        return sum(schema['rows'] for schema, start in self.blocks)
+
+    def typed_column(self, header):
+        """
+        Returns (column_type, values) for the named column, where values is an array for
+        'int', 'float' and 'bool' columns and a list for 'object' columns.
+        """
+        i = self.headers.index(header)
+        chunks = [self.read_column(schema, start, schema['columns'][i]) for schema, start in self.blocks]
+        if len(chunks) == 1:
+            return chunks[0]
+        return join_chunks(chunks)
+
+    def read_column(self, schema, start, column):
+        """
+        Reads one column's data from one block, returning (column_type, values).
+        """
+        block = self.map[start + column['offset']:start + column['offset'] + column['size']]
+        if schema['compression'] == 'zlib':
+            block = zlib.decompress(block)
+
+        column_type = str(column['type'])
+        if column_type == 'object':
+            table_size = struct.unpack('<I', block[:4])[0]
+            table = marshal.loads(block[4:4 + table_size])
+            indices = self.read_array(schema, 'object', block[4 + table_size:])
+            return column_type, [table[i] for i in indices]
+        return column_type, self.read_array(schema, column_type, block)
+
+    def read_array(self, schema, column_type, block):
+        """
+        Reads an array of the given column type from the bytes in block, converting from the
+        byte order the block was written with, if it differs from this machine's.
+        """
+        values = array(TYPECODES[column_type])
+        if values.itemsize != schema['itemsizes'][column_type]:
+            raise ValueError("%s was written on a machine with %d-byte %s values, and this one uses %d bytes" %
+                             (self.path, schema['itemsizes'][column_type], column_type, values.itemsize))
+        values.fromstring(block)
+        if schema['byteorder'] != sys.byteorder:
+            values.byteswap()
+        return values
+
+    def column(self, header):
+        """
+        Returns the values in the named column, one for each row: an array for columns of
+        ints or floats, and a list otherwise.
+        """
+        column_type, values = self.typed_column(header)
+        if column_type == 'bool':
+            return map(bool, values)
+        return values
+
+    def close(self):
+        self.map.close()
+        self.file.close()
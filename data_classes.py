@@ -7,8 +7,8 @@ information about the log file used to create them, including:
 
 task: one of 'task1', 'task2', ..., 'task6', identifies the task number
 filename: the name of the original log file
-task_headers:  names of relevant data fields
-practice_headers:  names of relevant data fields from practice trials
+task_headers:  names of relevant data fields (shared by every file for the task; see TASK_HEADERS)
+practice_headers:  names of relevant data fields from practice trials (see PRACTICE_HEADERS)
 sibling:  True/False depending on whether there is an 's' in the file name
 ID:  4-digit ID number
 key: A unique identifier including country prefix, group number, and ID number.
@@ -18,22 +18,98 @@ device: A number specific to the device used to administer the tasks, i.e., "IIN
 date: The date of task administration (per the file name)
 time: time of administration (per the file name)
 summary: A dictionary containing summary data for the task
-trial_by_trial: A list of dictionaries with data for each trial from the task
+trial_by_trial: A TrialTable with data for each trial from the task
 practice: same as trial by trial, but for practice trials
 
-The Subject class contains all task information for a given subject. 
+The Subject class contains all task information for a given subject.
+
+The TrialTable class stores trial data column by column, packing columns
+of plain numbers into arrays, but can be used like a list of dictionaries,
+one for each trial.
 """
+import os
+import re
+import time
+import warnings
+from array import array
+from itertools import izip
+
 import exception_classes as e
 
+# The tasks for which there are log files
+TASKS = ['task1', 'task2', 'task3', 'task4', 'task5', 'task6']
+
+# Splits the subject part of a log file name, i.e., 'PE211005', into its
+# prefix ('PE', or 'PEs' for siblings), group ('21') and ID ('1005')
+SUBJECT_PATTERN = re.compile(r'([a-zA-Z][a-zA-Z]s?)(\d\d)(\d+)', re.IGNORECASE)
+
+# Names of the data kept for each task's trials and practice trials.  Every DataFile
+# and TrialTable for a task shares these tuples, rather than keeping a list of its own.
+TASK_HEADERS = {
+    'task1': ('TrialNum', 'NumBadTouches', 'Score', 'Score-incorrect only'),
+    'task2': ('TrialNum', 'TargetSide', 'TimeOut', 'ReactionTime', 'TouchPosition', 'DistanceFromCenter',
+              'PressedSide', 'GoalSide', 'Correct', 'SwitchRule', 'SwitchSide'),
+    'task3': ('TrialNum', 'NumDots', 'ShownDots', 'Delay', 'TimeOut', 'EarlyResponse', 'DotPressed',
+              'ReactionTime', 'TouchPosition', 'DistanceFromCenter', 'Rank'),
+    'task4': ('Block', 'PercentCorrect', 'AvgDistanceFromCenter', 'AvgResponseTime'),
+    'task5': ('Task', 'EndCondition', 'Duration', 'NumGoodTouches', 'NumBadTouches', 'NumRepeats',
+              'AvgTimePerTarget', 'StandardDeviation', 'AvgTimePerAction', 'AvgTargetsPerArea', 'AvgLocation',
+              'AvgFirstTen', 'AvgLastTen', 'AvgDistancePerTarget'),
+}
+TASK_HEADERS['task6'] = TASK_HEADERS['task1']
+
+PRACTICE_HEADERS = {
+    'task1': ('TrialNum', 'NumBadTouches', 'Score'),
+    'task2': ('TrialNum', 'TargetSide', 'TimeOut', 'ReactionTime', 'TouchPosition', 'DistanceFromCenter',
+              'PressedSide', 'GoalSide', 'Correct'),
+    'task3': ('TrialNum', 'NumDots', 'ShownDots', 'Delay', 'TimeOut', 'EarlyResponse', 'DotPressed',
+              'ReactionTime', 'TouchPosition', 'DistanceFromCenter'),
+    'task4': ('TrialNum', 'Correct', 'ResponseTime', 'TouchPosition', 'DistanceFromCenter'),
+    'task5': TASK_HEADERS['task5'][1:],
+}
+PRACTICE_HEADERS['task6'] = PRACTICE_HEADERS['task1']
+
+# The shared header tuples by name, i.e., 'task2' or 'task2-practice', so that a pickled
+# TrialTable only has to store the name of its headers (see TrialTable.__getstate__)
+HEADER_SCHEMAS = dict(TASK_HEADERS.items() + [(task + '-practice', headers) for task, headers in
+                                              PRACTICE_HEADERS.items()])
+SCHEMA_NAMES = dict((headers, name) for name, headers in sorted(HEADER_SCHEMAS.items(), reverse=True))
+
+# The version of the pickled form of Subject, DataFile and TrialTable (see their
+# __getstate__ methods).  Instances pickled before there were versions, as a
+# dictionary of attributes, can still be read.
+PICKLE_VERSION = 1
+
+
+def shared_headers(headers):
+    """
+    Returns headers as a tuple, which is the shared one from TASK_HEADERS or PRACTICE_HEADERS
+    if there is one with the same names.
+    """
+    headers = tuple(headers)
+    if headers in SCHEMA_NAMES:
+        return HEADER_SCHEMAS[SCHEMA_NAMES[headers]]
+    return headers
+
+
+def check_pickle_version(state, cls):
+    """
+    Raises a ValueError if state was pickled by a newer version of this module than this one.
+    """
+    if state[0] > PICKLE_VERSION:
+        raise ValueError("%s was pickled by a newer version of data_classes (format %d)" % (cls.__name__, state[0]))
+
 
-class Subject:
+class Subject(object):
     """
     A class containing all data (including trial by trial and summary statistics)
     and metadata (subject ID, device number, sibling, time) from the output task
     log files.
     """
 
-    def __init__(self, ID, group, sibling, key):
+    __slots__ = ('ID', 'group', 'sibling', 'data', 'key')
+
+    def __init__(self, ID=None, group=None, sibling=None, key=None):
 
         self.ID = ID       # Should be a four digit number
         self.group = group    # Generally a two-digit number
@@ -41,6 +117,15 @@ class Subject:
         self.data = {}       # A dictionary to be filled with DataFile objects
         self.key = key
 
+    def __getstate__(self):
+        return PICKLE_VERSION, self.ID, self.group, self.sibling, self.key, self.data
+
+    def __setstate__(self, state):
+        if isinstance(state, dict):  # Pickled before there were versions
+            state = (0, state['ID'], state['group'], state['sibling'], state['key'], state['data'])
+        check_pickle_version(state, Subject)
+        self.ID, self.group, self.sibling, self.key, self.data = state[1:]
+
     def __str__(self):
         """
         Returns a string representation of the object
@@ -56,7 +141,7 @@ class Subject:
         :param data_object: An instance of the DataFile class
         :return: None
         """
-        if task not in ['task1', 'task2', 'task3', 'task4', 'task5', 'task6']:
+        if task not in TASKS:
             raise e.TaskNameError(task)
 
         elif isinstance(data_object, DataFile):
@@ -65,70 +150,25 @@ class Subject:
             raise TypeError(data_object)
 
     def write_summary(self, out_file, overwrite=False):
+        """
+        Writes a row of summary data for this subject to out_file.
+        See export.write_summaries, which should be used instead
+        when writing more than one subject.
+        """
+        import export
 
-        import csv
-        import os
-
-        # Get summary data for all tasks in one dictionary
-        full_summary = self.summarize_data()
-
-        # Get headers in alphabetical order so that data will be written
-        # in task order
-        headers = sorted(full_summary.keys())
-
-        # If the file already exists, we want to append to it
-        # without writing header rows.  However, if overwrite
-        # is true, the whole file will just be overwritten.
-
-        if os.path.isfile(out_file) and not overwrite:
-            with open(out_file, "a") as out:
-                writer = csv.DictWriter(out, headers)
-                out.write(",".join(str(x) for x in [self.key, self.ID, self.group, self.sibling]) + ",")
-                writer.writerow(full_summary)  # Should only be one row
-
-        else:  # Open a new file (or overwrite old one) and write to it
-            with open(out_file, "w") as out:
-                writer = csv.DictWriter(out, headers)
-                # Add header for subject ID
-                out.write('Key,SubID,Group,Sibling,')
-                writer.writeheader()
-                out.write(",".join(str(x) for x in [self.key, self.ID, self.group, self.sibling]) + ",")
-                writer.writerow(full_summary)
+        export.write_summaries([self], out_file, overwrite=overwrite)
 
     def dump_trial_by_trial(self, task, out_file, overwrite=False):
         """
-        This function takes a list of dictionaries
-        and writes them to a .csv file.
-        """
-        import csv
-        import os
-
-        # If the file already exists, we want to append to it
-        # without writing header rows.  However, if overwrite
-        # is true, the whole file will just be overwritten.
-        if os.path.isfile(out_file) and not overwrite:
-            with open(out_file, "a") as out:
-                writer = csv.DictWriter(out, self.data[task].task_headers)
-                # Add ID, time, group, and sibling as first columns
-
-                for trial in self.data[task].trial_by_trial:
-                    out.write(
-                        ",".join(
-                            str(x) for x in [self.key, self.ID, self.group, self.sibling, self.data[task].device,
-                                             self.data[task].time]) + ",")
-                    writer.writerow(trial)
-
-        else:  # Open a new file (or overwrite old one) and write to it
-            with open(out_file, "w") as out:
-                writer = csv.DictWriter(out, self.data[task].task_headers)
-                out.write('Key,SubID,Group,Sibling,Device,Time,')
-                writer.writeheader()
-                for row in self.data[task].trial_by_trial:
-                    out.write(
-                        ",".join(
-                            str(x) for x in [self.key, self.ID, self.group, self.sibling, self.data[task].device,
-                                             self.data[task].time]) + ",")
-                    writer.writerow(row)
+        Writes trial-by-trial data for the given task to out_file.
+        See export.TrialFileWriter, which should be used instead
+        when writing more than one subject.
+        """
+        import export
+
+        with export.TrialFileWriter(overwrite=overwrite, file_names={task: out_file}) as writer:
+            writer.write(self, task)
 
     def summarize_data(self):
         """
@@ -142,25 +182,90 @@ class Subject:
         return full_summary
 
 
-class DataFile:
+class DataFile(object):
     """
     A class, each instance of which is built from
     a log file
     """
 
-    def __init__(self, log_file):
+    __slots__ = ('log_file', 'filename', 'task', 'key', 'ID', 'group', 'sibling', 'device', 'date', 'time',
+                 'task_headers', 'practice_headers', 'summary', 'practice', 'trial_by_trial', '_trial_loader')
+
+    # The attributes that are pickled, in order (see __getstate__).  The headers aren't,
+    # since they are the same for every file for a task.
+    pickled_attributes = ('filename', 'task', 'key', 'ID', 'group', 'sibling', 'device', 'date', 'time',
+                          'summary', 'practice', 'trial_by_trial')
 
-        import os
+    def __init__(self, log_file=None, stage_times=None):
+        """
+        Parses and summarizes the given log file.  If no log file is given,
+        an empty instance is created, whose attributes are filled in by
+        the caller (see database.Database).
+
+        :param stage_times: an optional dictionary.  If given, the seconds spent in
+                            parse_file_name, parse_file_data and summarize are stored in
+                            it under those names (see instrumentation.RunReport).
+        """
+
+        if log_file is None:
+            return
 
         self.log_file = log_file
         self.filename = os.path.basename(log_file.name)
+
+        start = time.time()
         self.parse_file_name(self.filename)
         self.set_task_headers()
         self.set_practice_headers()
+        named = time.time()
         self.parse_file_data()
+        parsed = time.time()
         self.summarize()
+        summarized = time.time()
         del self.log_file  # Just because you can't pickle files
 
+        if stage_times is not None:
+            stage_times['parse_file_name'] = named - start
+            stage_times['parse_file_data'] = parsed - named
+            stage_times['summarize'] = summarized - parsed
+
+    def __getattr__(self, name):
+        """
+        Loads the practice and trial-by-trial data the first time either is used, for
+        instances whose trial data were left in a database (see database.Database).  Such
+        instances have a _trial_loader, a function that returns (practice, trial_by_trial).
+        """
+        if name in ('practice', 'trial_by_trial') and getattr(self, '_trial_loader', None) is not None:
+            self.load_trials()
+            return getattr(self, name)
+        raise AttributeError(name)
+
+    def load_trials(self):
+        """
+        Loads the practice and trial-by-trial data, if they haven't been loaded already.
+        """
+        if getattr(self, '_trial_loader', None) is not None:
+            self.practice, self.trial_by_trial = self._trial_loader()
+            del self._trial_loader
+
+    def __getstate__(self):
+        # The trial loader can't be pickled, so load the trials first.  Attributes that
+        # were never set are pickled as None.
+        self.load_trials()
+        return (PICKLE_VERSION,) + tuple(getattr(self, name, None) for name in self.pickled_attributes)
+
+    def __setstate__(self, state):
+        if isinstance(state, dict):  # Pickled before there were versions
+            state = (0,) + tuple(state.get(name) for name in self.pickled_attributes)
+        check_pickle_version(state, DataFile)
+
+        for name, value in zip(self.pickled_attributes, state[1:]):
+            if value is not None:
+                setattr(self, name, value)
+        if getattr(self, 'task', None) in TASK_HEADERS:
+            self.set_task_headers()
+            self.set_practice_headers()
+
     def parse_file_name(self, file_name):
 
         """
@@ -204,10 +309,6 @@ class DataFile:
         self.device = 'IIN028'
         """
 
-        import os
-        import re
-        import warnings
-
         name, extension = os.path.splitext(os.path.basename(file_name))
 
         # Only accept csv files.
@@ -219,7 +320,7 @@ class DataFile:
         subject, device, task, date_and_time = name.split("_")
         self.key = subject
 
-        if task not in ['task1', 'task2', 'task3', 'task4', 'task5', 'task6']:
+        if task not in TASKS:
             raise e.BadFileNameError(
                 "Invalid task designation in file: %s\nExpected one of 'task1', 'task2', ..., 'task6'\n" % file_name)
 
@@ -227,7 +328,7 @@ class DataFile:
             self.task = task
 
         # Further split the subject string, which should be something like 'PE211005'
-        sub_components = re.search(r'([a-zA-Z][a-zA-Z]s?)(\d\d)(\d+)', subject, re.IGNORECASE)
+        sub_components = SUBJECT_PATTERN.search(subject)
 
         # This should split the subject data into match.group(1) = 'PE',
         # match.group(2) = '21', and match.group(3) = 1005.  Note that
@@ -273,73 +374,30 @@ class DataFile:
     def set_task_headers(self):
 
         """
-        Assigns a value to self.practice_headers according to the value
-        of self.task. Said value will be in the from of a list of
+        Assigns a value to self.task_headers according to the value
+        of self.task. Said value will be in the from of a tuple of
         strings (header names), which correspond to the data that we are interested in extracting
         from the log files.  This function is for task trials, specifically, as the headers
         for practice trials differ slightly from those associated with actual task trials.
 
-        :return: None.  Value of self.practice_headers is assigned (as a list of strings)
+        :return: None.  Value of self.task_headers is assigned (as a tuple of strings, shared
+                 by every DataFile for the same task; see TASK_HEADERS)
         """
-
-        if self.task == 'task1':
-            self.task_headers = ["TrialNum", "NumBadTouches", "Score", "Score-incorrect only"]
-
-        elif self.task == 'task2':
-            self.task_headers = ['TrialNum', 'TargetSide', 'TimeOut', 'ReactionTime', 'TouchPosition',
-                                 'DistanceFromCenter', 'PressedSide', 'GoalSide', 'Correct', 'SwitchRule',
-                                 'SwitchSide']
-
-        elif self.task == 'task3':
-            self.task_headers = ['TrialNum', 'NumDots', 'ShownDots', 'Delay', 'TimeOut', 'EarlyResponse',
-                                 'DotPressed', 'ReactionTime', 'TouchPosition', 'DistanceFromCenter', 'Rank']
-
-        elif self.task == 'task4':
-            self.task_headers = ['Block', 'PercentCorrect', 'AvgDistanceFromCenter', 'AvgResponseTime']
-
-        elif self.task == 'task5':
-            self.task_headers = ['Task', 'EndCondition', 'Duration', 'NumGoodTouches', 'NumBadTouches',
-                                 'NumRepeats', 'AvgTimePerTarget', 'StandardDeviation', 'AvgTimePerAction',
-                                 'AvgTargetsPerArea', 'AvgLocation', 'AvgFirstTen', 'AvgLastTen',
-                                 'AvgDistancePerTarget']
-
-        elif self.task == 'task6':
-            self.task_headers = ["TrialNum", "NumBadTouches", "Score", "Score-incorrect only"]
+        self.task_headers = TASK_HEADERS[self.task]
 
     def set_practice_headers(self):
 
         """
         Assigns a value to self.practice_headers according to the value
-        of self.task. Said value will be in the from of a list of
+        of self.task. Said value will be in the from of a tuple of
         strings (header names), which correspond to the data that we are interested in extracting
         from the log files.  This function is for practice trials, specifically, as the headers
         for practice trials differ slightly from those associated with actual task trials.
 
-        :return: None.  Value of self.practice_headers is assigned (as a list of strings)
+        :return: None.  Value of self.practice_headers is assigned (as a tuple of strings, shared
+                 by every DataFile for the same task; see PRACTICE_HEADERS)
         """
-
-        if self.task == 'task1':
-            self.practice_headers = ["TrialNum", "NumBadTouches", "Score"]
-
-        elif self.task == 'task2':
-            self.practice_headers = ['TrialNum', 'TargetSide', 'TimeOut', 'ReactionTime', 'TouchPosition',
-                                     'DistanceFromCenter', 'PressedSide', 'GoalSide', 'Correct']
-
-        elif self.task == 'task3':
-            self.practice_headers = ['TrialNum', 'NumDots', 'ShownDots', 'Delay', 'TimeOut', 'EarlyResponse',
-                                     'DotPressed', 'ReactionTime', 'TouchPosition', 'DistanceFromCenter']
-
-        elif self.task == 'task4':
-            self.practice_headers = ['TrialNum', 'Correct', 'ResponseTime', 'TouchPosition', 'DistanceFromCenter']
-
-        elif self.task == 'task5':
-            self.practice_headers = ['EndCondition', 'Duration', 'NumGoodTouches', 'NumBadTouches',
-                                     'NumRepeats', 'AvgTimePerTarget', 'StandardDeviation', 'AvgTimePerAction',
-                                     'AvgTargetsPerArea', 'AvgLocation', 'AvgFirstTen', 'AvgLastTen',
-                                     'AvgDistancePerTarget']
-
-        elif self.task == 'task6':
-            self.practice_headers = ["TrialNum", "NumBadTouches", "Score"]
+        self.practice_headers = PRACTICE_HEADERS[self.task]
 
     def parse_file_data(self):
         """
@@ -362,15 +420,133 @@ class DataFile:
 
         import summarize
 
-        if self.task == 'task1':
-            self.summary = summarize.get1(self.trial_by_trial)
-        elif self.task == 'task2':
-            self.summary = summarize.get2(self.trial_by_trial)
-        elif self.task == 'task3':
-            self.summary = summarize.get3(self.trial_by_trial)
-        elif self.task == 'task4':
-            self.summary = summarize.get4(self.trial_by_trial)
-        elif self.task == 'task5':
-            self.summary = summarize.get5(self.trial_by_trial)
-        elif self.task == 'task6':
-            self.summary = summarize.get6(self.trial_by_trial)
\ No newline at end of file
+        self.summary = summarize.SUMMARY_FUNCTIONS[self.task](self.trial_by_trial)
+
+
+class TrialTable(object):
+    """
+    Trial-by-trial data from a log file, stored as one column per header.
+    Columns where every value is an int, a float, or a bool are packed into
+    arrays; other columns are kept as lists (with repeated strings shared).
+
+    A TrialTable behaves like the list of dictionaries it replaces:
+
+    >>table = TrialTable(['TrialNum', 'Correct'], [[1, True], [2, False]])
+    >>len(table)
+    2
+    >>table[0]
+    {'TrialNum': 1, 'Correct': True}
+    >>[trial['Correct'] for trial in table]
+    [True, False]
+
+    A whole column can also be fetched at once, i.e., table['TrialNum'] or
+    table.column('TrialNum').
+    """
+
+    __slots__ = ('headers', 'length', 'widths', 'types', 'columns')
+
+    def __init__(self, headers=(), rows=()):
+        """
+        :param headers: a list of column names
+        :param rows: a list of lists of values, one for each trial.  As with
+                     dict(zip(headers, row)), values beyond the last header are
+                     dropped and headers beyond the end of a short row are left out
+                     of that trial's dictionary.
+        """
+        self.headers = shared_headers(headers)
+        self.length = len(rows)
+
+        # Keep track of the rows that are shorter than the list of headers, if there are any
+        width = len(self.headers)
+        widths = [min(len(row), width) for row in rows]
+        self.widths = array('B', widths) if any(w != width for w in widths) else None
+
+        self.types = []
+        self.columns = []
+        for i in range(width):
+            column_type, column = self.pack_column([row[i] if i < len(row) else None for row in rows])
+            self.types.append(column_type)
+            self.columns.append(column)
+
+    def __getstate__(self):
+        # Shared headers are pickled by name (see SCHEMA_NAMES)
+        return (PICKLE_VERSION, SCHEMA_NAMES.get(self.headers, self.headers), self.length, self.widths,
+                self.types, self.columns)
+
+    def __setstate__(self, state):
+        if isinstance(state, dict):  # Pickled before there were versions
+            state = (0, state['headers'], state['length'], state['widths'], state['types'], state['columns'])
+        check_pickle_version(state, TrialTable)
+
+        headers, self.length, self.widths, self.types, self.columns = state[1:]
+        if isinstance(headers, str):
+            self.headers = HEADER_SCHEMAS[headers]
+        else:
+            self.headers = shared_headers(headers)
+
+    @staticmethod
+    def pack_column(values):
+        """
+        Returns (column_type, column) where column holds the given values in the most
+        compact form available: an array for columns of ints ('int'), floats ('float')
+        or bools ('bool'), and a list otherwise (column_type None).
+        """
+        kinds = set(type(value) for value in values)
+
+        if kinds == set([int]):
+            return 'int', array('l', values)
+        elif kinds == set([float]):
+            return 'float', array('d', values)
+        elif kinds == set([bool]):
+            return 'bool', array('b', values)
+        else:
+            return None, [intern(value) if type(value) is str else value for value in values]
+
+    def __len__(self):
+        return self.length
+
+    def __repr__(self):
+        return '<TrialTable: %d trials of %s>' % (self.length, ", ".join(self.headers))
+
+    def column(self, header):
+        """
+        Returns the values in the named column, one for each trial, as an array
+        (for columns of ints or floats) or a list.
+        """
+        i = self.headers.index(header)
+        if self.types[i] == 'bool':
+            return map(bool, self.columns[i])
+        return self.columns[i]
+
+    def row(self, index):
+        """
+        Returns a dictionary of the data for the trial at the given index.
+        """
+        width = self.widths[index] if self.widths is not None else len(self.headers)
+        trial = {}
+        for i in range(width):
+            value = self.columns[i][index]
+            trial[self.headers[i]] = bool(value) if self.types[i] == 'bool' else value
+        return trial
+
+    def __getitem__(self, index):
+        if isinstance(index, basestring):
+            return self.column(index)
+        elif isinstance(index, slice):
+            return [self.row(i) for i in xrange(*index.indices(self.length))]
+
+        if index < 0:
+            index += self.length
+        if not 0 <= index < self.length:
+            raise IndexError("TrialTable index out of range")
+        return self.row(index)
+
+    def __iter__(self):
+        columns = [self.column(header) for header in self.headers]
+
+        if self.widths is None:
+            for values in izip(*columns):
+                yield dict(izip(self.headers, values))
+        else:
+            for width, values in izip(self.widths, izip(*columns)):
+                yield dict(izip(self.headers[:width], values))
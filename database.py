@@ -0,0 +1,456 @@
+"""
+The Database class, which stores Subject data in an SQLite database
+file, is defined here.  Subjects are split across four tables:
+
+subjects: one row per subject (key, ID, group, sibling)
+files: one row per log file (subject key, task, file name, device, date, time)
+trials: the practice and trial-by-trial data for each log file, as pickled TrialTables
+summaries: one row per summary statistic per log file (subject key, task, field, value)
+
+Files are indexed by task, device and date and subjects by group, so part
+of a cohort can be pulled out without loading everyone.  A Database can be
+used much like the shelve database it replaces, i.e., a dictionary of
+Subject instances keyed by subject key:
+
+>>db = Database("YL_DATABASE.sqlite")
+>>len(db)
+>>db['PE121001'].data['task1'].summary
+>>db.keys(group='12')
+
+Practice and trial-by-trial data are only read from the file the first time
+they are used, so pulling summaries for a whole cohort doesn't unpickle any
+trials.  Use summaries() to get the summary data without building Subjects at all.
+
+Changes are written in a single transaction when commit() or close() is called.
+"""
+
+import os
+import sqlite3
+import cPickle as pickle
+from functools import partial
+from itertools import groupby
+from operator import itemgetter
+
+import data_classes as dat
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS subjects (
+    key TEXT PRIMARY KEY,
+    id TEXT,
+    grp TEXT,
+    sibling INTEGER
+);
+CREATE TABLE IF NOT EXISTS files (
+    key TEXT,
+    task TEXT,
+    filename TEXT,
+    device TEXT,
+    date TEXT,
+    iso_date TEXT,
+    time TEXT,
+    PRIMARY KEY (key, task)
+);
+CREATE TABLE IF NOT EXISTS trials (
+    key TEXT,
+    task TEXT,
+    practice BLOB,
+    trial_by_trial BLOB,
+    PRIMARY KEY (key, task)
+);
+CREATE TABLE IF NOT EXISTS summaries (
+    key TEXT,
+    task TEXT,
+    field TEXT,
+    value,
+    PRIMARY KEY (key, task, field)
+);
+CREATE INDEX IF NOT EXISTS subjects_group ON subjects (grp);
+CREATE INDEX IF NOT EXISTS files_task ON files (task);
+CREATE INDEX IF NOT EXISTS files_device ON files (device);
+CREATE INDEX IF NOT EXISTS files_date ON files (iso_date);
+"""
+
+
+def iso_date(date):
+    """
+    Converts a date in the format used in log file names, i.e., '5/15/2013',
+    to one that sorts in date order, i.e., '2013-05-15'.
+    """
+    try:
+        month, day, year = (int(x) for x in date.split("/"))
+    except ValueError:
+        return None
+    return "%04d-%02d-%02d" % (year, month, day)
+
+
+class Database:
+    """
+    A dictionary-like store of Subject instances, backed by an SQLite file.
+    """
+
+    def __init__(self, path):
+        """
+        :param path: path to the database file.  It is created if it doesn't exist.
+        """
+        self.path = path
+        self.connection = sqlite3.connect(path)
+        self.connection.text_factory = str
+
+        # Write-ahead logging lets other processes keep reading while we write
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.executescript(SCHEMA)
+
+    def __len__(self):
+        return self.connection.execute("SELECT COUNT(*) FROM subjects").fetchone()[0]
+
+    def __contains__(self, key):
+        return self.connection.execute("SELECT 1 FROM subjects WHERE key = ?", (key,)).fetchone() is not None
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def keys(self, group=None, sibling=None, device=None, task=None, since=None, until=None):
+        """
+        Returns a sorted list of subject keys, optionally only for the subjects in
+        a given group, of a given sibling status, or with a log file for the given
+        task, from the given device, or from between the dates since and until
+        (inclusive, as '5/15/2013' or '2013-05-15').
+        """
+        query, values = self.key_query(group, sibling, device, task, since, until)
+        return [row[0] for row in self.connection.execute(query + " ORDER BY subjects.key", values)]
+
+    def key_query(self, group=None, sibling=None, device=None, task=None, since=None, until=None):
+        """
+        Returns (query, values): an SQL query for the subject keys selected by
+        the arguments (see keys()), and the values for its placeholders.
+        """
+        query = "SELECT DISTINCT subjects.key FROM subjects"
+        if (device, task, since, until) != (None, None, None, None):
+            query += " JOIN files ON files.key = subjects.key"
+        where, values = self.where(group, sibling, device, task, since, until)
+        return query + where, values
+
+    def where(self, group=None, sibling=None, device=None, task=None, since=None, until=None):
+        """
+        Returns (where, values): an SQL WHERE clause on the subjects and files tables for
+        the arguments (see keys()), or "" if there are none, and the values for its placeholders.
+        """
+        conditions = []
+        values = []
+
+        if group is not None:
+            conditions.append("subjects.grp = ?")
+            values.append(group)
+        if sibling is not None:
+            conditions.append("subjects.sibling = ?")
+            values.append(int(sibling))
+        if device is not None:
+            conditions.append("files.device = ?")
+            values.append(device)
+        if task is not None:
+            conditions.append("files.task = ?")
+            values.append(task)
+        if since is not None:
+            conditions.append("files.iso_date >= ?")
+            values.append(iso_date(since) or since)
+        if until is not None:
+            conditions.append("files.iso_date <= ?")
+            values.append(iso_date(until) or until)
+
+        if not conditions:
+            return "", values
+        return " WHERE " + " AND ".join(conditions), values
+
+    def summaries(self, group=None, sibling=None, device=None, task=None, since=None, until=None):
+        """
+        Returns the summary data for the subjects selected by the arguments (see keys()),
+        straight from the summaries table, without loading any trial data.
+
+        :return: a dictionary mapping subject keys to dictionaries of summary data by task,
+                 i.e., {'PE121001': {'task1': {'T1_ScoreAllTrials': 2.5, ...}, ...}, ...}
+        """
+        query = "SELECT key, task, field, value FROM summaries"
+        values = []
+        if (group, sibling, device, task, since, until) != (None, None, None, None, None, None):
+            key_query, values = self.key_query(group, sibling, device, task, since, until)
+            query += " WHERE key IN (%s)" % key_query
+
+        summaries = {}
+        for key, file_task, field, value in self.connection.execute(query, values):
+            summaries.setdefault(key, {}).setdefault(file_task, {})[field] = value
+        return summaries
+
+    def subjects(self, group=None, sibling=None, device=None, task=None, since=None, until=None):
+        """
+        Yields a Subject instance, with its trial data already loaded, for every subject
+        in the database, in key order, reading each table once from start to finish
+        rather than looking subjects up one at a time.  This is the quick way to go
+        through everyone (see export.write_database).
+
+        The arguments work as in keys(), except that device, task, since and until pick
+        out log files rather than subjects: each Subject only has data for the log files
+        for that task, from that device, or from between those dates.
+        """
+        where, values = self.where(group, sibling, device, task, since, until)
+        files = self.connection.execute(
+            "SELECT files.key, subjects.id, subjects.grp, subjects.sibling, files.task, files.filename, "
+            "files.device, files.date, files.time, trials.practice, trials.trial_by_trial "
+            "FROM files JOIN subjects ON subjects.key = files.key "
+            "LEFT JOIN trials ON trials.key = files.key AND trials.task = files.task"
+            "%s ORDER BY files.key, files.task" % where, values)
+
+        # Summaries come in the same order as files, so the two are read side by side
+        summaries = self.connection.execute(
+            "SELECT summaries.key, summaries.task, summaries.field, summaries.value FROM summaries "
+            "JOIN files ON files.key = summaries.key AND files.task = summaries.task "
+            "JOIN subjects ON subjects.key = files.key"
+            "%s ORDER BY summaries.key, summaries.task" % where, values)
+        next_summary = next(summaries, None)
+
+        for key, rows in groupby(files, itemgetter(0)):
+            subject = None
+            for key, ID, group, sibling, task, filename, device, date, time, practice, trial_by_trial in rows:
+                if subject is None:
+                    subject = dat.Subject(ID, group, bool(sibling), key)
+
+                summary = {}
+                while next_summary is not None and next_summary[:2] <= (key, task):
+                    if next_summary[:2] == (key, task):
+                        summary[next_summary[2]] = next_summary[3]
+                    next_summary = next(summaries, None)
+
+                data_file = self.stored_data_file(subject, task, filename, device, date, time, summary)
+                if practice is not None:
+                    del data_file._trial_loader
+                    data_file.practice = pickle.loads(str(practice))
+                    data_file.trial_by_trial = pickle.loads(str(trial_by_trial))
+                subject.add_data(task, data_file)
+
+            yield subject
+
+    def tasks(self, key):
+        """
+        Returns the set of tasks for which data are stored for the given subject.
+        """
+        return set(row[0] for row in self.connection.execute("SELECT task FROM files WHERE key = ?", (key,)))
+
+    def __getitem__(self, key):
+        row = self.connection.execute("SELECT id, grp, sibling FROM subjects WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            raise KeyError(key)
+
+        subject = dat.Subject(row[0], row[1], bool(row[2]), key)
+
+        summaries = {}
+        for task, field, value in self.connection.execute(
+                "SELECT task, field, value FROM summaries WHERE key = ?", (key,)):
+            summaries.setdefault(task, {})[field] = value
+
+        for task, filename, device, date, time in self.connection.execute(
+                "SELECT task, filename, device, date, time FROM files WHERE key = ?", (key,)):
+            subject.add_data(task, self.stored_data_file(subject, task, filename, device, date, time,
+                                                         summaries.get(task, {})))
+
+        return subject
+
+    def stored_data_file(self, subject, task, filename, device, date, time, summary):
+        """
+        Returns a DataFile for one of subject's stored log files, whose trial data
+        are loaded from the database the first time they are used.
+        """
+        data_file = dat.DataFile()
+        data_file.filename = filename
+        data_file.task = task
+        data_file.key = subject.key
+        data_file.ID = subject.ID
+        data_file.group = subject.group
+        data_file.sibling = subject.sibling
+        data_file.device = device
+        data_file.date = date
+        data_file.time = time
+        data_file.set_task_headers()
+        data_file.set_practice_headers()
+        data_file.summary = summary
+        data_file._trial_loader = partial(self.load_trials, subject.key, task)
+        return data_file
+
+    def load_trials(self, key, task):
+        """
+        Reads the practice and trial-by-trial data stored for a subject and task.
+
+        :return: a tuple of TrialTables, (practice, trial_by_trial)
+        """
+        row = self.connection.execute("SELECT practice, trial_by_trial FROM trials WHERE key = ? AND task = ?",
+                                      (key, task)).fetchone()
+        if row is None:
+            raise KeyError((key, task))
+        return tuple(pickle.loads(str(x)) for x in row)
+
+    def __setitem__(self, key, subject):
+        """
+        Stores subject under key, replacing anything already stored for that subject.
+        """
+        # The subject may have come from this database, with its trials not yet loaded
+        for data_file in subject.data.values():
+            data_file.load_trials()
+        self.__delitem__(key, missing_ok=True)
+        self.put_subject(subject)
+
+    def __delitem__(self, key, missing_ok=False):
+        if not missing_ok and key not in self:
+            raise KeyError(key)
+        for table in ('subjects', 'files', 'trials', 'summaries'):
+            self.connection.execute("DELETE FROM %s WHERE key = ?" % table, (key,))
+
+    def put_subject(self, subject, tasks=None):
+        """
+        Adds or updates a subject's record and stores the data for the given tasks,
+        replacing any data already stored for those tasks.  Data stored for other
+        tasks are left alone.
+
+        :param subject: a Subject instance
+        :param tasks: an optional list of tasks from subject.data to store.  By default,
+                      all of them are stored.
+        """
+        if tasks is None:
+            tasks = subject.data.keys()
+
+        self.connection.execute("INSERT OR REPLACE INTO subjects (key, id, grp, sibling) VALUES (?, ?, ?, ?)",
+                                (subject.key, subject.ID, subject.group, int(subject.sibling)))
+
+        for task in tasks:
+            data_file = subject.data[task]
+            self.connection.execute("DELETE FROM summaries WHERE key = ? AND task = ?", (subject.key, task))
+            self.connection.execute(
+                "INSERT OR REPLACE INTO files (key, task, filename, device, date, iso_date, time) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (subject.key, task, data_file.filename, data_file.device, data_file.date, iso_date(data_file.date),
+                 data_file.time))
+            self.connection.execute(
+                "INSERT OR REPLACE INTO trials (key, task, practice, trial_by_trial) VALUES (?, ?, ?, ?)",
+                (subject.key, task, sqlite3.Binary(pickle.dumps(data_file.practice, pickle.HIGHEST_PROTOCOL)),
+                 sqlite3.Binary(pickle.dumps(data_file.trial_by_trial, pickle.HIGHEST_PROTOCOL))))
+            self.connection.executemany(
+                "INSERT INTO summaries (key, task, field, value) VALUES (?, ?, ?, ?)",
+                [(subject.key, task, field, value) for field, value in dict(data_file.summary).iteritems()])
+
+    def put_summary(self, key, task, summary):
+        """
+        Replaces the summary data stored for one of a subject's tasks, leaving the rest
+        of what is stored for the subject, trial data included, alone.
+
+        :param key: the subject's key
+        :param task: the task whose summary to replace, i.e., 'task4'
+        :param summary: a dictionary of summary statistics (see summarize.py)
+        """
+        self.connection.execute("DELETE FROM summaries WHERE key = ? AND task = ?", (key, task))
+        self.connection.executemany(
+            "INSERT INTO summaries (key, task, field, value) VALUES (?, ?, ?, ?)",
+            [(key, task, field, value) for field, value in dict(summary).iteritems()])
+
+    def merge(self, path):
+        """
+        Copies everything stored in another database file (i.e., one written by a sharded
+        run of build_database.py) into this one.  Where both databases have data for the
+        same subject and task, the data from the other database replace the data here.
+
+        :param path: path to the other database file
+        :return: a sorted list of (task, key) tuples, one for every subject and task that was
+                 already stored here before the merge
+        """
+        self.connection.commit()  # Databases can't be attached in the middle of a transaction
+        self.connection.execute("ATTACH DATABASE ? AS other", (path,))
+        try:
+            duplicates = sorted((task, key) for key, task in self.connection.execute(
+                "SELECT key, task FROM other.files INTERSECT SELECT key, task FROM main.files"))
+
+            # Summaries are stored one row per field, so clear out the old ones first
+            self.connection.execute(
+                "DELETE FROM main.summaries WHERE EXISTS (SELECT 1 FROM other.files "
+                "WHERE other.files.key = summaries.key AND other.files.task = summaries.task)")
+            for table in ('subjects', 'files', 'trials', 'summaries'):
+                self.connection.execute("INSERT OR REPLACE INTO main.%s SELECT * FROM other.%s" % (table, table))
+            self.connection.commit()
+        finally:
+            self.connection.execute("DETACH DATABASE other")
+
+        return duplicates
+
+    def clear(self):
+        """
+        Deletes all data from the database.
+        """
+        for table in ('subjects', 'files', 'trials', 'summaries'):
+            self.connection.execute("DELETE FROM %s" % table)
+
+    def commit(self):
+        self.connection.commit()
+
+    def close(self):
+        """
+        Commits any changes and closes the database file.
+        """
+        self.connection.commit()
+        self.connection.close()
+
+
+def find_shelve(database_file):
+    """
+    Returns the path to the shelve database that older versions of build_database.py
+    kept where database_file is now, i.e., 'YL_DATABASE' for 'YL_DATABASE.sqlite',
+    or None if there isn't one.
+    """
+    shelve_file = os.path.splitext(database_file)[0]
+    if shelve_file == database_file:
+        return None
+
+    # Depending on the dbm module, a shelve is stored in one file or several
+    for suffix in ('', '.db', '.dat', '.dir', '.pag'):
+        if os.path.isfile(shelve_file + suffix):
+            return shelve_file
+    return None
+
+
+def upgrade_shelve(database_file):
+    """
+    If database_file doesn't exist yet, but there is a shelve database from an older
+    version of build_database.py in its place (see find_shelve), copies the shelve
+    into a new database_file.  Otherwise, does nothing.
+
+    :return: True if a shelve was copied
+    """
+    shelve_file = find_shelve(database_file)
+    if shelve_file is None or os.path.exists(database_file):
+        return False
+
+    # Copy into a temporary file first, so that a copy that is cut short is started
+    # over the next time rather than taken for the whole database
+    temp_file = database_file + ".tmp"
+    if os.path.exists(temp_file):
+        os.remove(temp_file)
+    db = Database(temp_file)
+    try:
+        import_shelve(shelve_file, db)
+    finally:
+        db.close()
+    os.rename(temp_file, database_file)
+    return True
+
+
+def import_shelve(shelve_file, db):
+    """
+    Copies every subject from a shelve database written by older versions of
+    build_database.py into db.
+
+    :param shelve_file: path to the shelve database, i.e., 'YL_DATABASE'
+    :param db: a Database instance
+    """
+    import shelve
+
+    old_db = shelve.open(shelve_file, "r")
+    try:
+        for key in old_db:
+            db[key] = old_db[key]
+    finally:
+        old_db.close()
+    db.commit()
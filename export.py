@@ -0,0 +1,185 @@
+"""
+Functions for writing subject data to the .csv output files.  Each of
+these writes data for many subjects through a single open file, rather
+than reopening the file once per subject.
+"""
+
+import csv
+import os
+
+import summarize
+
+# Columns identifying the subject at the start of each row of the summary file
+SUMMARY_ID_HEADERS = ['Key', 'SubID', 'Group', 'Sibling']
+
+# Every column of summary data, for all six tasks, in alphabetical (and so task) order
+SUMMARY_HEADERS = sorted(field for fields in summarize.SUMMARY_FIELDS.values() for field in fields)
+
+
+def write_summaries(subjects, out_file, overwrite=False):
+    """
+    Writes one row of summary data per subject to out_file.  Every row has a column
+    for every summary statistic of every task, so a subject who is missing a task
+    just gets empty cells for that task's columns.
+
+    :param subjects: an iterable of Subject instances
+    :param out_file: path to the summary .csv file
+    :param overwrite: if the file already exists, it is appended to (without a header
+                      row) unless overwrite is True, in which case it is replaced.
+    :return: None
+    """
+    # If the file already exists, we want to append to it
+    # without writing header rows.  However, if overwrite
+    # is true, the whole file will just be overwritten.
+    append = os.path.isfile(out_file) and not overwrite
+
+    with open(out_file, "a" if append else "w") as out:
+        writer = csv.DictWriter(out, SUMMARY_ID_HEADERS + SUMMARY_HEADERS)
+        if not append:
+            writer.writeheader()
+
+        for subject in subjects:
+            row = subject.summarize_data()
+            row.update(zip(SUMMARY_ID_HEADERS, [subject.key, subject.ID, subject.group, subject.sibling]))
+            writer.writerow(row)
+
+
+def write_database(db, summary_file, out_dir="", columnar_files=False, compress=False, **filters):
+    """
+    Rewrites the summary file and the task files from scratch with the data for every
+    subject in a database, or just the ones picked out by filters, without parsing any
+    log files.  The database is read in a single pass (see Database.subjects), one
+    subject at a time.
+
+    :param db: a database.Database instance
+    :param summary_file: path to the summary .csv file
+    :param out_dir: the directory in which to write the task files
+    :param columnar_files: if True, also write binary, column by column task files (see columnar.py)
+    :param compress: if True, compress the columns of those files
+    :param filters: optional group, sibling, device, task, since and until arguments for
+                    Database.subjects, i.e., group='12', since='2013-05-01'
+    :return: the number of subjects written
+    """
+    import columnar
+
+    writers = [TrialFileWriter(out_dir, overwrite=True)]
+    if columnar_files:
+        writers.append(columnar.ColumnarWriter(out_dir, overwrite=True, compress=compress))
+    count = [0]
+
+    def stored_subjects():
+        for subject in db.subjects(**filters):
+            for writer in writers:
+                writer.write_subject(subject)
+            count[0] += 1
+            yield subject
+
+    try:
+        write_summaries(stored_subjects(), summary_file, overwrite=True)
+    finally:
+        for writer in writers:
+            writer.close()
+    return count[0]
+
+
+class TrialFileWriter:
+    """
+    Writes trial-by-trial data to one .csv file per task (task1.csv, ..., task6.csv).
+    Each file is opened once, the first time data for its task are written, and
+    stays open until close() is called, so data for any number of subjects can be
+    written without reopening the files.  Example:
+
+    with TrialFileWriter(overwrite=True) as writer:
+        for sub in subjects:
+            writer.write_subject(subjects[sub])
+    """
+
+    # Columns identifying the subject and log file at the start of each row
+    id_headers = ['Key', 'SubID', 'Group', 'Sibling', 'Device', 'Time']
+
+    # Size of the write buffer for each open file
+    buffer_size = 1 << 16
+
+    def __init__(self, out_dir="", overwrite=False, file_names=None):
+        """
+        :param out_dir: the directory in which to write the task files
+        :param overwrite: if a task file already exists, it is appended to (without a
+                          header row) unless overwrite is True, in which case it is replaced.
+        :param file_names: an optional dictionary mapping task names to file names, for
+                           files that shouldn't be named after their task, i.e., {'task1': 'T1.csv'}
+        """
+        self.out_dir = out_dir
+        self.overwrite = overwrite
+        self.file_names = file_names or {}
+        self.files = {}    # Open file objects, by task
+        self.writers = {}  # csv.writer objects for the open files, by task
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def file_path(self, task):
+        """
+        Returns the path to the given task's file.
+        """
+        return os.path.join(self.out_dir, self.file_names.get(task, task + '.csv'))
+
+    def get_writer(self, task, headers):
+        """
+        Returns the csv.writer for the given task's file, opening the file (and
+        writing a header row, if it is new or being overwritten) if need be.  The
+        output directory is created if it doesn't exist yet.
+        """
+        if task not in self.writers:
+            out_file = self.file_path(task)
+            if self.out_dir and not os.path.isdir(self.out_dir):
+                os.makedirs(self.out_dir)
+            append = os.path.isfile(out_file) and not self.overwrite
+            self.files[task] = open(out_file, "a" if append else "w", self.buffer_size)
+            self.writers[task] = csv.writer(self.files[task])
+            if not append:
+                self.writers[task].writerow(self.id_headers + list(headers))
+
+        return self.writers[task]
+
+    def write(self, subject, task):
+        """
+        Writes every trial from one of subject's tasks to that task's file.
+
+        :param subject: a Subject instance
+        :param task: one of 'task1', 'task2', ..., 'task6'
+        :return: None
+        """
+        data_file = subject.data[task]
+        headers = data_file.task_headers
+        writer = self.get_writer(task, headers)
+
+        # The identifying columns are the same for every trial in the file
+        prefix = [subject.key, subject.ID, subject.group, subject.sibling, data_file.device, data_file.time]
+        writer.writerows([prefix + [trial.get(header, "") for header in headers]
+                          for trial in data_file.trial_by_trial])
+
+    def write_subject(self, subject):
+        """
+        Writes trial-by-trial data for all of subject's tasks.
+        """
+        for task in subject.data:
+            self.write(subject, task)
+
+    def flush(self):
+        """
+        Flushes everything written so far out to the task files, leaving them open.
+        """
+        for task in self.files:
+            self.files[task].flush()
+
+    def close(self):
+        """
+        Flushes and closes all of the open task files.
+        """
+        for task in self.files:
+            self.files[task].close()
+        self.files = {}
+        self.writers = {}
@@ -0,0 +1,375 @@
+"""
+Functions for turning a list of log files into DataFile objects.  Parsing
+and summarizing a log file doesn't depend on any other log file, so the
+work can be spread across several worker processes.  Results always come
+back in the same order as the files that were passed in, so the caller can
+merge them into the subjects dictionary exactly as if the files had been
+parsed one at a time.  On slow storage, files can also be read ahead of
+parsing by a pool of threads (see read_log_files).  Log files can also be
+read straight out of zip, tar and gzip archives (see archives.py).
+"""
+
+import StringIO
+import collections
+import hashlib
+import mmap
+import multiprocessing
+import os
+import zlib
+from multiprocessing.pool import ThreadPool
+
+import archives
+import data_classes as dat
+import exception_classes as e
+
+# The scandir package (a backport of os.scandir) lists large folders faster than
+# os.listdir, because it can tell files from folders without a stat() per file.
+try:
+    from scandir import scandir
+except ImportError:
+    scandir = None
+
+
+def parse_log_file(log_file):
+    """
+    Builds a DataFile instance from the log file at the given path.  Any error
+    raised while parsing is caught and returned as a message so that a single bad
+    file doesn't bring down a whole pool of workers.
+
+    :param log_file: the path to a YL log file
+    :return: a tuple, (log_file, data_file, error, stats).  If the file was parsed successfully,
+             data_file is a DataFile instance and error is None.  Otherwise, data_file is
+             None and error is a string describing the problem.  stats is a dictionary with
+             the size of the file in 'bytes', the md5 hex digest of its contents in 'md5', and
+             the seconds spent in each step of building the DataFile (see
+             instrumentation.RunReport.record_file).
+
+    A file on disk is memory-mapped, and both parsed and hashed from the mapping (see
+    parser_functions.row_reader), so it is never copied whole and adding it to the manifest
+    (see manifest.file_entry) doesn't mean reading it again.  A file inside an archive is
+    read into memory first (see parse_log_contents).
+    """
+    if archives.split_path(log_file)[0] is not None:
+        return parse_log_contents(*read_log_file(log_file))
+
+    stats = {}
+    try:
+        with open(log_file, "rb") as in_file:
+            stats['bytes'] = os.fstat(in_file.fileno()).st_size
+            stats['md5'] = file_md5(in_file)
+            return log_file, dat.DataFile(in_file, stage_times=stats), None, stats
+    except Exception as err:
+        return log_file, None, str(err), stats
+
+
+def file_md5(in_file):
+    """
+    Returns the md5 hex digest of an open file's contents, hashed straight from a memory
+    map of the file rather than from a copy of it.
+    """
+    try:
+        mapped = mmap.mmap(in_file.fileno(), 0, access=mmap.ACCESS_READ)
+    except (EnvironmentError, ValueError):  # An empty file can't be mapped
+        return hashlib.md5(in_file.read()).hexdigest()
+    try:
+        return hashlib.md5(mapped).hexdigest()
+    finally:
+        mapped.close()
+
+
+def parse_log_contents(log_file, contents, error=None):
+    """
+    Like parse_log_file, but for a log file that has already been read into memory
+    (see read_log_files).
+
+    :param log_file: the path the log file was read from
+    :param contents: the contents of the log file, as a string
+    :param error: if the file couldn't be read, a string describing the problem, which
+                  is passed straight through
+    :return: a tuple, (log_file, data_file, error, stats) (see parse_log_file)
+    """
+    stats = {}
+    if error is not None:
+        return log_file, None, error, stats
+
+    stats['bytes'] = len(contents)
+    stats['md5'] = hashlib.md5(contents).hexdigest()
+    in_file = StringIO.StringIO(contents)
+    in_file.name = log_file
+    try:
+        return log_file, dat.DataFile(in_file, stage_times=stats), None, stats
+    except Exception as err:
+        return log_file, None, str(err), stats
+
+
+def read_log_file(log_file):
+    """
+    Reads a whole log file, which may be inside an archive, into memory.
+
+    :return: a tuple, (log_file, contents, error).  If the file couldn't be read, contents
+             is None and error is a string describing the problem.
+    """
+    if archives.split_path(log_file)[0] is not None:
+        try:
+            return log_file, archives.read_member(log_file), None
+        except archives.ARCHIVE_ERRORS as err:
+            return log_file, None, str(err)
+
+    try:
+        with open(log_file, "rb") as in_file:
+            return log_file, in_file.read(), None
+    except EnvironmentError as err:
+        return log_file, None, str(err)
+
+
+def read_log_files(log_files, threads):
+    """
+    Reads log files into memory in a pool of threads, so that waiting on a slow disk
+    (a network drive or a synced folder, say) overlaps with parsing files that have
+    already been read.  Only a few files per thread are read ahead of the caller.
+
+    :param log_files: a list of paths to YL log files
+    :param threads: the number of threads reading files at once
+    :return: an iterator over (log_file, contents, error) tuples (see read_log_file) in the
+             same order as log_files
+    """
+    pool = ThreadPool(threads)
+    max_pending = threads * 4
+    pending = collections.deque()
+    try:
+        for log_file in log_files:
+            pending.append(pool.apply_async(read_log_file, (log_file,)))
+            if len(pending) >= max_pending:
+                yield pending.popleft().get()
+        while pending:
+            yield pending.popleft().get()
+        pool.close()
+    except:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+
+
+def parse_log_files(log_files, workers=1, prefetch=0):
+    """
+    Parses every file in log_files, using a pool of worker processes if more than
+    one worker is requested.
+
+    :param log_files: a list of paths to YL log files
+    :param workers: the number of processes to use (an int).  With workers <= 1 the files
+                    are parsed in the current process.
+    :param prefetch: if more than 0, the number of threads used to read files into memory
+                     ahead of parsing them (see read_log_files).  Otherwise each file is
+                     read as it is parsed.
+    :return: an iterator over (log_file, data_file, error, stats) tuples (see parse_log_file) in the
+             same order as log_files
+
+    Only a few files per worker are handed out ahead of the caller, so parsed files don't
+    pile up in memory if the caller is slower than the workers.  Files inside archives are
+    read out of them in this process, an archive at a time (see archives.read_members), so
+    they are read quickest if log_files is in archives.reading_order.
+    """
+    jobs = parse_jobs(log_files, prefetch)
+
+    if workers <= 1 or len(log_files) <= 1:
+        for function, args in jobs:
+            yield function(*args)
+        return
+
+    pool = multiprocessing.Pool(min(workers, len(log_files)))
+    max_pending = workers * 4
+    pending = collections.deque()
+    try:
+        for function, args in jobs:
+            pending.append(pool.apply_async(function, args))
+            if len(pending) >= max_pending:
+                yield pending.popleft().get()
+        while pending:
+            yield pending.popleft().get()
+        pool.close()
+    except:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+
+
+def parse_jobs(log_files, prefetch=0):
+    """
+    Yields a (function, args) job for each of log_files, which parses the file when
+    function(*args) is called (see parse_log_files).
+    """
+    archived = set(log_file for log_file in log_files if archives.split_path(log_file)[0] is not None)
+    members = archives.read_members([log_file for log_file in log_files if log_file in archived])
+    if prefetch > 0:
+        reads = read_log_files([log_file for log_file in log_files if log_file not in archived], prefetch)
+
+    for log_file in log_files:
+        if log_file in archived:
+            yield parse_log_contents, next(members)
+        elif prefetch > 0:
+            yield parse_log_contents, next(reads)
+        else:
+            yield parse_log_file, (log_file,)
+
+
+def read_file_name(log_file):
+    """
+    Reads the subject, task, etc. from the name of a log file, without opening it.
+
+    :param log_file: the path to a YL log file
+    :return: a DataFile instance with only the attributes set by DataFile.parse_file_name
+             filled in, or None if the name doesn't follow the naming convention
+    """
+    name_data = dat.DataFile()
+    try:
+        name_data.parse_file_name(os.path.basename(log_file))
+    except (e.BadFileNameError, ValueError):
+        return None
+    return name_data
+
+
+def list_folder(log_folder):
+    """
+    Returns the paths to the files (not folders) in log_folder, using scandir if it is installed.
+    """
+    if scandir is None:
+        return [os.path.join(log_folder, name) for name in os.listdir(log_folder)]
+    return [entry.path for entry in scandir(log_folder) if entry.is_file()]
+
+
+def scan_log_folders(log_folders):
+    """
+    Lists the files in each of log_folders and checks their names against the log
+    file naming convention (see DataFile.parse_file_name), without opening any of them.
+    The files inside any archives in the folders are listed too (see archives.py).
+
+    :param log_folders: a list of paths to folders of log files, or to archives of log files
+    :return: a tuple, (log_files, bad_files), where log_files is a list of paths to files
+             with valid names, sorted by subject key, task and path, and bad_files is a
+             list of (path, error) tuples, one for each file whose name can't be read
+    """
+    planned = []
+    bad_files = []
+    for log_folder in log_folders:
+        if archives.is_archive(log_folder):
+            folder_files = archives.list_paths(log_folder)
+        else:
+            folder_files = []
+            for path in list_folder(log_folder):
+                if archives.is_archive(path):
+                    try:
+                        folder_files.extend(archives.list_paths(path))
+                    except archives.ARCHIVE_ERRORS as err:
+                        bad_files.append((path, str(err)))
+                else:
+                    folder_files.append(path)
+
+        for log_file in folder_files:
+            name_data = dat.DataFile()
+            try:
+                name_data.parse_file_name(os.path.basename(log_file))
+            except (e.BadFileNameError, ValueError) as err:
+                bad_files.append((log_file, str(err)))
+                continue
+            planned.append((name_data.key, name_data.task, log_file))
+
+    planned.sort()
+    bad_files.sort()
+    return [log_file for key, task, log_file in planned], bad_files
+
+
+def drop_duplicate_files(log_files):
+    """
+    Finds files that are for the same subject and task, judging by their names, and
+    keeps only the last of each such group, which is the one that would win if all
+    of the files were parsed.  Files with names that can't be read are kept, so that
+    the problem is reported when they are parsed.
+
+    :param log_files: a sorted list of paths to YL log files
+    :return: a tuple, (kept_files, duplicates, fallbacks), where kept_files is a list of the
+             paths to keep, in their original order, duplicates is a list of the (task, key)
+             tuples for every file that was dropped, and fallbacks maps each kept file that
+             had duplicates to a list of the files dropped in its favour, the last by name
+             first, to be parsed instead if it can't be (see parse_fallbacks)
+    """
+    file_task = {}
+    for log_file in log_files:
+        name_data = read_file_name(log_file)
+        if name_data is not None:
+            file_task[log_file] = (name_data.task, name_data.key)
+
+    winners = {}
+    for log_file in log_files:
+        if log_file in file_task:
+            winners[file_task[log_file]] = log_file
+
+    kept_files = [log_file for log_file in log_files
+                  if log_file not in file_task or winners[file_task[log_file]] == log_file]
+    duplicates = []
+    fallbacks = {}
+    for log_file in reversed(log_files):
+        if log_file in file_task and winners[file_task[log_file]] != log_file:
+            duplicates.append(file_task[log_file])
+            fallbacks.setdefault(winners[file_task[log_file]], []).append(log_file)
+    duplicates.reverse()
+
+    return kept_files, duplicates, fallbacks
+
+
+def parse_fallbacks(parsed_files, fallbacks):
+    """
+    Passes on the (log_file, data_file, error, stats) tuples from parse_log_files, but
+    when a file that had duplicates can't be parsed, its duplicates are parsed in its
+    place, one at a time, until one of them can be, so that the subject's data for that
+    task aren't lost.  The results for the duplicates follow the failed file's.
+
+    :param parsed_files: an iterator over (log_file, data_file, error, stats) tuples
+    :param fallbacks: a dictionary mapping log files to lists of files to try instead
+                      (see drop_duplicate_files)
+    """
+    for log_file, data_file, error, stats in parsed_files:
+        yield log_file, data_file, error, stats
+        if error is None:
+            continue
+        for fallback in fallbacks.get(log_file, []):
+            result = parse_log_file(fallback)
+            yield result
+            if result[2] is None:
+                break
+
+
+# The ways in which log files can be split into shards, and the part of the file name each one uses
+SHARD_FIELDS = {'key': lambda name_data: name_data.key,
+                'group': lambda name_data: name_data.group,
+                'prefix': lambda name_data: name_data.key[:2].upper()}
+
+
+def select_shard(log_files, shard, n_shards, by='key'):
+    """
+    Picks out the log files that belong to one of n_shards shards, so that the log files
+    can be split between several runs (on one machine or several) whose databases are
+    merged afterwards (see database.Database.merge).  Every file for a given subject
+    lands in the same shard, and the same file always lands in the same shard, no matter
+    which machine the run is on.  Files with names that can't be read all go to shard 0,
+    so that each of them is reported exactly once.
+
+    :param log_files: a list of paths to YL log files
+    :param shard: which shard to keep, from 0 to n_shards - 1
+    :param n_shards: the number of shards the files are split into
+    :param by: what the files are split by: the subject 'key', the subject 'group', or
+               the 'prefix' at the start of the subject key (i.e., 'PE' for Peru)
+    :return: a list of the paths in log_files that belong to the shard, in their original order
+    """
+    field = SHARD_FIELDS[by]
+    selected = []
+    for log_file in log_files:
+        name_data = read_file_name(log_file)
+        if name_data is None:
+            file_shard = 0
+        else:
+            file_shard = (zlib.crc32(field(name_data)) & 0xffffffff) % n_shards
+        if file_shard == shard:
+            selected.append(log_file)
+    return selected
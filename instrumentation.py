@@ -0,0 +1,121 @@
+"""
+The RunReport class, which records where the time goes during a run of
+build_database.py, is defined here.  It keeps track of:
+
+stages: total wall time for each stage of the run (listing files, parsing,
+        writing the database, writing the summary and task files, ...)
+tasks: for each task, the number of files parsed, the bytes read, and the
+       time spent in each step of DataFile (parse_file_name, parse_file_data,
+       summarize), summed over all files
+files: the number of files listed, parsed, and skipped because of errors
+slowest_files: the files that took longest to parse
+
+The report is written out as JSON at the end of the run, i.e.:
+
+{"stages": {"list": 0.21, "parse": 14.2, "database": 1.3, ...},
+ "tasks": {"task1": {"files": 206, "bytes": 512310, "parse_file_data": 1.2, ...}, ...},
+ "files": {"listed": 1237, "parsed": 1236, "failed": 1},
+ "slowest_files": [{"file": "...", "task": "task3", "seconds": 0.052}, ...]}
+"""
+
+import json
+import time
+from contextlib import contextmanager
+
+# The steps of building a DataFile that are timed for every log file (see DataFile.__init__)
+DATA_FILE_STEPS = ['parse_file_name', 'parse_file_data', 'summarize']
+
+
+class RunReport:
+    """
+    Collects timing information over a run.  Example:
+
+    report = RunReport()
+    with report.stage('list'):
+        files = os.listdir(folder)
+    report.write("RUN_REPORT.json")
+    """
+
+    def __init__(self, n_slowest=20):
+        """
+        :param n_slowest: how many of the slowest files to keep track of
+        """
+        self.start = time.time()
+        self.stages = {}
+        self.tasks = {}
+        self.files = {'listed': 0, 'parsed': 0, 'failed': 0}
+        self.slowest_files = []
+        self.n_slowest = n_slowest
+
+    def add_time(self, stage, seconds):
+        self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+
+    @contextmanager
+    def stage(self, stage):
+        """
+        A context manager that adds the time spent in its block to the named stage.
+        """
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.add_time(stage, time.time() - start)
+
+    def timed(self, stage, iterable):
+        """
+        Yields the items of iterable, adding the time spent waiting for each item
+        to the named stage.
+        """
+        iterator = iter(iterable)
+        while True:
+            start = time.time()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                self.add_time(stage, time.time() - start)
+                return
+            self.add_time(stage, time.time() - start)
+            yield item
+
+    def record_file(self, log_file, task, stats):
+        """
+        Records the statistics for one successfully parsed log file.
+
+        :param log_file: path to the log file
+        :param task: the file's task, i.e., 'task1'
+        :param stats: a dictionary with the number of 'bytes' in the file and the
+                      seconds spent in each of DATA_FILE_STEPS
+        """
+        self.files['parsed'] += 1
+
+        totals = self.tasks.setdefault(task, dict([('files', 0), ('bytes', 0)] +
+                                                  [(step, 0.0) for step in DATA_FILE_STEPS]))
+        totals['files'] += 1
+        totals['bytes'] += stats.get('bytes', 0)
+        for step in DATA_FILE_STEPS:
+            totals[step] += stats.get(step, 0.0)
+
+        seconds = sum(stats.get(step, 0.0) for step in DATA_FILE_STEPS)
+        self.slowest_files.append({'file': log_file, 'task': task, 'seconds': seconds})
+        if len(self.slowest_files) > 2 * self.n_slowest:
+            self.trim_slowest()
+
+    def record_failure(self):
+        self.files['failed'] += 1
+
+    def trim_slowest(self):
+        self.slowest_files.sort(key=lambda entry: entry['seconds'], reverse=True)
+        del self.slowest_files[self.n_slowest:]
+
+    def as_dict(self):
+        self.trim_slowest()
+        return {'total_seconds': time.time() - self.start, 'stages': self.stages, 'tasks': self.tasks,
+                'files': self.files, 'bytes_read': sum(totals['bytes'] for totals in self.tasks.values()),
+                'slowest_files': self.slowest_files}
+
+    def write(self, report_file):
+        """
+        Writes the report to report_file as JSON.
+        """
+        with open(report_file, "w") as out:
+            json.dump(self.as_dict(), out, indent=2, sort_keys=True)
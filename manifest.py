@@ -0,0 +1,197 @@
+"""
+Functions for keeping track of which log files have already been
+ingested.  The manifest is a dictionary keyed by the absolute path of
+each log file that has been parsed successfully.  Each entry records:
+
+size: the size of the file in bytes when it was parsed
+mtime: the modification time of the file when it was parsed (for a file
+       inside an archive, the size and mtime recorded in the archive)
+md5: an md5 hex digest of the file's contents
+key: the key of the subject the file belongs to, i.e., 'PE211005'
+task: the task recorded in the file, one of 'task1', 'task2', ..., 'task6'
+
+key and task point at the parsed DataFile (and its summary) in the
+database, i.e., db[key].data[task], so a file that hasn't changed never
+needs to be parsed again.  A file is only re-parsed if it is new, or if
+both its size/mtime and its contents have changed since it was recorded.
+A file at a path that isn't in the manifest isn't new if a file with the
+same name and the same size and mtime, or the same contents, is (i.e.,
+when the log folder has been moved or renamed).
+"""
+
+import hashlib
+import os
+import cPickle as pickle
+
+import archives
+
+
+def load_manifest(manifest_file):
+    """
+    Loads a manifest pickled by save_manifest.  Older versions of build_database.py
+    pickled a set of file basenames instead; these are carried over as entries
+    with no signature, which are filled in the next time the file is seen.
+
+    :param manifest_file: path to the pickled manifest
+    :return: a manifest dictionary (empty if manifest_file doesn't exist)
+    """
+    if not os.path.isfile(manifest_file):
+        return {}
+
+    with open(manifest_file, "rb") as f:
+        manifest = pickle.load(f)
+
+    if not isinstance(manifest, dict):
+        manifest = dict((name, None) for name in manifest)
+
+    return manifest
+
+
+def save_manifest(manifest, manifest_file):
+    """
+    Pickles the manifest to manifest_file.  The file is replaced in one step, so a run
+    killed while saving leaves the old manifest whole.
+    """
+    write_atomically(manifest_file, pickle.dumps(manifest, pickle.HIGHEST_PROTOCOL))
+
+
+def write_atomically(out_file, contents):
+    """
+    Writes contents to out_file by way of a temporary file that replaces it once the
+    contents are safely on disk, so out_file is never left half-written.
+    """
+    temp_file = out_file + ".tmp"
+    with open(temp_file, "wb") as out:
+        out.write(contents)
+        out.flush()
+        os.fsync(out.fileno())
+    if os.name == 'nt' and os.path.exists(out_file):
+        os.remove(out_file)  # os.rename can't replace a file on Windows
+    os.rename(temp_file, out_file)
+
+
+def content_hash(log_file):
+    """
+    Returns the md5 hex digest of the contents of the file at log_file.
+    """
+    if archives.split_path(log_file)[0] is not None:
+        return hashlib.md5(archives.read_member(log_file)).hexdigest()
+
+    md5 = hashlib.md5()
+    with open(log_file, "rb") as f:
+        for block in iter(lambda: f.read(65536), ""):
+            md5.update(block)
+    return md5.hexdigest()
+
+
+def file_entry(log_file, key, task, md5=None):
+    """
+    Builds a manifest entry for the file at log_file.
+
+    :param log_file: path to a log file
+    :param key: the key of the subject the file belongs to
+    :param task: the task recorded in the file
+    :param md5: the file's content hash, if it is already known
+    :return: a dictionary (see the module docstring)
+    """
+    size, mtime = archives.file_signature(log_file)
+    return {'size': size, 'mtime': mtime, 'md5': md5 or content_hash(log_file),
+            'key': key, 'task': task}
+
+
+def find_changes(manifest, log_files):
+    """
+    Sorts log_files into files that have never been ingested and files whose
+    contents have changed since they were.  The size and mtime of a file are
+    checked first, so unchanged files are never read.  Files that were touched
+    without their contents changing have their manifest entries updated in place,
+    and files that were parsed before under another path (see find_moved) have
+    theirs carried over to the new path.
+
+    :param manifest: a manifest dictionary
+    :param log_files: a list of paths to log files
+    :return: two lists of absolute paths, (new_files, changed_files)
+    """
+    new_files = []
+    changed_files = []
+    listed = set(os.path.abspath(log_file) for log_file in log_files)
+    by_name = None  # Paths in the manifest by file name, for files that seem to have moved
+
+    for log_file in log_files:
+        path = os.path.abspath(log_file)
+        entry = manifest.get(path)
+
+        if entry is None:
+            # Files recorded by name only (see load_manifest) are assumed to be the
+            # same files that were parsed before; just fill in their signature.
+            name = os.path.basename(path)
+            if name in manifest and manifest[name] is None:
+                del manifest[name]
+                manifest[path] = file_entry(path, None, None)
+                continue
+
+            # Otherwise the file may have been parsed before under another path
+            if by_name is None:
+                by_name = paths_by_name(manifest)
+            old_path = None
+            if by_name.get(name):
+                size, mtime = archives.file_signature(path)
+                old_path = find_moved(manifest, path, size, mtime, by_name[name])
+            if old_path is None:
+                new_files.append(path)
+                continue
+            manifest[path] = dict(manifest[old_path], size=size, mtime=mtime)
+            if old_path not in listed:
+                del manifest[old_path]
+                by_name[name].remove(old_path)
+            by_name[name].append(path)
+            continue
+
+        size, mtime = archives.file_signature(path)
+        if size == entry['size'] and mtime == entry['mtime']:
+            continue
+
+        md5 = content_hash(path)
+        if md5 == entry['md5']:
+            entry['size'] = size
+            entry['mtime'] = mtime
+        else:
+            changed_files.append(path)
+
+    return new_files, changed_files
+
+
+def paths_by_name(manifest):
+    """
+    Returns a dictionary mapping each file name in the manifest to a list of the paths
+    recorded under it.
+    """
+    by_name = {}
+    for path, entry in manifest.iteritems():
+        if entry is not None:
+            by_name.setdefault(os.path.basename(path), []).append(path)
+    return by_name
+
+
+def find_moved(manifest, path, size, mtime, old_paths):
+    """
+    Looks for the manifest entry of a file that has the same name as the file at path
+    and was recorded under another path.  The size and mtime are checked first, so the
+    file is only read if none of them match.
+
+    :param manifest: a manifest dictionary
+    :param path: the absolute path of a log file that isn't in the manifest
+    :param size: the size of the file, as returned by archives.file_signature
+    :param mtime: the modification time of the file, likewise
+    :param old_paths: the paths in the manifest with the same file name (see paths_by_name)
+    :return: the path of the matching entry, or None if there isn't one
+    """
+    for old_path in old_paths:
+        if manifest[old_path]['size'] == size and manifest[old_path]['mtime'] == mtime:
+            return old_path
+
+    md5 = content_hash(path)
+    for old_path in old_paths:
+        if manifest[old_path]['md5'] == md5:
+            return old_path
+    return None
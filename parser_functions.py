@@ -8,21 +8,25 @@ def read_log_file(task_number, logFile, task_headers, practice_headers):
     :param logFile: an open file object corresponding to a YL log file.
     :param task_headers: a list of names corresponding to the information we want to parse from the log file
     :param practice_headers: a list of names corresponding to data we wish to parse from practice trials in the log file
-    :return: two lists of dictionaries, one for practice data and one for task data.  The returned dictionary keys are
-             given by the names in practice_headers and task_headers, respectively
+    :return: two TrialTables (see data_classes.py), one for practice data and one for task data.  Each can be used
+             as a list of dictionaries, with keys given by the names in practice_headers and task_headers, respectively
 
     This function is called by the data_file class method, parse_file_data with arguments given by
     class attributes.
     """
 
-    import csv
-
-    logReader = csv.reader(logFile)
+    import data_classes as dat
 
     # Check if the task number argument is valid
     if task_number not in ['task1', 'task2', 'task3', 'task4', 'task5', 'task6']:
         raise e.TaskNameError(task_number)
 
+    # Tasks 1 and 6 only use the first eight columns of each line (see task1_get_data)
+    if task_number in ['task1', 'task6']:
+        logReader = row_reader(logFile, TASK1_COLUMNS)
+    else:
+        logReader = row_reader(logFile)
+
     # Skip over unused metadata at the top of the file (different tasks have different numbers of unused lines)
     if task_number in ['task1', 'task2']:
         skip_lines(logReader, 3)
@@ -33,13 +37,21 @@ def read_log_file(task_number, logFile, task_headers, practice_headers):
     task = []
     practice = []
 
+    # Look up a converter for each column read from the log file.  Tasks 1, 2, 3 and 6
+    # read the columns named in practice_headers (tasks 2 and 3 add some computed
+    # columns of their own to the task trials), while tasks 4 and 5 read the ones in task_headers.
+    if task_number in ['task4', 'task5']:
+        converters = get_converters(task_headers)
+    else:
+        converters = get_converters([header for header in practice_headers if header not in DERIVED_COLUMNS])
+
     # Call on task-specific parser functions to read data from log_file and store appropriate data in
     # task and practice lists
     if task_number == 'task1' or task_number == 'task6':
-        task1_get_data(logReader, practice, task)
+        task1_get_data(logReader, practice, task, converters)
 
     elif task_number == 'task2' or task_number == 'task3':
-        tasks23_get_data(logReader, practice, task)
+        tasks23_get_data(logReader, practice, task, converters)
 
         if task_number == 'task2':
             task_2_determine_switch(task)
@@ -47,15 +59,80 @@ def read_log_file(task_number, logFile, task_headers, practice_headers):
             task3_determine_dot_order(task)
 
     elif task_number == 'task4':
-        task4_get_data(logReader, practice, task)
+        task4_get_data(logReader, practice, task, converters)
 
     elif task_number == 'task5':
-        task5_get_data(logReader, practice, task)
+        task5_get_data(logReader, practice, task, converters)
 
-    # Return two lists of dictionaries, the first of which corresponds to practice data, the second of
+    # Return two TrialTables, the first of which corresponds to practice data, the second of
     # which holds the actual trial data.
-    return [dict(zip(practice_headers, trial)) for trial in practice], [dict(zip(task_headers, trial)) for trial in
-                                                                        task]
+    return dat.TrialTable(practice_headers, practice), dat.TrialTable(task_headers, task)
+
+
+# The number of leading columns of a task1 or task6 log file that are ever used
+TASK1_COLUMNS = 8
+
+
+def row_reader(logFile, max_columns=-1):
+    """
+    Returns an iterator over the lines of a log file, each split into a list of strings,
+    just as a csv.reader would.  Log files that are on disk are memory-mapped, and each
+    line is sliced straight out of the mapping as it is needed, so the file is never
+    copied whole; other file-like objects (i.e., a StringIO) are read().
+
+    Log files are simple comma-separated values, so lines are just split on commas.  A
+    file that has any quotes in it (or null bytes, which csv rejects) is handed to a
+    csv.reader instead, so quoted commas are handled as before.
+
+    :param logFile: an open file object corresponding to a YL log file.
+    :param max_columns: if given, only the first max_columns values of each line are split out,
+                        and the rest of the line is left, unsplit, as one more value at the end.
+                        Ignored for files that are read by csv.
+    :return: an iterator over the lines of the file, as lists of strings.  Blank lines
+             are empty lists.
+    """
+    import csv
+    import mmap
+
+    try:
+        mapped = mmap.mmap(logFile.fileno(), 0, access=mmap.ACCESS_READ)
+    except (AttributeError, EnvironmentError, ValueError):
+        # Not a file on disk (i.e., a StringIO), or an empty file, which can't be mapped
+        contents = logFile.read()
+    else:
+        # Lines ending in a lone carriage return can't be found by looking for newlines
+        carriage_return = mapped.find('\r')
+        if mapped.find('"') < 0 and mapped.find('\0') < 0 and (
+                carriage_return < 0 or mapped[carriage_return + 1:carriage_return + 2] == '\n'):
+            return mapped_rows(mapped, max_columns)
+        try:
+            contents = mapped[:]
+        finally:
+            mapped.close()
+
+    if '"' in contents or '\0' in contents:
+        return csv.reader(contents.splitlines(True))
+
+    return iter([line.split(',', max_columns) if line else [] for line in contents.splitlines()])
+
+
+def mapped_rows(mapped, max_columns=-1):
+    """
+    Yields the lines of a memory-mapped log file, split on commas (see row_reader), copying
+    out one line at a time.  The mapping is closed once every line has been read.
+    """
+    try:
+        size = len(mapped)
+        start = 0
+        while start < size:
+            end = mapped.find('\n', start)
+            if end < 0:
+                end = size
+            line = mapped[start:end].rstrip('\r')
+            start = end + 1
+            yield line.split(',', max_columns) if line else []
+    finally:
+        mapped.close()
 
 
 def cleaned_string(in_str):
@@ -106,37 +183,142 @@ def cleaned_string(in_str):
         return None
 
 
+def to_int(in_str):
+    """
+    Converter for columns that hold whole numbers, i.e., TrialNum.  Values that
+    don't look like whole numbers are handed to cleaned_string, so the result is
+    always the same as cleaned_string(in_str).
+    """
+    just_text = in_str.strip()
+    if just_text.isdigit():
+        return int(just_text)
+    return cleaned_string(in_str)
+
+
+def to_number(in_str):
+    """
+    Converter for columns that hold decimal numbers, i.e., ReactionTime.
+    Returns an int if there's no decimal point, like cleaned_string does.
+    """
+    just_text = in_str.strip()
+    if just_text.isdigit():
+        return int(just_text)
+    elif just_text.replace(".", "", 1).isdigit():
+        return float(just_text)
+    return cleaned_string(in_str)
+
+
+def to_percent(in_str):
+    """
+    Converter for columns that hold percentages, i.e., '91.43%' --> 91.43
+    """
+    just_text = in_str.strip()
+    if just_text.endswith("%") and just_text[:-1].replace(".", "", 1).isdigit():
+        return float(just_text[:-1])
+    return cleaned_string(in_str)
+
+
+def to_bool(in_str):
+    """
+    Converter for columns that hold true/false values, i.e., TimeOut.
+    """
+    just_text = in_str.strip().lower()
+    if just_text == 'true':
+        return True
+    elif just_text == 'false':
+        return False
+    return cleaned_string(in_str)
+
+
+def to_coordinate(in_str):
+    """
+    Converter for columns that hold (x;y) coordinates, i.e., '(263;369)' --> (263.0, 369.0)
+    """
+    just_text = in_str.strip().lower()
+    if ";" in just_text and "block" not in just_text:
+        return tuple(float(x.strip("()")) for x in just_text.split(";"))
+    return cleaned_string(in_str)
+
+
+def to_text(in_str):
+    """
+    Converter for columns that hold words, i.e., TargetSide.  Returns the
+    word in lower case.
+    """
+    just_text = in_str.strip().lower()
+    if just_text.isalpha() and just_text not in ('true', 'false') and "calculations" not in just_text:
+        return just_text
+    return cleaned_string(in_str)
+
+
+# The converter used for each named column.  Every converter goes straight to the
+# type expected for its column, and falls back on cleaned_string for anything
+# unexpected, so the parsed values are exactly what cleaned_string would give.
+# Columns that aren't listed here are converted with cleaned_string.
+COLUMN_CONVERTERS = {
+    'TrialNum': to_int, 'NumBadTouches': to_int, 'Score': to_number, 'TargetSide': to_text, 'TimeOut': to_bool,
+    'ReactionTime': to_number, 'TouchPosition': to_coordinate, 'DistanceFromCenter': to_number,
+    'PressedSide': to_text, 'Correct': to_int, 'NumDots': to_int, 'ShownDots': to_int, 'Delay': to_number,
+    'EarlyResponse': to_bool, 'DotPressed': to_int, 'PercentCorrect': to_percent,
+    'AvgDistanceFromCenter': to_number, 'AvgResponseTime': to_number, 'Task': to_int, 'EndCondition': to_text,
+    'Duration': to_number, 'NumGoodTouches': to_int, 'NumRepeats': to_int, 'AvgTimePerTarget': to_number,
+    'StandardDeviation': to_number, 'AvgTimePerAction': to_number, 'AvgTargetsPerArea': to_coordinate,
+    'AvgLocation': to_number, 'AvgFirstTen': to_number, 'AvgLastTen': to_number,
+    'AvgDistancePerTarget': to_number}
+
+# Columns that are computed by the parser functions rather than read from the log file
+DERIVED_COLUMNS = ['GoalSide', 'SwitchRule', 'SwitchSide', 'Rank', 'Score-incorrect only']
+
+
+def get_converters(headers):
+    """
+    :param headers: a list of column names, in the order they appear in the log file
+    :return: a list with the converter function (see COLUMN_CONVERTERS) for each column
+    """
+    return [COLUMN_CONVERTERS.get(header, cleaned_string) for header in headers]
+
+
 def skip_lines(reader, n):
     """
     Most of the log files have 2 or 3 lines at the top of the file containing some sort of metadata
     that isn't used in these analyses.  This function just skips the number of lines specified by argument, n.
-    :param reader: a csv reader object
+    :param reader: an iterator over the lines of a log file (see row_reader)
     :param n: the number of lines to skip (an int)
     """
     for i in xrange(n):
         reader.next()
 
 
-def get_values(line, indices):
+def get_values(line, indices, converters=None):
     """
-    Given a csv.reader line from a YL log file, this returns a list
+    Given a line from a YL log file (see row_reader), this returns a list
     with the information of interest in the cleaned_string format.
-    :param line: A list (from csv.reader object generated by YL log file)
+    :param line: A list of strings (one line of a YL log file, from row_reader)
     :param indices: The indices of the data of interest in the given line
+    :param converters: An optional list of converter functions (see get_converters),
+                       one for each index.  Values without a converter are passed
+                       to cleaned_string.
     :return: a list of values of interest.
     """
-    return [cleaned_string(x) for x in (line[y] for y in indices)]
+    if converters is None:
+        return [cleaned_string(x) for x in (line[y] for y in indices)]
+
+    values = [convert(line[y]) for convert, y in zip(converters, indices)]
+    if len(indices) > len(converters):
+        values.extend(cleaned_string(line[y]) for y in indices[len(converters):])
+    return values
 
 
-def tasks23_get_data(logReader, practice, task):
+def tasks23_get_data(logReader, practice, task, converters=None):
 
     """
     Reads practice and task data from log files for tasks 2 and 3 and stores
     the trial data in practice and task (both are lists).
 
-    :param logReader: a csv.reader object from YL log file
+    :param logReader: an iterator over the lines of a YL log file (see row_reader)
     :param practice: a (probably empty) list to store practice data
     :param task: a (probably empty) list to store task data
+    :param converters: an optional list of converters for the columns of each line (see get_values)
     :raise: raises a BadLineError when there is a line of unexpected format.
     """
 
@@ -159,7 +341,7 @@ def tasks23_get_data(logReader, practice, task):
         else:
             # Add the current line (as a list) to
             # the appropriate list of lines
-            currTrialType.append(get_values(line, range(1, len(line))))
+            currTrialType.append(get_values(line, range(1, len(line)), converters))
 
 
 def task_2_determine_switch(task):
@@ -246,12 +428,18 @@ def task3_determine_dot_order(task):
             task[i].append(1)
 
 
-def task1_get_data(logReader, practice, task):
+def task1_get_data(logReader, practice, task, converters=None):
     """
-    :param logReader:
-    :param practice:
-    :param task:
-    :return: None: task is modified in place
+    Reads practice and task data from log files for tasks 1 and 6 in a single
+    pass over the file.  Only the first line of each trial is kept.  Task trials
+    get an extra "Score-incorrect only" value, which is the trial's score if there
+    were any bad touches and the empty string otherwise.
+
+    :param logReader: an iterator over the lines of a YL task1 or task6 log file (see row_reader)
+    :param practice: a (probably empty) list to store practice data
+    :param task: a (probably empty) list to store task data
+    :param converters: an optional list of converters for the TrialNum, NumBadTouches and Score columns
+    :return: None: practice and task are modified in place
     """
     currTrialType = practice
     prevTrialNum = None
@@ -277,22 +465,28 @@ def task1_get_data(logReader, practice, task):
             # the appropriate list of lines
             currTrialNum = line[1]
             if currTrialNum != prevTrialNum:
-                currTrialType.append(get_values(line, (1, 6, 7)))
+                trial = get_values(line, (1, 6, 7), converters)
+
+                # Score-incorrect only: the score, counted only for
+                # trials that had at least one bad touch.
+                if currTrialType is task:
+                    if int(trial[1]) != 0:
+                        trial.append(trial[2])
+                    else:
+                        trial.append("")
+
+                currTrialType.append(trial)
                 prevTrialNum = currTrialNum
-        for trial in task:
-            if int(trial[1]) != 0:
-                trial.append(trial[2])
-            else:
-                trial.append("")
 
 
-def task4_get_data(logReader, practice, task):
+def task4_get_data(logReader, practice, task, converters=None):
     """
     Parses summary data for each block from the task4 YL log file.
 
-    :param logReader: a csv.reader object corresponding to a YL task4 log file
+    :param logReader: an iterator over the lines of a YL task4 log file (see row_reader)
     :param practice: a list to store data from practice trials.
     :param task: a list to store data from the actual task
+    :param converters: an optional list of converters for the values in each Block line
     :return: None.  practice and task lists are edited in place.
     """
     # practice_done variable will be set to true once
@@ -307,7 +501,7 @@ def task4_get_data(logReader, practice, task):
             # '32.28865', 'AvgResponseTime', '0.6529274']
             # which we will distill to [4, 91.43, 32.28865, 0.6529274]
 
-            task.append(get_values(line, (0, 2, 4, 6)))
+            task.append(get_values(line, (0, 2, 4, 6), converters))
 
             # Once a line with "Block" in the first column is encountered, set
             # practice_done to true.
@@ -323,23 +517,26 @@ def task4_get_data(logReader, practice, task):
             practice.append(line[1:])
 
 
-def task5_get_data(logReader, practice, task):
+def task5_get_data(logReader, practice, task, converters=None):
 
     """
     Parses data from YL task5 log file and stores practice and task data in separate lists, which are passed
     as arguments.
 
-    :param logReader: a csv.reader object generated from a YL task5 log file
+    :param logReader: an iterator over the lines of a YL task5 log file (see row_reader)
     :param practice: a (probably empty) list in which to store practice trial data
     :param task: a (probably empty) list in which to store actual trial data
+    :param converters: an optional list of converters for the values in each line
     """
     for line in logReader:
+        # Lines alternate between names and values, i.e., ['Task 1', 'EndCondition', 'completed', ...]
+        # Keep the trial number and the values.
         if "Practice" in line[0]:
-            practice.append(
-                [cleaned_string(x) for x in list([line[0].split()[1]] + [line[i] for i in range(2, len(line), 2)])])
+            values = [line[0].split()[1]] + line[2::2]
+            practice.append(get_values(values, range(len(values)), converters))
         elif "Task" in line[0]:
-            task.append(
-                [cleaned_string(x) for x in list([line[0].split()[1]] + [line[i] for i in range(2, len(line), 2)])])
+            values = [line[0].split()[1]] + line[2::2]
+            task.append(get_values(values, range(len(values)), converters))
 
 
 
@@ -1,7 +1,25 @@
 """
 A set of functions that take the output of the read_file functions
-and return a dictionary of summary statistics.
+and return a dictionary of summary statistics.  Each function reads the
+columns it needs straight from the TrialTable (see data_classes.py),
+rather than looking values up trial by trial.
 """
+from itertools import compress, izip
+
+# The names of the summary statistics returned by each of the
+# task-specific functions below.
+SUMMARY_FIELDS = {
+    'task1': ['T1_BadTouchesAllTrials', 'T1_BadTouchesFirst', 'T1_BadTouchesLast', 'T1_ScoreAllTrials',
+              'T1_ScoreFirst', 'T1_ScoreLast'],
+    'task2': ['T2_NonSwitchRuleAvgAccuracy', 'T2_NonSwitchRuleRT', 'T2_NonSwitchSideAvgAccuracy',
+              'T2_NonSwitchSideRT', 'T2_OppositeAccuracy', 'T2_OppositeRT', 'T2_SameAccuracy', 'T2_SameRT',
+              'T2_SwitchRuleAvgAccuracy', 'T2_SwitchRuleRT', 'T2_SwitchSideAvgAccuracy', 'T2_SwitchSideRT'],
+    'task3': ['T3_Delay0.1Distance', 'T3_Delay3Distance', 'T3_Load1Distance', 'T3_Load2Distance',
+              'T3_Load3Distance'],
+    'task4': ['T4_Block4RT', 'T4_Block5RT', 'T4_RandomRT', 'T4_RuleRT'],
+    'task5': ['T5_AvgDistancePerTarget', 'T5_NumBadTouches', 'T5_NumRepeats'],
+    'task6': ['T6_BadTouchesAllTrials', 'T6_BadTouchesFirst', 'T6_BadTouchesLast', 'T6_ScoreAllTrials',
+              'T6_ScoreFirst', 'T6_ScoreLast']}
 
 
 def mean(x):
@@ -18,27 +36,32 @@ def mean(x):
 
     # Calculate the mean of the new array the old-fashioned way
     if n_entries > 0:
-        average = float(sum([i for i in new_array]))/n_entries
+        average = float(sum(new_array))/n_entries
     else:  # If the array has no legitimate values, set the average to none
         average = None
 
     return average
 
 
-def get1(task_dict_list):
+def get_column(task_dict_list, header):
     """
-    :param task_dict_list: list of dictionaries output
-                           by read_file function
+    Returns a sequence with the value of the named field for each trial.
+    :param task_dict_list: a TrialTable, or a list of dictionaries
+    :param header: the name of a field, i.e., 'ReactionTime'
+    """
+    if hasattr(task_dict_list, 'column'):
+        return task_dict_list.column(header)
+    return [trial[header] for trial in task_dict_list]
 
-    :return a dictionary of summary summary statistics including
-            T1_BadTouchesAllTrials
-            T1_BadTouchesFirst
 
+def touch_summary(task_dict_list, prefix):
+    """
+    Summary statistics shared by tasks 1 and 6.  See get1 and get6.
     """
 
     # Calculate the average number of bad touches per trial
-    bad_touches = [x['NumBadTouches'] for x in task_dict_list]
-    scores = [x['Score-incorrect only'] for x in task_dict_list]
+    bad_touches = get_column(task_dict_list, 'NumBadTouches')
+    scores = get_column(task_dict_list, 'Score-incorrect only')
 
     # We should always have 12 trials, and be looking at the first
     # six trials versus the last six trials, but I've added this
@@ -57,8 +80,23 @@ def get1(task_dict_list):
     score_last = mean([score for score in scores[mid_point:] if score])
     score_total = mean([score for score in scores if score])
 
-    return {'T1_BadTouchesAllTrials': avg_total, 'T1_BadTouchesFirst': avg_first, 'T1_BadTouchesLast': avg_last,
-            'T1_ScoreFirst': score_first, 'T1_ScoreLast': score_last, 'T1_ScoreAllTrials': score_total}
+    return {prefix + '_BadTouchesAllTrials': avg_total, prefix + '_BadTouchesFirst': avg_first,
+            prefix + '_BadTouchesLast': avg_last, prefix + '_ScoreFirst': score_first,
+            prefix + '_ScoreLast': score_last, prefix + '_ScoreAllTrials': score_total}
+
+
+def get1(task_dict_list):
+    """
+    :param task_dict_list: list of dictionaries output
+                           by read_file function
+
+    :return a dictionary of summary summary statistics including
+            T1_BadTouchesAllTrials
+            T1_BadTouchesFirst
+
+    """
+
+    return touch_summary(task_dict_list, 'T1')
 
 
 def get2(task_dict_list):
@@ -75,31 +113,19 @@ def get2(task_dict_list):
     """
 
     ###############################################################
-    # Organize Trials into separate lists according to trial type #
+    # Mark which trials belong to each trial type.                #
     ###############################################################
 
-    non_switch_rule_trials = []
-    switch_rule_trials = []
-    non_switch_side_trials = []
-    switch_side_trials = []
-    same_trials = []
-    opposite_trials = []
-
-    for trial in task_dict_list:
-        if trial['SwitchRule'] is True:
-            switch_rule_trials.append(trial)
-        elif trial['SwitchRule'] is False:
-            non_switch_rule_trials.append(trial)
-
-        if trial['SwitchSide'] is True:
-            switch_side_trials.append(trial)
-        elif trial['SwitchSide'] is False:
-            non_switch_side_trials.append(trial)
-
-        if trial['TargetSide'] == "same":
-            same_trials.append(trial)
-        elif trial['TargetSide'] == "opposite":
-            opposite_trials.append(trial)
+    switch_rule = get_column(task_dict_list, 'SwitchRule')
+    switch_side = get_column(task_dict_list, 'SwitchSide')
+    target_side = get_column(task_dict_list, 'TargetSide')
+
+    trial_types = {'SwitchRule': [x is True for x in switch_rule],
+                   'NonSwitchRule': [x is False for x in switch_rule],
+                   'SwitchSide': [x is True for x in switch_side],
+                   'NonSwitchSide': [x is False for x in switch_side],
+                   'Same': [x == "same" for x in target_side],
+                   'Opposite': [x == "opposite" for x in target_side]}
 
     ###############################################################
     # Calculate summary statistics for the different trial types. #
@@ -107,25 +133,18 @@ def get2(task_dict_list):
     # data are not included in these calculations.                #
     ###############################################################
 
-    switch_rule_accuracy = mean([x['Correct'] for x in switch_rule_trials])
-    non_switch_rule_accuracy = mean([x['Correct'] for x in non_switch_rule_trials])
-    switch_side_accuracy = mean([x['Correct'] for x in switch_side_trials])
-    non_switch_side_accuracy = mean([x['Correct'] for x in non_switch_side_trials])
-    same_accuracy = mean([x['Correct'] for x in same_trials])
-    opposite_accuracy = mean([x['Correct'] for x in opposite_trials])
+    correct = get_column(task_dict_list, 'Correct')
+    reaction_time = get_column(task_dict_list, 'ReactionTime')
 
-    switch_rule_rt = mean([x['ReactionTime'] for x in switch_rule_trials])
-    non_switch_rule_rt = mean([x['ReactionTime'] for x in non_switch_rule_trials])
-    switch_side_rt = mean([x['ReactionTime'] for x in switch_side_trials])
-    non_switch_side_rt = mean([x['ReactionTime'] for x in non_switch_side_trials])
-    same_rt = mean([x['ReactionTime'] for x in same_trials])
-    opposite_rt = mean([x['ReactionTime'] for x in opposite_trials])
+    accuracy = dict((name, mean(compress(correct, mask))) for name, mask in trial_types.iteritems())
+    rt = dict((name, mean(compress(reaction_time, mask))) for name, mask in trial_types.iteritems())
 
-    return {'T2_SwitchRuleAvgAccuracy': switch_rule_accuracy, 'T2_NonSwitchRuleAvgAccuracy': non_switch_rule_accuracy,
-            'T2_SwitchSideAvgAccuracy': switch_side_accuracy, 'T2_NonSwitchSideAvgAccuracy': non_switch_side_accuracy,
-            'T2_SameAccuracy': same_accuracy, 'T2_OppositeAccuracy': opposite_accuracy, 'T2_SwitchRuleRT':
-            switch_rule_rt, 'T2_NonSwitchRuleRT': non_switch_rule_rt, 'T2_SwitchSideRT': switch_side_rt,
-            'T2_NonSwitchSideRT': non_switch_side_rt, 'T2_SameRT': same_rt, 'T2_OppositeRT': opposite_rt}
+    return {'T2_SwitchRuleAvgAccuracy': accuracy['SwitchRule'], 'T2_NonSwitchRuleAvgAccuracy':
+            accuracy['NonSwitchRule'], 'T2_SwitchSideAvgAccuracy': accuracy['SwitchSide'],
+            'T2_NonSwitchSideAvgAccuracy': accuracy['NonSwitchSide'], 'T2_SameAccuracy': accuracy['Same'],
+            'T2_OppositeAccuracy': accuracy['Opposite'], 'T2_SwitchRuleRT': rt['SwitchRule'],
+            'T2_NonSwitchRuleRT': rt['NonSwitchRule'], 'T2_SwitchSideRT': rt['SwitchSide'],
+            'T2_NonSwitchSideRT': rt['NonSwitchSide'], 'T2_SameRT': rt['Same'], 'T2_OppositeRT': rt['Opposite']}
 
 
 def get3(task_dict_list):
@@ -151,19 +170,17 @@ def get3(task_dict_list):
 
     """
 
+    # Build a list within which each trial is represented by a list,
+    # within which each dot has a (distance, delay) tuple
     trials = []
     trial_num = None
+    columns = [get_column(task_dict_list, header) for header in ('TrialNum', 'DistanceFromCenter', 'Delay')]
 
-    # Builds a list within which each trial is represented by a list,
-    # within which each dot has a (distance, delay tuple)
-    # TODO: This could be implemented more efficiently either as a dictionary or a different list structure
-    for trial in task_dict_list:
-        if trial['TrialNum'] == trial_num:
-            trials[-1].append((trial['DistanceFromCenter'], trial['Delay']))
-        else:
+    for dot_trial_num, distance, delay in izip(*columns):
+        if dot_trial_num != trial_num or not trials:
             trials.append([])
-            trial_num = trial['TrialNum']
-            trials[-1].append((trial['DistanceFromCenter'], trial['Delay']))
+            trial_num = dot_trial_num
+        trials[-1].append((distance, delay))
 
     # Now we have a list of lists of (distance, delay) tuples.
 
@@ -172,14 +189,14 @@ def get3(task_dict_list):
     for i in range(1, 4):
         load_means = [mean([dot[0] for dot in trial if dot[0]]) for trial in trials if len(trial) == i]
 
-        acc_by_load[i] = mean([x for x in load_means if x is not None])
+        acc_by_load[i] = mean(load_means)
 
     acc_by_delay = {}
     for delay in [0.1, 3]:
         delay_means = [mean([dot[0] for dot in trial if dot[0] is not None])
                        for trial in trials if trial[0][1] == delay]
 
-        acc_by_delay[delay] = mean([x for x in delay_means if x is not None])
+        acc_by_delay[delay] = mean(delay_means)
 
     return {'T3_Load1Distance': acc_by_load[1], 'T3_Load2Distance': acc_by_load[2], 'T3_Load3Distance': acc_by_load[3],
             'T3_Delay0.1Distance': acc_by_delay[0.1], 'T3_Delay3Distance': acc_by_delay[3]}
@@ -216,11 +233,14 @@ def get4(task_dict_list):
     rand_blocks = (1, 4)
     rule_blocks = (2, 3, 5)
 
-    random_mean = mean([block['AvgResponseTime'] for block in task_dict_list if block['Block'] in rand_blocks])
-    rule_mean = mean([block['AvgResponseTime'] for block in task_dict_list if block['Block'] in rule_blocks])
+    blocks = get_column(task_dict_list, 'Block')
+    response_times = get_column(task_dict_list, 'AvgResponseTime')
 
-    block4_mean = task_dict_list[3]['AvgResponseTime']
-    block5_mean = task_dict_list[4]['AvgResponseTime']
+    random_mean = mean([rt for block, rt in izip(blocks, response_times) if block in rand_blocks])
+    rule_mean = mean([rt for block, rt in izip(blocks, response_times) if block in rule_blocks])
+
+    block4_mean = response_times[3]
+    block5_mean = response_times[4]
 
     return {'T4_RandomRT': random_mean, 'T4_RuleRT': rule_mean, 'T4_Block4RT': block4_mean,
             'T4_Block5RT': block5_mean}
@@ -248,8 +268,8 @@ def get5(task_dict_list):
     """
 
 
-    values = map(mean, ([x['NumBadTouches'] for x in task_dict_list], [x['NumRepeats'] for x in task_dict_list],
-                           [x['AvgDistancePerTarget'] for x in task_dict_list]))
+    values = [mean(get_column(task_dict_list, header)) for header in
+              ('NumBadTouches', 'NumRepeats', 'AvgDistancePerTarget')]
     return zip(['T5_NumBadTouches', 'T5_NumRepeats', 'T5_AvgDistancePerTarget'], values)
 
 
@@ -260,26 +280,227 @@ def get6(task_dict_list):
 
     """
 
-    # Calculate the average number of bad touches per trial
-    bad_touches = [x['NumBadTouches'] for x in task_dict_list]
-    scores = [x['Score-incorrect only'] for x in task_dict_list]
+    return touch_summary(task_dict_list, 'T6')
 
-    # We should always have 12 trials, and be looking at the first
-    # six trials versus the last six trials, but I've added this
-    # midpoint variable in case for some reason there's a different
-    # number of trials.
-    mid_point = len(bad_touches) / 2
 
-    # Again, since there should be equal number of trials contributing
-    # to avg_first and average_last, avg_total could be computed by
-    # just doing mean([avg_first, avg_last]), but it's safer this way
-    avg_total = mean(bad_touches)
-    avg_first = mean(bad_touches[:mid_point])
-    avg_last = mean(bad_touches[mid_point:])
+# The function that summarizes each task
+SUMMARY_FUNCTIONS = {'task1': get1, 'task2': get2, 'task3': get3, 'task4': get4, 'task5': get5, 'task6': get6}
+
+
+# The columns each task's summary statistics are computed from
+SUMMARY_COLUMNS = {'task1': ('NumBadTouches', 'Score-incorrect only'),
+                   'task2': ('SwitchRule', 'SwitchSide', 'TargetSide', 'Correct', 'ReactionTime'),
+                   'task3': ('TrialNum', 'DistanceFromCenter', 'Delay'),
+                   'task4': ('Block', 'AvgResponseTime'),
+                   'task5': ('NumBadTouches', 'NumRepeats', 'AvgDistancePerTarget'),
+                   'task6': ('NumBadTouches', 'Score-incorrect only')}
+
+
+###############################################################
+# Batch versions of get1, ..., get6, which summarize many     #
+# log files at once.  Each takes a dictionary with one long   #
+# column per header in SUMMARY_COLUMNS, holding every file's  #
+# trials one after another, and a list of (start, end)        #
+# positions of each file's trials in those columns, and       #
+# returns a list of summaries, one per file, just as the      #
+# single-file function would have returned them.              #
+###############################################################
+
+def grouped_means(values, bounds):
+    """
+    Returns the mean (see mean) of each group of values, where bounds is a list of
+    (start, end) positions of the groups.
+    """
+    return [mean(values[start:end]) for start, end in bounds]
+
+
+def masked(values, mask):
+    """
+    Replaces the values where mask is False with None, so that they are left out of means.
+    """
+    return [value if keep else None for value, keep in izip(values, mask)]
+
+
+def by_group(fields):
+    """
+    Turns a dictionary of lists of values, one per group, into a list of dictionaries, one per group.
+    """
+    names = list(fields)
+    return [dict(izip(names, values)) for values in izip(*[fields[name] for name in names])]
+
+
+def batch_touch_summary(columns, bounds, prefix):
+    """
+    Batch version of touch_summary.
+    """
+    bad_touches = columns['NumBadTouches']
+    scores = [score if score else None for score in columns['Score-incorrect only']]
+    first_half = [(start, start + (end - start) / 2) for start, end in bounds]
+    last_half = [(start + (end - start) / 2, end) for start, end in bounds]
+
+    return by_group({prefix + '_BadTouchesAllTrials': grouped_means(bad_touches, bounds),
+                     prefix + '_BadTouchesFirst': grouped_means(bad_touches, first_half),
+                     prefix + '_BadTouchesLast': grouped_means(bad_touches, last_half),
+                     prefix + '_ScoreFirst': grouped_means(scores, first_half),
+                     prefix + '_ScoreLast': grouped_means(scores, last_half),
+                     prefix + '_ScoreAllTrials': grouped_means(scores, bounds)})
+
+
+def batch_get1(columns, bounds):
+    return batch_touch_summary(columns, bounds, 'T1')
 
-    score_first = mean([score for score in scores[:mid_point] if score])
-    score_last = mean([score for score in scores[mid_point:] if score])
-    score_total = mean([score for score in scores if score])
 
-    return {'T6_BadTouchesAllTrials': avg_total, 'T6_BadTouchesFirst': avg_first, 'T6_BadTouchesLast': avg_last,
-            "T6_ScoreFirst": score_first, "T6_ScoreLast": score_last, "T6_ScoreAllTrials": score_total}
+def batch_get2(columns, bounds):
+    """
+    Batch version of get2.
+    """
+    switch_rule = columns['SwitchRule']
+    switch_side = columns['SwitchSide']
+    target_side = columns['TargetSide']
+    trial_types = {'SwitchRule': [x is True for x in switch_rule],
+                   'NonSwitchRule': [x is False for x in switch_rule],
+                   'SwitchSide': [x is True for x in switch_side],
+                   'NonSwitchSide': [x is False for x in switch_side],
+                   'Same': [x == "same" for x in target_side],
+                   'Opposite': [x == "opposite" for x in target_side]}
+
+    fields = {}
+    for name, mask in trial_types.iteritems():
+        accuracy_name = 'T2_%sAvgAccuracy' % name if 'Switch' in name else 'T2_%sAccuracy' % name
+        fields[accuracy_name] = grouped_means(masked(columns['Correct'], mask), bounds)
+        fields['T2_%sRT' % name] = grouped_means(masked(columns['ReactionTime'], mask), bounds)
+    return by_group(fields)
+
+
+def batch_get3(columns, bounds):
+    """
+    Batch version of get3.  The dots are first grouped into trials, as in get3, and the
+    trials' mean distances are then grouped by file.
+    """
+    trial_nums = columns['TrialNum']
+    distances = columns['DistanceFromCenter']
+    delays = columns['Delay']
+
+    # Where each trial starts and ends, and which trials belong to each file
+    trial_bounds = []
+    file_trials = []
+    for start, end in bounds:
+        first_trial = len(trial_bounds)
+        for i in xrange(start, end):
+            if i == start or trial_nums[i] != trial_nums[i - 1]:
+                if len(trial_bounds) > first_trial:
+                    trial_bounds[-1] = (trial_bounds[-1][0], i)
+                trial_bounds.append((i, end))
+        file_trials.append((first_trial, len(trial_bounds)))
+
+    sizes = [end - start for start, end in trial_bounds]
+    first_delays = [delays[start] for start, end in trial_bounds]
+    load_means = [mean([distance for distance in distances[start:end] if distance]) for start, end in trial_bounds]
+    delay_means = grouped_means(distances, trial_bounds)
+
+    fields = {}
+    for load in range(1, 4):
+        fields['T3_Load%dDistance' % load] = grouped_means(masked(load_means, [size == load for size in sizes]),
+                                                           file_trials)
+    for delay in [0.1, 3]:
+        fields['T3_Delay%sDistance' % delay] = grouped_means(
+            masked(delay_means, [first_delay == delay for first_delay in first_delays]), file_trials)
+    return by_group(fields)
+
+
+def batch_get4(columns, bounds):
+    """
+    Batch version of get4.
+    """
+    rand_blocks = (1, 4)
+    rule_blocks = (2, 3, 5)
+
+    blocks = columns['Block']
+    response_times = columns['AvgResponseTime']
+
+    def block_rt(n):
+        # The n-th block's response time for each file, which, as in get4, has to be there
+        if any(start + n >= end for start, end in bounds):
+            raise IndexError("a task 4 log file has fewer than %d blocks" % (n + 1))
+        return [response_times[start + n] for start, end in bounds]
+
+    return by_group({'T4_RandomRT': grouped_means(masked(response_times, [b in rand_blocks for b in blocks]), bounds),
+                     'T4_RuleRT': grouped_means(masked(response_times, [b in rule_blocks for b in blocks]), bounds),
+                     'T4_Block4RT': block_rt(3), 'T4_Block5RT': block_rt(4)})
+
+
+def batch_get5(columns, bounds):
+    """
+    Batch version of get5, whose summaries are lists of (name, value) pairs.
+    """
+    names = ['T5_NumBadTouches', 'T5_NumRepeats', 'T5_AvgDistancePerTarget']
+    values = [grouped_means(columns[header], bounds) for header in
+              ('NumBadTouches', 'NumRepeats', 'AvgDistancePerTarget')]
+    return [zip(names, file_values) for file_values in izip(*values)]
+
+
+def batch_get6(columns, bounds):
+    return batch_touch_summary(columns, bounds, 'T6')
+
+
+# The function that summarizes each task for many files at once
+BATCH_FUNCTIONS = {'task1': batch_get1, 'task2': batch_get2, 'task3': batch_get3, 'task4': batch_get4,
+                   'task5': batch_get5, 'task6': batch_get6}
+
+
+def summarize_cohort(subjects, tasks=None):
+    """
+    Recomputes the summary data for every subject from the stored
+    trial-by-trial data, without going back to the log files.  This is what
+    to use after changing how a task is summarized (say, the block numbers
+    in get4).
+
+    The whole cohort is summarized at once: a Database is read in a single
+    pass (see Database.subjects), every subject's trials for a task are
+    lined up in one set of columns, and each task's statistics are computed
+    over those columns, grouped by subject (see BATCH_FUNCTIONS).
+
+    :param subjects: a Database (see database.py) or a dictionary mapping subject keys to
+                     Subject instances, i.e., the subjects dictionary in build_database.py.
+                     In a Database, only the summaries of the re-summarized tasks are
+                     rewritten, and the changes are committed once every subject is done.
+    :param tasks: an optional list of the tasks to re-summarize, i.e., ['task4'].  By
+                  default, all tasks are re-summarized.
+    :return: a dictionary mapping subject keys to their full (all-task) summaries
+    """
+    tasks = tasks or sorted(BATCH_FUNCTIONS)
+    in_database = hasattr(subjects, 'put_summary')
+    if in_database:
+        cohort = subjects.subjects()
+    else:
+        cohort = (subjects[key] for key in sorted(subjects))
+
+    # Line up every subject's trials for each task, noting where each subject's start and end
+    columns = dict((task, dict((header, []) for header in SUMMARY_COLUMNS[task])) for task in tasks)
+    bounds = dict((task, []) for task in tasks)
+    data_files = dict((task, []) for task in tasks)
+    cohort_subjects = []
+    for subject in cohort:
+        for task in tasks:
+            if task in subject.data:
+                task_columns = columns[task]
+                start = len(task_columns[SUMMARY_COLUMNS[task][0]])
+                for header in SUMMARY_COLUMNS[task]:
+                    task_columns[header].extend(get_column(subject.data[task].trial_by_trial, header))
+                bounds[task].append((start, len(task_columns[SUMMARY_COLUMNS[task][0]])))
+                data_files[task].append((subject.key, subject.data[task]))
+        if in_database:  # Only the summaries are needed from here on
+            for data_file in subject.data.values():
+                data_file.practice = data_file.trial_by_trial = None
+        cohort_subjects.append(subject)
+
+    for task in tasks:
+        summaries = BATCH_FUNCTIONS[task](columns.pop(task), bounds[task])
+        for (key, data_file), summary in izip(data_files[task], summaries):
+            data_file.summary = summary
+            if in_database:
+                subjects.put_summary(key, task, summary)
+
+    if in_database:
+        subjects.commit()
+    return dict((subject.key, subject.summarize_data()) for subject in cohort_subjects)
@@ -0,0 +1,67 @@
+"""
+Checks that parsing a task1 or task6 log file takes time in proportion to
+its length.  These files used to be post-processed by a loop over every
+trial read so far, once per line, so the time per trial grew with the
+number of trials.  The synthetic files are the same as benchmark.py's
+(see benchmark.py --scaling for the timings themselves).  Run with:
+
+python -m unittest test_parser_scaling
+"""
+
+import random
+import StringIO
+import time
+import unittest
+
+import benchmark
+import data_classes as dat
+import parser_functions
+
+# Trial counts to compare.  A quadratic parser takes 16 times as long per trial
+# on the larger file, so allowing up to 3 times as long leaves room for noise.
+SMALL, LARGE = 100, 1600
+MAX_RATIO = 3.0
+
+
+def time_per_trial(task, n_trials, repeats=5):
+    """
+    Returns the best time out of several, in seconds per trial, taken to parse a
+    synthetic log file with n_trials task trials, along with the number of trials read.
+    """
+    headers = dat.DataFile()
+    headers.task = task
+    headers.set_task_headers()
+    headers.set_practice_headers()
+    log_file = StringIO.StringIO()
+    benchmark.write_log_file(task, log_file, random.Random(0), n_trials)
+    contents = log_file.getvalue()
+
+    best = None
+    for i in range(repeats):
+        start = time.time()
+        practice, trials = parser_functions.read_log_file(task, StringIO.StringIO(contents),
+                                                          headers.task_headers, headers.practice_headers)
+        seconds = time.time() - start
+        best = seconds if best is None else min(best, seconds)
+    return best / n_trials, len(trials)
+
+
+class ParserScalingTest(unittest.TestCase):
+
+    def check_scaling(self, task):
+        small, n_small = time_per_trial(task, SMALL)
+        large, n_large = time_per_trial(task, LARGE)
+        self.assertEqual((n_small, n_large), (SMALL, LARGE))
+        self.assertLess(large, small * MAX_RATIO,
+                        "%s: %.1fus per trial for %d trials, but %.1fus for %d" %
+                        (task, small * 1e6, SMALL, large * 1e6, LARGE))
+
+    def test_task1(self):
+        self.check_scaling('task1')
+
+    def test_task6(self):
+        self.check_scaling('task6')
+
+
+if __name__ == '__main__':
+    unittest.main()
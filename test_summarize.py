@@ -0,0 +1,102 @@
+"""
+Checks each of the task summary functions in summarize.py against known
+output.  The expected values were worked out by the original, trial by
+trial versions of get1, ..., get6 (which read lists of dictionaries) from
+the same trials, so these tests catch any change in the summary statistics
+written to the summary file.  The batch versions used by summarize_cohort
+are checked against the same values.  Run with:
+
+python -m unittest test_summarize
+"""
+
+import unittest
+
+import data_classes as dat
+import summarize
+
+# Trial-by-trial data for each task, as (headers, rows), with the kinds of gaps that
+# turn up in real log files: missing values, zero scores, and trials of each type.
+TRIALS = {
+    'task1': (['NumBadTouches', 'Score-incorrect only'],
+              [[0, 2], [1, 0], [3, 1], [0, None], [2, 4], [1, 3],
+               [0, 1], [4, 2], [2, 0], [1, 5], [0, 2], [3, 1]]),
+    'task2': (['SwitchRule', 'SwitchSide', 'TargetSide', 'Correct', 'ReactionTime'],
+              [[None, None, 'same', True, 0.612],
+               [True, False, 'same', True, 0.534],
+               [False, True, 'opposite', False, 0.901],
+               [True, True, 'opposite', True, 0.777],
+               [False, False, 'same', False, 1.203],
+               [True, False, 'opposite', True, None],
+               [False, True, 'same', True, 0.458],
+               [True, True, 'same', None, 0.699]]),
+    'task3': (['TrialNum', 'DistanceFromCenter', 'Delay'],
+              [[1, 12.5, 0.1],
+               [2, 30.25, 3], [2, 8.0, 3],
+               [3, 14.0, 0.1], [3, None, 0.1], [3, 22.75, 0.1],
+               [4, 0.0, 3],
+               [5, 40.5, 0.1], [5, 18.125, 0.1],
+               [6, 9.75, 3], [6, 11.0, 3], [6, 5.5, 3]]),
+    'task4': (['Block', 'AvgResponseTime'],
+              [[1, 0.645187], [2, 0.5908622], [3, 0.6249163], [4, 0.6071847], [5, 0.5916294]]),
+    'task5': (['NumBadTouches', 'NumRepeats', 'AvgDistancePerTarget'],
+              [[2, 0, 170.9032], [5, 1, 155.25], [0, 3, None], [1, 0, 201.5]]),
+    'task6': (['NumBadTouches', 'Score-incorrect only'],
+              [[1, 3], [0, 2], [2, 2], [0, 1], [5, 0], [1, 4],
+               [2, 2], [0, 3], [1, 1], [3, None], [0, 2], [1, 3]]),
+}
+
+# What the original summary functions returned for TRIALS
+EXPECTED = {
+    'task1': {'T1_BadTouchesAllTrials': 1.4166666666666667, 'T1_BadTouchesFirst': 1.1666666666666667,
+              'T1_BadTouchesLast': 1.6666666666666667, 'T1_ScoreAllTrials': 2.3333333333333335,
+              'T1_ScoreFirst': 2.5, 'T1_ScoreLast': 2.2},
+    'task2': {'T2_NonSwitchRuleAvgAccuracy': 0.3333333333333333, 'T2_NonSwitchRuleRT': 0.8540000000000001,
+              'T2_NonSwitchSideAvgAccuracy': 0.6666666666666666, 'T2_NonSwitchSideRT': 0.8685,
+              'T2_OppositeAccuracy': 0.6666666666666666, 'T2_OppositeRT': 0.839, 'T2_SameAccuracy': 0.75,
+              'T2_SameRT': 0.7012, 'T2_SwitchRuleAvgAccuracy': 1.0, 'T2_SwitchRuleRT': 0.6699999999999999,
+              'T2_SwitchSideAvgAccuracy': 0.6666666666666666, 'T2_SwitchSideRT': 0.70875},
+    'task3': {'T3_Delay0.1Distance': 20.0625, 'T3_Delay3Distance': 9.291666666666666, 'T3_Load1Distance': 12.5,
+              'T3_Load2Distance': 24.21875, 'T3_Load3Distance': 13.5625},
+    'task4': {'T4_Block4RT': 0.6071847, 'T4_Block5RT': 0.5916294, 'T4_RandomRT': 0.6261858499999999,
+              'T4_RuleRT': 0.6024693},
+    'task5': {'T5_AvgDistancePerTarget': 175.8844, 'T5_NumBadTouches': 2.0, 'T5_NumRepeats': 1.0},
+    'task6': {'T6_BadTouchesAllTrials': 1.3333333333333333, 'T6_BadTouchesFirst': 1.5,
+              'T6_BadTouchesLast': 1.1666666666666667, 'T6_ScoreAllTrials': 2.3, 'T6_ScoreFirst': 2.4,
+              'T6_ScoreLast': 2.2},
+}
+
+
+class SummaryFunctionTest(unittest.TestCase):
+
+    def check_summary(self, task, trials):
+        summary = dict(summarize.SUMMARY_FUNCTIONS[task](trials))
+        self.assertEqual(sorted(summary), sorted(EXPECTED[task]))
+        self.assertEqual(sorted(summary), summarize.SUMMARY_FIELDS[task])
+        for field, value in EXPECTED[task].iteritems():
+            self.assertAlmostEqual(summary[field], value, places=12, msg=field)
+
+    def test_trial_tables(self):
+        for task, (headers, rows) in sorted(TRIALS.items()):
+            self.check_summary(task, dat.TrialTable(headers, rows))
+
+    def test_batch_functions(self):
+        # Each task's trials twice over, as if from two log files, and summarized at once
+        for task, (headers, rows) in sorted(TRIALS.items()):
+            table = dat.TrialTable(headers, rows)
+            columns = dict((header, list(table.column(header)) * 2) for header in summarize.SUMMARY_COLUMNS[task])
+            summaries = summarize.BATCH_FUNCTIONS[task](columns, [(0, len(rows)), (len(rows), 2 * len(rows))])
+            self.assertEqual(len(summaries), 2)
+            for summary in summaries:
+                summary = dict(summary)
+                self.assertEqual(sorted(summary), summarize.SUMMARY_FIELDS[task])
+                for field, value in EXPECTED[task].iteritems():
+                    self.assertAlmostEqual(summary[field], value, places=12, msg=field)
+
+    def test_lists_of_dictionaries(self):
+        # As stored in databases written by older versions
+        for task, (headers, rows) in sorted(TRIALS.items()):
+            self.check_summary(task, [dict(zip(headers, row)) for row in rows])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,127 @@
+"""
+The FolderWatcher class, which keeps an eye on folders of log files as they
+are synced from the field, is defined here (see build_database.watch).
+
+Folders are polled rather than rescanned: a folder is only listed again when
+its modification time changes, i.e., when a file has been added to it,
+removed or renamed, and only files that haven't been seen before are looked
+at.  A new file is only handed on once it is complete, that is, once its
+size and modification time have stayed the same for settle_time seconds,
+so a file that is still being copied in isn't parsed half-written.  The
+same goes for archives of log files (see archives.py): once an archive is
+complete, the files inside it are handed on.
+Example:
+
+watcher = FolderWatcher(["YL_DATA_PERU"])
+while True:
+    log_files, bad_files = watcher.poll()
+    ...
+    time.sleep(2)
+"""
+
+import os
+import time
+
+import archives
+import data_classes as dat
+import exception_classes as e
+import ingest
+
+
+class FolderWatcher:
+    """
+    Finds complete log files that have appeared in a set of folders since they were
+    last polled.
+    """
+
+    def __init__(self, log_folders, known_files=(), settle_time=2.0):
+        """
+        :param log_folders: a list of paths to folders of log files
+        :param known_files: absolute paths of files that have already been dealt with
+                            (i.e., the keys of the manifest), which are never handed on
+        :param settle_time: how many seconds a file's size and modification time have
+                            to stay the same before it is considered complete
+        """
+        self.log_folders = [os.path.abspath(folder) for folder in log_folders]
+        self.known_files = set(known_files)
+        self.settle_time = settle_time
+        self.folder_mtimes = {}  # The modification time of each folder when it was last listed
+        self.candidates = {}     # For each new file, its (size, mtime) and when it was first seen with them
+
+    def poll(self):
+        """
+        Lists any folders that have changed and checks on the new files found so far.
+
+        :return: a tuple, (log_files, bad_files), where log_files is a list of paths to new
+                 files that are complete, sorted by subject key, task and path, and bad_files
+                 is a list of (path, error) tuples, one for each new file whose name doesn't
+                 follow the naming convention (see ingest.scan_log_folders).  Each file is
+                 only returned once.
+        """
+        now = time.time()
+        bad_files = []
+
+        for log_folder in self.log_folders:
+            try:
+                mtime = os.stat(log_folder).st_mtime
+            except OSError:
+                continue  # The folder may be unavailable for a while, i.e., on a network drive
+
+            # Folder times can be coarse, so a folder that changed very recently is listed again
+            if self.folder_mtimes.get(log_folder) == mtime and now - mtime > self.settle_time:
+                continue
+            self.folder_mtimes[log_folder] = mtime
+
+            for log_file in ingest.list_folder(log_folder):
+                if log_file in self.known_files or log_file in self.candidates:
+                    continue
+                if archives.archive_kind(log_file) is None and not self.check_name(log_file, bad_files):
+                    continue
+                self.candidates[log_file] = None
+
+        planned = []
+        for log_file in self.candidates.keys():
+            try:
+                stat = os.stat(log_file)
+            except OSError:
+                del self.candidates[log_file]  # Removed or renamed before it was complete
+                continue
+
+            signature = (stat.st_size, stat.st_mtime)
+            seen = self.candidates[log_file]
+            if seen is None or seen[0] != signature:
+                self.candidates[log_file] = (signature, now)
+            elif stat.st_size > 0 and now - seen[1] >= self.settle_time:
+                del self.candidates[log_file]
+                self.known_files.add(log_file)
+                if archives.archive_kind(log_file) is None:
+                    new_files = [log_file]
+                else:
+                    try:
+                        new_files = [path for path in archives.list_paths(log_file)
+                                     if path not in self.known_files and self.check_name(path, bad_files)]
+                    except archives.ARCHIVE_ERRORS as err:
+                        bad_files.append((log_file, str(err)))
+                        continue
+                for new_file in new_files:
+                    name_data = ingest.read_file_name(new_file)
+                    planned.append((name_data.key, name_data.task, new_file))
+
+        planned.sort()
+        bad_files.sort()
+        return [log_file for key, task, log_file in planned], bad_files
+
+    def check_name(self, log_file, bad_files):
+        """
+        Checks a new file's name against the naming convention.  If it doesn't follow it,
+        (log_file, error) is added to bad_files and the file is ignored from then on.
+
+        :return: True if the name is fine
+        """
+        try:
+            dat.DataFile().parse_file_name(os.path.basename(log_file))
+        except (e.BadFileNameError, ValueError) as err:
+            bad_files.append((log_file, str(err)))
+            self.known_files.add(log_file)
+            return False
+        return True